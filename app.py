@@ -1,6 +1,7 @@
 import os
 import logging
 import sys
+import multiprocessing
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -74,6 +75,14 @@ with app.app_context():
     import models
     db.create_all()
     
+    # create_all() never alters existing tables; add columns and unique constraints introduced since
+    from utils.schema import add_missing_columns, add_missing_unique_constraints
+    from services.conversation_service import merge_duplicate_conversations
+    add_missing_columns(db)
+    add_missing_unique_constraints(db, before_create={
+        'uq_conversation_bot_chat': merge_duplicate_conversations
+    })
+    
     # Create admin user if doesn't exist
     from models import User, SubscriptionType
     from werkzeug.security import generate_password_hash
@@ -92,3 +101,14 @@ with app.app_context():
         db.session.add(admin_user)
         db.session.commit()
         logging.info(f"Admin user created with email: {admin_email}")
+
+# Background work owned by this process; spawned helper processes (which
+# re-import the main module) only run the task they were given
+if multiprocessing.parent_process() is None:
+    from services.ingestion_service import get_ingestion_service
+    get_ingestion_service(app).start_recovery()
+
+    # Drain the webhook queue from the start, including updates left from before a restart
+    from services.update_worker import embedded_workers_enabled, get_worker_pool
+    if embedded_workers_enabled():
+        get_worker_pool(app)
@@ -0,0 +1,124 @@
+import os
+import re
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app as flask_app, db
+from services.dedup_service import update_deduplicator
+from services.webhook_ingest import accept_update
+from utils import metrics
+
+WEBHOOK_PATH = re.compile(r'^/telegram/webhook/(\d+)/?$')
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class TelegramWebhookASGI:
+    """
+    ASGI endpoint for /telegram/webhook/<bot_id>.
+
+    Runs the same validation, deduplication and queueing as the Flask route,
+    but awaits the database work on a bounded thread pool, so requests
+    waiting for the database wait on the event loop rather than each holding
+    a thread (see benchmarks/webhook_benchmark.py). Serve with any ASGI
+    server, e.g. `uvicorn asgi:app --workers 4`; everything else stays on
+    the Flask app.
+    """
+
+    def __init__(self, flask_app, db_threads: int = None):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(
+            max_workers=db_threads or int(os.environ.get("ASGI_DB_THREADS", 32)),
+            thread_name_prefix='asgi-db'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            return
+
+        match = WEBHOOK_PATH.match(scope['path'])
+        if not match:
+            await self._respond(send, 404)
+            return
+
+        if scope['method'] != 'POST':
+            await self._respond(send, 405)
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            await self._respond(send, 413)
+            return
+
+        try:
+            update_data = json.loads(body) if body else None
+        except ValueError:
+            update_data = None
+
+        bot_id = int(match.group(1))
+        metrics.increment('asgi.webhook_requests')
+
+        # Redeliveries this process already accepted are answered without a thread hop
+        if isinstance(update_data, dict) and update_data.get('update_id') is not None \
+                and update_deduplicator.is_known(bot_id, update_data['update_id']):
+            await self._respond(send, 200)
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            status = await loop.run_in_executor(self.executor, self._accept, bot_id, update_data)
+        except Exception as e:
+            logging.error(f"ASGI webhook error for bot {bot_id}: {e}")
+            status = 500
+
+        await self._respond(send, status)
+
+    def _accept(self, bot_id: int, update_data) -> int:
+        with self.flask_app.app_context():
+            try:
+                return accept_update(self.flask_app, bot_id, update_data)
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return b''
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    async def _respond(send, status: int):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', b'0')]
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = TelegramWebhookASGI(flask_app)
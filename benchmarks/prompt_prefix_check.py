@@ -0,0 +1,77 @@
+"""
+Check that a bot's prompt prefix is compiled once and reused.
+
+AIService is driven against a fake Gemini client that records the config of
+every generate call; no API key is needed. Every request to a bot must carry
+the same system instruction, so Gemini's implicit prefix caching applies.
+
+    python benchmarks/prompt_prefix_check.py --messages 200
+"""
+import os
+import sys
+import time
+import argparse
+from types import SimpleNamespace
+
+os.environ['RESPONSE_CACHE_ENABLED'] = '0'
+# The real client is replaced before any call; it only needs a key to construct
+os.environ.setdefault('GOOGLE_GENAI_API_KEY', 'fake')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ai_service import AIService  # noqa: E402
+from utils import metrics  # noqa: E402
+
+
+class FakeModels:
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, model, contents, config):
+        self.calls.append((contents, config))
+        return SimpleNamespace(text="ok")
+
+
+class FakeClient:
+    def __init__(self):
+        self.models = FakeModels()
+
+
+def run(service: AIService, bot, system_prompt: str, messages: int) -> float:
+    started = time.perf_counter()
+    for i in range(messages):
+        service.generate_response(f"Question number {i}?", [f"Knowledge chunk {i}."], system_prompt,
+                                  budget=16000, bot=bot)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+
+    client = FakeClient()
+    service = AIService()
+    service.client = client
+
+    bot = SimpleNamespace(id=1, config_version=1, kb_version=1)
+    persona = "You are the assistant of a furniture store. Answer politely and briefly. " * 20
+
+    elapsed = run(service, bot, persona, args.messages)
+    instructions = {config.system_instruction for _, config in client.models.calls}
+    assert len(instructions) == 1, len(instructions)
+    for contents, config in client.models.calls:
+        assert persona.strip()[:64] not in str(contents)
+    assert metrics.snapshot('prompt.').get('prompt.prefix_misses') == 1
+    print(f"v1: {args.messages} messages, 1 compile, "
+          f"{elapsed / args.messages * 1000:.3f} ms per message")
+
+    # A settings change compiles the new prefix once
+    bot.config_version = 2
+    client.models.calls.clear()
+    run(service, bot, persona + "Always mention free delivery.", args.messages)
+    instructions_v2 = {config.system_instruction for _, config in client.models.calls}
+    assert len(instructions_v2) == 1 and instructions_v2 != instructions
+    assert metrics.snapshot('prompt.').get('prompt.prefix_misses') == 2
+
+    print(metrics.snapshot('prompt.prefix'))
+    print("prefix reuse OK")
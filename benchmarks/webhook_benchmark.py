@@ -0,0 +1,114 @@
+"""
+Compare webhook ingestion throughput of the Flask route and the ASGI endpoint.
+
+Both are driven in-process (Flask test client on a thread pool, ASGI app
+called directly on an event loop) against a throwaway SQLite database, with
+the embedded update workers disabled so only ingestion is measured.
+
+    python benchmarks/webhook_benchmark.py --requests 2000 --concurrency 200
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+_db_dir = tempfile.mkdtemp(prefix='webhook-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+os.environ['WEBHOOK_EMBEDDED_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db  # noqa: E402
+from models import Bot, User  # noqa: E402
+from asgi import app as asgi_app  # noqa: E402
+
+
+def make_bot() -> int:
+    with app.app_context():
+        bot = Bot()
+        bot.name = 'Benchmark bot'
+        bot.telegram_token = '123456789:' + 'x' * 35
+        bot.user_id = User.query.first().id
+        db.session.add(bot)
+        db.session.commit()
+        return bot.id
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'chat': {'id': 1000 + update_id % 500},
+            'from': {'id': 1000 + update_id % 500},
+            'text': 'What are your opening hours?'
+        }
+    }
+
+
+def report(name: str, latencies: list, elapsed: float) -> None:
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:>6}: {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50 {statistics.median(latencies) * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms")
+
+
+def bench_flask(bot_id: int, requests: int, concurrency: int, first_update_id: int) -> None:
+    client = app.test_client()
+    url = f'/telegram/webhook/{bot_id}'
+
+    def post(update_id):
+        started = time.perf_counter()
+        response = client.post(url, data=json.dumps(make_update(update_id)), content_type='application/json')
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(post, range(first_update_id, first_update_id + requests)))
+    report('flask', latencies, time.perf_counter() - started)
+
+
+def bench_asgi(bot_id: int, requests: int, concurrency: int, first_update_id: int) -> None:
+    path = f'/telegram/webhook/{bot_id}'
+
+    async def post(update_id, semaphore):
+        body = json.dumps(make_update(update_id)).encode()
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        async with semaphore:
+            started = time.perf_counter()
+            await asgi_app({'type': 'http', 'method': 'POST', 'path': path}, receive, send)
+            assert sent[0]['status'] == 200, sent[0]['status']
+            return time.perf_counter() - started
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[
+            post(update_id, semaphore) for update_id in range(first_update_id, first_update_id + requests)
+        ])
+
+    started = time.perf_counter()
+    latencies = list(asyncio.run(run()))
+    report('asgi', latencies, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+
+    bot_id = make_bot()
+    bench_flask(bot_id, args.requests, args.concurrency, first_update_id=1)
+    bench_asgi(bot_id, args.requests, args.concurrency, first_update_id=args.requests + 1)
@@ -64,6 +64,9 @@ class BotSettingsForm(FlaskForm):
     system_prompt = TextAreaField('System Prompt', validators=[Optional(), Length(max=2000)])
     temperature = FloatField('Temperature', validators=[Optional(), NumberRange(min=0, max=2)])
     max_tokens = IntegerField('Max Tokens', validators=[Optional(), NumberRange(min=1, max=4000)])
+    retrieval_strategy = SelectField('Knowledge Search', choices=[
+        ('bm25', 'Keyword (BM25)'), ('embedding', 'Semantic (embeddings)'), ('hybrid', 'Hybrid')
+    ], default='bm25')
     is_active = BooleanField('Bot Active')
     submit = SubmitField('Update Bot')
 
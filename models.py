@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 from app import db
 from flask_login import UserMixin
-from sqlalchemy import Text, JSON
+from sqlalchemy import Text, JSON, func, inspect
 import enum
 
 class SubscriptionType(enum.Enum):
@@ -60,12 +60,18 @@ class Bot(db.Model):
     # Bot configuration
     telegram_token = db.Column(db.String(255))
     telegram_webhook_url = db.Column(db.String(255))
+    telegram_update_offset = db.Column(db.BigInteger)  # next getUpdates offset when long polling
     is_active = db.Column(db.Boolean, default=True)
     
     # AI configuration
     system_prompt = db.Column(Text, default="You are a helpful assistant.")
     temperature = db.Column(db.Float, default=0.7)
     max_tokens = db.Column(db.Integer, default=1000)
+    retrieval_strategy = db.Column(db.String(20), default='bm25')  # 'bm25', 'embedding' or 'hybrid'
+    
+    # Bumped on every settings / knowledge base change so cached copies can revalidate cheaply
+    config_version = db.Column(db.Integer, nullable=False, default=1)
+    kb_version = db.Column(db.Integer, nullable=False, default=1)
     
     # Owner reference
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -78,12 +84,30 @@ class Bot(db.Model):
     knowledge_base = db.relationship('KnowledgeBase', backref='bot', lazy=True, cascade='all, delete-orphan')
     conversations = db.relationship('Conversation', backref='bot', lazy=True)
     analytics = db.relationship('Analytics', backref='bot', lazy=True)
+    
+    def bump_config_version(self):
+        self._bump('config_version')
+    
+    def bump_kb_version(self):
+        self._bump('kb_version')
+    
+    def _bump(self, column):
+        """
+        Increment a version in the UPDATE itself, so concurrent bumps never
+        write the same number; the new value is loaded on next access after
+        the flush
+        """
+        if inspect(self).persistent:
+            setattr(self, column, func.coalesce(getattr(Bot, column), 1) + 1)
+        else:
+            setattr(self, column, (getattr(self, column) or 1) + 1)
 
 class KnowledgeBase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(Text, nullable=False)
     file_type = db.Column(db.String(50))  # 'text', 'pdf', 'url', etc.
+    content_hash = db.Column(db.String(40), index=True)  # of the normalized text, for exact duplicates
     
     # Bot reference
     bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False)
@@ -91,8 +115,44 @@ class KnowledgeBase(db.Model):
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    chunks = db.relationship('KnowledgeChunk', backref='knowledge_base', lazy=True,
+                             cascade='all, delete-orphan', order_by='KnowledgeChunk.position')
+    ingestion_jobs = db.relationship('IngestionJob', backref='knowledge_base', lazy=True)
+
+class KnowledgeChunk(db.Model):
+    """
+    Overlapping slice of a knowledge base item, with token statistics precomputed at ingest
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    position = db.Column(db.Integer, nullable=False)
+    content = db.Column(Text, nullable=False)
+    
+    # Token statistics used for retrieval scoring
+    tokens = db.Column(Text)  # normalized token stream, space separated
+    normalizer_version = db.Column(db.Integer)
+    token_count = db.Column(db.Integer, nullable=False, default=0)
+    term_freqs = db.Column(JSON, nullable=False, default=dict)
+    embedding = db.Column(db.LargeBinary)  # float32 hashed n-gram vector
+    
+    # Duplicate detection; duplicates are kept but left out of every index
+    content_hash = db.Column(db.String(40))
+    minhash = db.Column(db.LargeBinary)  # uint32 MinHash signature of word 3-grams
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('knowledge_chunk.id', ondelete='SET NULL'), index=True)
+    
+    # References
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'), nullable=False, index=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False, index=True)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Conversation(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('bot_id', 'telegram_chat_id', name='uq_conversation_bot_chat'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     telegram_chat_id = db.Column(db.String(100))
     telegram_user_id = db.Column(db.String(100))
@@ -105,6 +165,10 @@ class Conversation(db.Model):
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Rolling summary of the turns older than the verbatim window (see ConversationMemory)
+    summary = db.Column(Text)
+    summary_through_id = db.Column(db.Integer)  # last Message.id folded into the summary
+    
     # Relationships
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
 
@@ -115,7 +179,7 @@ class Message(db.Model):
     telegram_message_id = db.Column(db.String(100))
     
     # Conversation reference
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -168,3 +232,69 @@ class BroadcastLog(db.Model):
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class WebhookUpdate(db.Model):
+    """
+    Durable queue of incoming Telegram updates, drained by the update workers
+    """
+    __table_args__ = (
+        db.Index('ix_webhook_update_status_id', 'status', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    update_id = db.Column(db.BigInteger)
+    chat_id = db.Column(db.String(100))
+    payload = db.Column(JSON, nullable=False)
+
+    # Bot reference
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False)
+
+    # Processing state: 'pending', 'processing', 'done' or 'failed'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(Text)
+    claimed_by = db.Column(db.String(64))
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    processed_at = db.Column(db.DateTime)
+
+class ProcessedUpdate(db.Model):
+    """
+    Telegram update ids already accepted, shared by all workers for deduplication
+    """
+    __table_args__ = (
+        db.UniqueConstraint('bot_id', 'update_id', name='uq_processed_update_bot_update'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False)
+    update_id = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class IngestionJob(db.Model):
+    """
+    Background extraction and indexing of an uploaded knowledge base file
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(50), nullable=False)
+    source_path = db.Column(db.String(500))  # uploaded file, removed once processed
+
+    # References; the knowledge base item is removed if ingestion fails
+    bot_id = db.Column(db.Integer, db.ForeignKey('bot.id'), nullable=False, index=True)
+    knowledge_base_id = db.Column(db.Integer, db.ForeignKey('knowledge_base.id'))
+
+    # Processing state: 'pending', 'running', 'done' or 'failed'
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    chunks_indexed = db.Column(db.Integer, nullable=False, default=0)
+    duplicate_chunks = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(Text)
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # refreshed while running; a stale one means the worker died
+    finished_at = db.Column(db.DateTime)
+
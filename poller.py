@@ -0,0 +1,23 @@
+import os
+import signal
+import asyncio
+
+# Polled updates go to the webhook queue, which worker.py or the web processes
+# drain; set WEBHOOK_EMBEDDED_WORKERS=1 to drain it in this process as well
+os.environ.setdefault('WEBHOOK_EMBEDDED_WORKERS', '0')
+
+from app import app  # noqa: E402
+from services.polling_service import PollingRunner  # noqa: E402
+
+
+async def main():
+    runner = PollingRunner(app)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, runner.stop)
+    await runner.run()
+
+
+if __name__ == '__main__':
+    # Long-polling alternative to webhooks; run web processes with TELEGRAM_UPDATE_MODE=polling
+    asyncio.run(main())
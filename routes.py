@@ -1,18 +1,27 @@
 import os
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
-from app import db
-from models import User, Bot, KnowledgeBase, Conversation, Message, Analytics, Broadcast, BroadcastLog, SubscriptionType
+from app import db, csrf
+from models import User, Bot, KnowledgeBase, IngestionJob, Conversation, Message, Analytics, Broadcast, BroadcastLog, SubscriptionType
 from forms import LoginForm, RegistrationForm, BotCreateForm, KnowledgeBaseForm, BotSettingsForm, ProfileForm, BroadcastForm
-from services.ai_service import AIService
-from services.telegram_service import TelegramService
+from services.telegram_service import get_telegram_service
+from services.async_runner import run_async
 from services.broadcast_service import BroadcastService
+from services.bot_cache import bot_config_cache
+from services.ingestion_service import detect_file_type, get_ingestion_service
+from services.knowledge_service import UNFINISHED_JOB_STATUSES, knowledge_service
+from services.llm_gate import llm_gate
+from services.polling_service import polling_mode_enabled
+from services.webhook_ingest import accept_update
+from services.webhook_queue import webhook_queue
+from services.update_worker import get_worker_pool, embedded_workers_enabled
 from utils.helpers import get_user_language, format_date
 from utils.i18n import get_translations
+from utils import metrics
 
 # Create blueprints
 main_bp = Blueprint('main', __name__)
@@ -155,18 +164,24 @@ def bot_settings(bot_id):
     if form.validate_on_submit() and form.submit.data:
         form.populate_obj(bot)
         bot.updated_at = datetime.utcnow()
+        bot.bump_config_version()
         
-        # Setup Telegram webhook if token provided
-        if bot.telegram_token:
-            telegram_service = TelegramService(bot.telegram_token)
+        # Setup Telegram webhook if token provided (poller.py fetches updates in polling mode)
+        if bot.telegram_token and not polling_mode_enabled():
+            telegram_service = get_telegram_service(bot.telegram_token)
             webhook_url = f"{request.host_url}telegram/webhook/{bot.id}"
-            if telegram_service.set_webhook(webhook_url):
+            try:
+                webhook_set = run_async(telegram_service.set_webhook(webhook_url), timeout=15)
+            except Exception:
+                webhook_set = False
+            if webhook_set:
                 bot.telegram_webhook_url = webhook_url
                 flash('Telegram webhook configured successfully!', 'success')
             else:
                 flash('Failed to configure Telegram webhook. Please check your bot token.', 'error')
         
         db.session.commit()
+        bot_config_cache.invalidate(bot.id)
         flash('Bot settings updated successfully!', 'success')
         return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
     
@@ -176,45 +191,37 @@ def bot_settings(bot_id):
         kb.content = kb_form.content.data or ""
         kb.bot_id = bot.id
         
-        # Handle file upload
+        # Uploaded files are extracted and indexed in the background
         if kb_form.file_upload.data:
             file = kb_form.file_upload.data
-            filename = file.filename
+            file_type = detect_file_type(file.filename)
+            if not file_type:
+                flash('Legacy .doc files are not supported. Please save the document as .docx.', 'error')
+                return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
             
-            # Process different file types
-            if filename.lower().endswith('.txt'):
-                try:
-                    file_content = file.read().decode('utf-8')
-                    if kb.content:
-                        kb.content = kb.content + "\n\n" + file_content
-                    else:
-                        kb.content = file_content
-                    kb.file_type = 'text'
-                except UnicodeDecodeError:
-                    flash('Error reading text file. Please ensure it is UTF-8 encoded.', 'error')
-                    return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
-            elif filename.lower().endswith('.pdf'):
-                # For now, just save the filename and type
-                kb.file_type = 'pdf'
-                if not kb.content:
-                    kb.content = f"PDF file: {filename}"
-                flash('PDF file uploaded. Note: PDF text extraction is not yet implemented.', 'warning')
-            elif filename.lower().endswith(('.doc', '.docx')):
-                # For now, just save the filename and type  
-                kb.file_type = 'document'
-                if not kb.content:
-                    kb.content = f"Document file: {filename}"
-                flash('Document uploaded. Note: Document text extraction is not yet implemented.', 'warning')
-        else:
-            kb.file_type = 'text'
+            kb.file_type = file_type
+            db.session.add(kb)
+            ingestion_service = get_ingestion_service(current_app._get_current_object())
+            job = ingestion_service.create_job(bot, kb, file, file_type)
+            db.session.commit()
+            ingestion_service.submit(job.id)
+            
+            flash(f'File uploaded. Processing in the background (job #{job.id}).', 'info')
+            return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+        
+        kb.file_type = 'text'
         
         # Ensure we have content
         if not kb.content:
             flash('Please provide either content text or upload a file.', 'error')
             return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
         
-        db.session.add(kb)
-        db.session.commit()
+        existing = knowledge_service.find_duplicate_item(bot, kb.content)
+        if existing:
+            flash(f'This content is already in the knowledge base as "{existing.title}".', 'warning')
+            return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+        
+        knowledge_service.add_item(bot, kb)
         flash('Knowledge base item added successfully!', 'success')
         return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
     
@@ -222,9 +229,76 @@ def bot_settings(bot_id):
                          bot=bot, 
                          form=form, 
                          kb_form=kb_form,
+                         dedup_stats=knowledge_service.dedup_stats(bot),
                          lang=lang, 
                          t=translations)
 
+@dashboard_bp.route('/bot/<int:bot_id>/ingestion/<int:job_id>')
+@login_required
+def ingestion_status(bot_id, job_id):
+    bot = Bot.query.filter_by(id=bot_id, user_id=current_user.id).first_or_404()
+    job = IngestionJob.query.filter_by(id=job_id, bot_id=bot.id).first_or_404()
+    
+    return jsonify({
+        'id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'chunks_indexed': job.chunks_indexed,
+        'duplicate_chunks': job.duplicate_chunks,
+        'error': job.error,
+        'knowledge_base_id': job.knowledge_base_id
+    })
+
+@dashboard_bp.route('/bot/<int:bot_id>/knowledge/<int:kb_id>/edit', methods=['POST'])
+@login_required
+def knowledge_edit(bot_id, kb_id):
+    bot = Bot.query.filter_by(id=bot_id, user_id=current_user.id).first_or_404()
+    kb = KnowledgeBase.query.filter_by(id=kb_id, bot_id=bot.id).first_or_404()
+    
+    title = request.form.get('title', '').strip()
+    content = request.form.get('content', '').strip()
+    if not title or len(title) > 200 or not content:
+        flash('Please provide a title (up to 200 characters) and content.', 'error')
+        return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+    
+    # An upload still being processed would overwrite the edit when it finishes
+    if IngestionJob.query.filter(IngestionJob.knowledge_base_id == kb.id,
+                                 IngestionJob.status.in_(UNFINISHED_JOB_STATUSES)).first():
+        flash('This item is still being processed. Please try again when it is ready.', 'warning')
+        return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+    
+    # Browsers submit textarea line breaks as CRLF
+    content = content.replace('\r\n', '\n')
+    content_changed = content != (kb.content or '').replace('\r\n', '\n').strip()
+    # Uploaded items only keep a preview in kb.content; re-chunking it would lose the file
+    if content_changed and kb.file_type not in (None, 'text'):
+        flash('The content of an uploaded file cannot be edited. Upload the file again to change it.', 'warning')
+        return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+    
+    kb.title = title
+    if content_changed:
+        existing = knowledge_service.find_duplicate_item(bot, content)
+        if existing and existing.id != kb.id:
+            flash(f'This content is already in the knowledge base as "{existing.title}".', 'warning')
+            return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+        kb.content = content
+        knowledge_service.update_item(bot, kb)
+    else:
+        db.session.commit()
+    
+    flash('Knowledge base item updated successfully!', 'success')
+    return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+
+@dashboard_bp.route('/bot/<int:bot_id>/knowledge/<int:kb_id>/delete', methods=['POST'])
+@login_required
+def knowledge_delete(bot_id, kb_id):
+    bot = Bot.query.filter_by(id=bot_id, user_id=current_user.id).first_or_404()
+    kb = KnowledgeBase.query.filter_by(id=kb_id, bot_id=bot.id).first_or_404()
+    
+    knowledge_service.delete_item(bot, kb)
+    flash('Knowledge base item deleted successfully!', 'success')
+    return redirect(url_for('dashboard.bot_settings', bot_id=bot.id))
+
 @dashboard_bp.route('/bot/<int:bot_id>/analytics')
 @login_required
 def analytics(bot_id):
@@ -351,62 +425,32 @@ def users():
     
     return render_template('admin/users.html', users=users, lang=lang, t=translations)
 
-# Telegram webhook route
-@main_bp.route('/telegram/webhook/<int:bot_id>', methods=['POST'])
-def telegram_webhook(bot_id):
-    bot = Bot.query.get_or_404(bot_id)
-    
-    if not bot.is_active or not bot.telegram_token:
-        return '', 404
+@admin_bp.route('/queue')
+@login_required
+def queue_stats():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('dashboard.main'))
     
-    # Get update from Telegram
-    update_data = request.get_json()
+    stats = {'queue': webhook_queue.stats(), 'llm': llm_gate.stats()}
+    if embedded_workers_enabled():
+        stats['workers'] = get_worker_pool(current_app._get_current_object()).stats()
     
-    if 'message' in update_data:
-        message = update_data['message']
-        chat_id = message['chat']['id']
-        user_id = message['from']['id']
-        text = message.get('text', '')
-        
-        # Find or create conversation
-        conversation = Conversation.query.filter_by(
-            bot_id=bot.id,
-            telegram_chat_id=str(chat_id)
-        ).first()
-        
-        if not conversation:
-            conversation = Conversation()
-            conversation.bot_id = bot.id
-            conversation.user_id = bot.user_id
-            conversation.telegram_chat_id = str(chat_id)
-            conversation.telegram_user_id = str(user_id)
-            db.session.add(conversation)
-        
-        # Save user message
-        user_message = Message()
-        user_message.content = text
-        user_message.is_from_user = True
-        user_message.conversation_id = conversation.id
-        db.session.add(user_message)
-        
-        # Generate AI response
-        ai_service = AIService()
-        context = "\n".join([kb.content for kb in bot.knowledge_base])
-        response = ai_service.generate_response(text, context, bot.system_prompt)
-        
-        # Save bot response
-        bot_message = Message()
-        bot_message.content = response
-        bot_message.is_from_user = False
-        bot_message.conversation_id = conversation.id
-        db.session.add(bot_message)
-        
-        # Update conversation timestamp
-        conversation.last_message_at = datetime.utcnow()
-        db.session.commit()
-        
-        # Send response back to Telegram
-        telegram_service = TelegramService(bot.telegram_token)
-        telegram_service.send_message(chat_id, response)
+    return jsonify(stats)
+
+@admin_bp.route('/metrics')
+@login_required
+def metrics_snapshot():
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('dashboard.main'))
     
-    return '', 200
+    # e.g. ?prefix=response_cache. for cache hits, misses and seconds saved per bot
+    return jsonify(metrics.snapshot(request.args.get('prefix')))
+
+# Telegram webhook route
+@main_bp.route('/telegram/webhook/<int:bot_id>', methods=['POST'])
+@csrf.exempt
+def telegram_webhook(bot_id):
+    update_data = request.get_json(silent=True)
+    return '', accept_update(current_app._get_current_object(), bot_id, update_data)
@@ -1,40 +1,140 @@
-import os
+import time
+import hashlib
 import logging
 from google import genai
 from google.genai import types
+from services.context_assembler import context_assembler
+from services.genai_client import get_genai_client
+from services.llm_gate import LLMOverloaded, llm_gate
+from services.prompt_templates import prompt_templates
+from services.response_cache import response_cache
+from utils import metrics
+
+BUSY_RESPONSE = "I'm receiving a lot of messages right now. Please try again in a moment."
+EMPTY_RESPONSE = "I apologize, but I couldn't generate a response at this time."
+ERROR_RESPONSE = "I apologize, but I'm experiencing technical difficulties. Please try again later."
 
 class AIService:
     def __init__(self):
-        self.client = genai.Client(api_key=os.environ.get("GOOGLE_GENAI_API_KEY"))
+        # Shared per process so the HTTP connection pool survives across requests
+        self.client = get_genai_client()
         self.model = "gemini-2.5-flash"
     
-    def generate_response(self, user_message, context="", system_prompt="You are a helpful assistant."):
-        """
-        Generate AI response using Google Gemini
+    def generate_response(self, user_message, context="", system_prompt="You are a helpful assistant.",
+                          history=None, max_tokens=None, temperature=None, budget=None, bot=None,
+                          deadline=None, summary=None):
         """
-        try:
-            # Construct the prompt with context
-            full_prompt = f"""
-{system_prompt}
+        Generate AI response using Google Gemini.
 
-Context from knowledge base:
-{context}
-
-User message: {user_message}
+        With `bot`, replies are served from and stored in the bot's response
+        cache; only replies to a conversation's opening message are stored,
+        since later ones may depend on the earlier turns. `summary` condenses
+        the turns before `history` (see ConversationMemory). Upstream calls go
+        through the LLM gate: identical prompts in flight share one call and
+        concurrency is capped globally and per bot.
+        """
+        # Only standalone messages are answered from the cache, like only their replies are stored
+        if bot is not None and not history and not summary:
+            cached = response_cache.get(bot, user_message)
+            if cached is not None:
+                return cached
 
-Please provide a helpful response based on the context provided. If the user's question is not related to the context, still try to be helpful while staying within your role.
-"""
-            
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=full_prompt
+        try:
+            started = time.monotonic()
+            prompt, config, key = self._prepare(user_message, context, system_prompt, history,
+                                                max_tokens, temperature, budget, bot, summary)
+            response = llm_gate.call(
+                lambda: self.client.models.generate_content(model=self.model, contents=prompt.contents, config=config),
+                key=key,
+                bot_id=bot.id if bot is not None else None,
+                deadline=deadline
             )
             
-            return response.text or "I apologize, but I couldn't generate a response at this time."
+            if not response.text:
+                return EMPTY_RESPONSE
+            if bot is not None and not history and not summary:
+                response_cache.set(bot, user_message, response.text, time.monotonic() - started)
+            return response.text
             
+        except LLMOverloaded as e:
+            logging.warning(f"AI Service overloaded: {e}")
+            return BUSY_RESPONSE
         except Exception as e:
             logging.error(f"AI Service error: {e}")
-            return "I apologize, but I'm experiencing technical difficulties. Please try again later."
+            return ERROR_RESPONSE
+    
+    def stream_response(self, user_message, context="", system_prompt="You are a helpful assistant.",
+                        history=None, max_tokens=None, temperature=None, budget=None, bot=None,
+                        deadline=None, summary=None):
+        """
+        Like generate_response, but yield the reply in pieces as Gemini
+        produces them. Time to the first piece is recorded as llm.ttft_seconds.
+        """
+        # Only standalone messages are answered from the cache, like only their replies are stored
+        if bot is not None and not history and not summary:
+            cached = response_cache.get(bot, user_message)
+            if cached is not None:
+                yield cached
+                return
+
+        started = time.monotonic()
+        parts = []
+        try:
+            prompt, config, key = self._prepare(user_message, context, system_prompt, history,
+                                                max_tokens, temperature, budget, bot, summary)
+            upstream = lambda: (
+                chunk.text for chunk in self.client.models.generate_content_stream(
+                    model=self.model, contents=prompt.contents, config=config
+                ) if chunk.text
+            )
+            for piece in llm_gate.stream(upstream, key=key, bot_id=bot.id if bot is not None else None,
+                                         deadline=deadline):
+                if not parts:
+                    metrics.increment('llm.ttft_seconds', time.monotonic() - started)
+                    metrics.increment('llm.ttft_samples')
+                parts.append(piece)
+                yield piece
+            
+        except LLMOverloaded as e:
+            logging.warning(f"AI Service overloaded: {e}")
+            if not parts:
+                yield BUSY_RESPONSE
+            return
+        except Exception as e:
+            # A reply cut off mid-stream is left as it is
+            logging.error(f"AI Service streaming error: {e}")
+            if not parts:
+                yield ERROR_RESPONSE
+            return
+        
+        if not parts:
+            yield EMPTY_RESPONSE
+        elif bot is not None and not history and not summary:
+            response_cache.set(bot, user_message, "".join(parts), time.monotonic() - started)
+    
+    def _prepare(self, user_message, context, system_prompt, history, max_tokens, temperature, budget,
+                 bot=None, summary=None):
+        """
+        Assembled prompt, generation config and single-flight key of a request
+        """
+        # The static prefix is compiled once per bot version; only the rest is built per message
+        prefix = prompt_templates.prefix_for(bot, system_prompt, budget)
+        # Knowledge chunks (best first) and recent turns are packed into the plan's input budget
+        chunks = [context] if isinstance(context, str) and context else list(context or [])
+        prompt = context_assembler.assemble(system_prompt, user_message, chunks, history or [], budget,
+                                            prefix=prefix, summary=summary)
+        
+        # The system instruction is identical across a bot's requests, so Gemini's
+        # implicit prefix caching can serve it
+        config = types.GenerateContentConfig(
+            system_instruction=prompt.system_instruction,
+            max_output_tokens=max_tokens,
+            temperature=temperature
+        )
+        key = hashlib.sha1("\0".join(map(str, (
+            self.model, prompt.system_instruction, prompt.contents, max_tokens, temperature
+        ))).encode('utf-8')).hexdigest()
+        return prompt, config, key
     
     def analyze_content(self, content, analysis_type="sentiment"):
         """
@@ -48,10 +148,10 @@ Please provide a helpful response based on the context provided. If the user's q
             else:
                 prompt = f"Analyze this text: {content}"
             
-            response = self.client.models.generate_content(
+            response = llm_gate.call(lambda: self.client.models.generate_content(
                 model=self.model,
                 contents=prompt
-            )
+            ))
             
             return response.text.strip().lower() if response.text else "unknown"
             
@@ -66,10 +166,10 @@ Please provide a helpful response based on the context provided. If the user's q
         try:
             prompt = f"Summarize this text in no more than {max_length} characters: {text}"
             
-            response = self.client.models.generate_content(
+            response = llm_gate.call(lambda: self.client.models.generate_content(
                 model=self.model,
                 contents=prompt
-            )
+            ))
             
             return response.text or text[:max_length] + "..."
             
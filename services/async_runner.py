@@ -0,0 +1,84 @@
+import os
+import atexit
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Optional
+
+from services.telegram_sessions import close_session_registry
+
+DEFAULT_TIMEOUT = float(os.environ.get("ASYNC_CALL_TIMEOUT", 30))
+
+
+class AsyncLoopRunner:
+    """
+    Background event loop that synchronous Flask code can submit coroutines to.
+
+    One loop per worker process keeps the shared aiohttp session warm and lets
+    many Telegram calls run concurrently instead of each caller spinning up
+    its own short-lived loop.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="async-runner", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the loop and return a thread-safe future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = DEFAULT_TIMEOUT) -> Any:
+        """
+        Run a coroutine on the loop and wait for its result
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Close the loop's shared sessions and stop the loop thread
+        """
+        if not self._thread.is_alive():
+            return
+        try:
+            self.run(close_session_registry(), timeout)
+        except Exception as e:
+            logging.error(f"Error closing Telegram sessions: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+
+_runner: Optional[AsyncLoopRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_async_runner() -> AsyncLoopRunner:
+    """
+    Return this process's loop runner, starting it on first use
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            _runner = AsyncLoopRunner()
+            atexit.register(_runner.stop)
+        return _runner
+
+
+def run_async(coro: Awaitable, timeout: Optional[float] = DEFAULT_TIMEOUT) -> Any:
+    """
+    Run a coroutine from synchronous code on the shared loop
+    """
+    return get_async_runner().run(coro, timeout)
@@ -166,6 +166,10 @@ class AuthService:
             user.is_trial = False
             user.subscription_end = datetime.utcnow() + timedelta(days=duration_days)
             
+            # Cached bot snapshots carry the owner's plan
+            for bot in user.bots:
+                bot.bump_config_version()
+            
             db.session.commit()
             
             logging.info(f"Subscription upgraded for user {user.email} to {subscription_type}")
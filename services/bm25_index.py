@@ -0,0 +1,123 @@
+import math
+import heapq
+import threading
+from operator import itemgetter
+from typing import Dict, Iterable, List, Tuple
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index that supports incremental adds and removals.
+
+    Per-term impacts (each document's BM25 contribution for the term)
+    are computed lazily and reused until the index changes, so a query costs
+    one addition per matching posting.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self.total_length = 0
+
+        self._impacts: Dict[str, Dict[int, float]] = {}
+        self._lock = threading.RLock()
+
+    def add(self, doc_id: int, term_freqs: Dict[str, int], length: int = None) -> None:
+        """
+        Index a document, replacing any previous version with the same id
+        """
+        with self._lock:
+            if doc_id in self.doc_lengths:
+                self.remove(doc_id)
+
+            length = length if length is not None else sum(term_freqs.values())
+            for term, tf in term_freqs.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+
+            self.doc_lengths[doc_id] = length
+            self.doc_terms[doc_id] = tuple(term_freqs)
+            self.total_length += length
+            self._impacts.clear()
+
+    def remove(self, doc_id: int) -> None:
+        """
+        Drop a document from the index
+        """
+        with self._lock:
+            length = self.doc_lengths.pop(doc_id, None)
+            if length is None:
+                return
+
+            self.total_length -= length
+            for term in self.doc_terms.pop(doc_id, ()):
+                docs = self.postings[term]
+                del docs[doc_id]
+                if not docs:
+                    del self.postings[term]
+            self._impacts.clear()
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def _term_impacts(self, term: str) -> Dict[int, float]:
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            postings = self.postings.get(term)
+            if not postings:
+                return {}
+
+            idf = self.idf(term)
+            avg_length = self.total_length / len(self.doc_lengths) or 1.0
+            k1, b = self.k1, self.b
+            impacts = {
+                doc_id: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * self.doc_lengths[doc_id] / avg_length))
+                for doc_id, tf in postings.items()
+            }
+            self._impacts[term] = impacts
+        return impacts
+
+    def search(self, query_terms: Iterable[str], k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Top-k (doc_id, score) pairs for a query, best first.
+
+        Terms are scored rarest first; once there are enough candidates, a
+        term with more postings than candidates only adds to existing
+        candidates, so very common words cannot make a query scan the
+        whole index.
+        """
+        with self._lock:
+            if not self.doc_lengths:
+                return []
+
+            terms = sorted((term for term in set(query_terms) if term in self.postings),
+                           key=lambda term: len(self.postings[term]))
+
+            scores: Dict[int, float] = {}
+            for term in terms:
+                impacts = self._term_impacts(term)
+                if len(scores) >= k and len(impacts) > len(scores):
+                    for doc_id in scores:
+                        impact = impacts.get(doc_id)
+                        if impact:
+                            scores[doc_id] += impact
+                else:
+                    for doc_id, impact in impacts.items():
+                        scores[doc_id] = scores.get(doc_id, 0.0) + impact
+
+            return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes held by postings and cached impacts
+        """
+        with self._lock:
+            entries = sum(map(len, self.postings.values())) + sum(map(len, self._impacts.values()))
+            return 100 * entries + 200 * len(self.doc_lengths)
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
@@ -0,0 +1,98 @@
+import os
+import time
+from typing import NamedTuple, Optional
+
+from app import db
+from models import Bot, User
+from utils import metrics
+from utils.lru import LRUCache
+
+
+class BotSnapshot(NamedTuple):
+    """
+    Immutable view of the bot settings needed to answer a message
+    """
+    id: int
+    user_id: int
+    telegram_token: Optional[str]
+    is_active: bool
+    system_prompt: Optional[str]
+    temperature: float
+    max_tokens: int
+    retrieval_strategy: str
+    plan: str
+    config_version: int
+    kb_version: int
+
+
+_SNAPSHOT_COLUMNS = (
+    Bot.id, Bot.user_id, Bot.telegram_token, Bot.is_active, Bot.system_prompt,
+    Bot.temperature, Bot.max_tokens, Bot.retrieval_strategy, Bot.config_version, Bot.kb_version
+)
+
+
+class BotConfigCache:
+    """
+    Per-process LRU cache of bot snapshots.
+
+    Entries younger than `revalidate_after` seconds are served directly; older
+    ones are checked against the bot's version columns with a two-column
+    query and only reloaded when a version changed.
+    """
+
+    def __init__(self, maxsize: int = None, revalidate_after: float = None):
+        self.revalidate_after = revalidate_after if revalidate_after is not None else \
+            float(os.environ.get("BOT_CACHE_REVALIDATE_SECONDS", 1.0))
+        self._entries = LRUCache(maxsize=maxsize or int(os.environ.get("BOT_CACHE_SIZE", 1000)))
+
+    def get(self, bot_id: int) -> Optional[BotSnapshot]:
+        """
+        Return the current snapshot for a bot, or None if it does not exist
+        """
+        entry = self._entries.get(bot_id)
+        now = time.monotonic()
+
+        if entry is not None:
+            snapshot, checked_at = entry
+            if now - checked_at < self.revalidate_after:
+                metrics.increment('bot_cache.hits')
+                return snapshot
+
+            versions = db.session.query(Bot.config_version, Bot.kb_version).filter(Bot.id == bot_id).first()
+            if versions is not None and tuple(versions) == (snapshot.config_version, snapshot.kb_version):
+                self._entries.set(bot_id, (snapshot, now))
+                metrics.increment('bot_cache.revalidated')
+                return snapshot
+
+        metrics.increment('bot_cache.misses')
+        row = db.session.query(*_SNAPSHOT_COLUMNS, User.subscription_type).join(
+            User, User.id == Bot.user_id
+        ).filter(Bot.id == bot_id).first()
+        if row is None:
+            self._entries.pop(bot_id)
+            return None
+
+        snapshot = BotSnapshot(
+            id=row.id,
+            user_id=row.user_id,
+            telegram_token=row.telegram_token,
+            is_active=bool(row.is_active),
+            system_prompt=row.system_prompt,
+            temperature=row.temperature if row.temperature is not None else 0.7,
+            max_tokens=row.max_tokens or 1000,
+            retrieval_strategy=row.retrieval_strategy or 'bm25',
+            plan=row.subscription_type.value if row.subscription_type else 'free',
+            config_version=row.config_version or 1,
+            kb_version=row.kb_version or 1
+        )
+        self._entries.set(bot_id, (snapshot, now))
+        return snapshot
+
+    def invalidate(self, bot_id: int) -> None:
+        """
+        Drop a bot from this process's cache; other processes catch up on revalidation
+        """
+        self._entries.pop(bot_id)
+
+
+bot_config_cache = BotConfigCache()
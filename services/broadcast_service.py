@@ -1,8 +1,10 @@
+import asyncio
 import logging
 from datetime import datetime
-from typing import List
-from models import User, Bot, Broadcast, BroadcastLog, SubscriptionType
-from services.telegram_service import TelegramService
+from typing import Dict, List, Tuple
+from models import User, Bot, Conversation, Broadcast, BroadcastLog, SubscriptionType
+from services.async_runner import run_async
+from services.telegram_service import get_telegram_service
 from app import db
 
 class BroadcastService:
@@ -31,9 +33,27 @@ class BroadcastService:
                 'errors': []
             }
             
-            # Send to each user's bots
+            # Resolve delivery targets up front, then send to all users concurrently
+            delivery_plan = {user.id: self._get_delivery_targets(user) for user in target_users}
+            message_content = broadcast.html_content or broadcast.content
+            parse_mode = "HTML" if broadcast.html_content else "Markdown"
+            
+            # Filled in as each user's delivery finishes, so an aborted run keeps the finished ones
+            user_results = {}
+            try:
+                run_async(
+                    self._deliver_all(delivery_plan, message_content, parse_mode, user_results),
+                    timeout=60 + len(target_users)
+                )
+            except Exception as e:
+                # Only users whose delivery had not finished failed; the timeout cancels the rest
+                user_results = dict(user_results)
+                error = f"Delivery aborted: {str(e) or type(e).__name__}"
+                for user in target_users:
+                    user_results.setdefault(user.id, {'success': False, 'error': error})
+            
             for user in target_users:
-                user_result = self._send_to_user_bots(user, broadcast)
+                user_result = user_results[user.id]
                 
                 # Create broadcast log
                 log = BroadcastLog()
@@ -82,60 +102,62 @@ class BroadcastService:
         else:
             return User.query.filter_by(subscription_type=target_subscription).all()
     
-    def _send_to_user_bots(self, user: User, broadcast: Broadcast) -> dict:
+    def _get_delivery_targets(self, user: User) -> List[Tuple[int, str, int]]:
         """
-        Send broadcast message to all user's Telegram bots
+        Candidate (bot_id, token, chat_id) targets for a user, in the order to try them
         """
-        try:
-            message_sent = False
-            errors = []
+        targets = []
+        
+        # Get user's active bots with Telegram integration
+        active_bots = Bot.query.filter_by(
+            user_id=user.id,
+            is_active=True
+        ).filter(Bot.telegram_token.isnot(None)).all()
+        
+        for bot in active_bots:
+            # Get recent conversations to send message to active users
+            recent_conversations = Conversation.query.filter(
+                Conversation.bot_id == bot.id,
+                Conversation.telegram_chat_id.isnot(None)
+            ).order_by(Conversation.last_message_at.desc()).limit(10).all()
             
-            # Get user's active bots with Telegram integration
-            active_bots = Bot.query.filter_by(
-                user_id=user.id,
-                is_active=True
-            ).filter(Bot.telegram_token.isnot(None)).all()
-            
-            if not active_bots:
-                return {'success': False, 'error': 'No active Telegram bots found'}
-            
-            # Send via the first available bot
-            for bot in active_bots:
-                try:
-                    telegram_service = TelegramService(bot.telegram_token)
-                    
-                    # Get recent conversations to send message to active users
-                    recent_conversations = bot.conversations[-10:]  # Last 10 conversations
-                    
-                    for conversation in recent_conversations:
-                        if conversation.telegram_chat_id:
-                            # Use HTML content if available, otherwise plain text
-                            message_content = broadcast.html_content or broadcast.content
-                            
-                            success = telegram_service.send_message(
-                                int(conversation.telegram_chat_id),
-                                message_content,
-                                parse_mode="HTML" if broadcast.html_content else "Markdown"
-                            )
-                            
-                            if success:
-                                message_sent = True
-                                break  # Success, no need to try other conversations
-                    
-                    if message_sent:
-                        break  # Success with this bot, no need to try others
-                        
-                except Exception as e:
-                    errors.append(f"Bot {bot.id}: {str(e)}")
-                    continue
-            
-            if message_sent:
-                return {'success': True}
-            else:
-                return {'success': False, 'error': f"Failed to send via any bot: {'; '.join(errors)}"}
-                
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+            for conversation in recent_conversations:
+                targets.append((bot.id, bot.telegram_token, int(conversation.telegram_chat_id)))
+        
+        return targets
+    
+    async def _deliver_all(self, delivery_plan: Dict[int, List[Tuple[int, str, int]]],
+                           message_content: str, parse_mode: str, results: Dict[int, dict]) -> None:
+        """
+        Deliver to every user concurrently, limited to 30 sends in flight,
+        recording each user's result in `results` as soon as it is known
+        """
+        semaphore = asyncio.Semaphore(30)
+        
+        async def deliver(user_id):
+            async with semaphore:
+                results[user_id] = await self._send_to_user_bots(delivery_plan[user_id], message_content, parse_mode)
+        
+        await asyncio.gather(*[deliver(user_id) for user_id in delivery_plan])
+    
+    async def _send_to_user_bots(self, targets: List[Tuple[int, str, int]],
+                                 message_content: str, parse_mode: str) -> dict:
+        """
+        Send broadcast message via the first of a user's bots and chats that accepts it
+        """
+        if not targets:
+            return {'success': False, 'error': 'No active Telegram bots found'}
+        
+        errors = []
+        for bot_id, token, chat_id in targets:
+            try:
+                telegram_service = get_telegram_service(token)
+                if await telegram_service.send_message(chat_id, message_content, parse_mode=parse_mode):
+                    return {'success': True}
+            except Exception as e:
+                errors.append(f"Bot {bot_id}: {str(e)}")
+        
+        return {'success': False, 'error': f"Failed to send via any bot: {'; '.join(errors)}"}
     
     def schedule_broadcast(self, broadcast_id: int, scheduled_time: datetime) -> bool:
         """
@@ -230,16 +252,17 @@ class BroadcastService:
                 return False
             
             # Get the most recent conversation
-            recent_conversation = active_bot.conversations.order_by(
-                active_bot.conversations.c.last_message_at.desc()
-            ).first()
+            recent_conversation = Conversation.query.filter_by(
+                bot_id=active_bot.id
+            ).order_by(Conversation.last_message_at.desc()).first()
             
             if recent_conversation and recent_conversation.telegram_chat_id:
-                telegram_service = TelegramService(active_bot.telegram_token)
-                return telegram_service.send_message(
+                telegram_service = get_telegram_service(active_bot.telegram_token)
+                result = run_async(telegram_service.send_message(
                     int(recent_conversation.telegram_chat_id),
                     message
-                )
+                ))
+                return result is not None
             
             return False
             
@@ -0,0 +1,147 @@
+import os
+import hashlib
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from utils import metrics
+from utils.text_processing import estimate_tokens, truncate_to_tokens
+
+# Input-token budget per subscription plan
+DEFAULT_BUDGETS = {
+    'free': 2000,
+    'business': 6000,
+    'enterprise': 16000,
+}
+
+INSTRUCTIONS = (
+    "Please provide a helpful response based on the context provided. If the user's question "
+    "is not related to the context, still try to be helpful while staying within your role."
+)
+
+# Partial chunks shorter than this are not worth sending
+MIN_PARTIAL_CHUNK_TOKENS = 64
+
+
+class PromptPrefix(NamedTuple):
+    """
+    The static part of a prompt: system prompt and instructions
+    """
+    system_instruction: str
+    tokens: int
+    key: str  # sha1 of system_instruction
+
+
+class AssembledPrompt(NamedTuple):
+    system_instruction: str
+    contents: str
+    input_tokens: int
+    chunks_used: int
+    turns_used: int
+
+
+class ContextAssembler:
+    """
+    Packs the system prompt, retrieved knowledge chunks and recent
+    conversation turns into an input-token budget.
+
+    Priority, highest first: system prompt and user message (each capped at
+    a quarter of the budget), knowledge chunks in retrieval order,
+    conversation turns newest first, then the summary of the turns before
+    them. Up to `history_share` of what is left after the first two is held
+    back for the summary and turns, so a long knowledge context cannot crowd
+    out the conversation entirely.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, history_share: float = None):
+        self.budgets = budgets or {
+            plan: int(os.environ.get(f"PROMPT_BUDGET_{plan.upper()}", default))
+            for plan, default in DEFAULT_BUDGETS.items()
+        }
+        self.history_share = history_share if history_share is not None else \
+            float(os.environ.get("PROMPT_HISTORY_SHARE", 0.3))
+
+    def budget_for(self, plan: Optional[str]) -> int:
+        return self.budgets.get(plan or 'free', self.budgets['free'])
+
+    def compile_prefix(self, system_prompt: str, budget: int = None) -> PromptPrefix:
+        """
+        Build the static part of the prompt, which only changes with the
+        bot's settings (see PromptTemplates for the per-bot cache)
+        """
+        budget = budget or self.budget_for(None)
+        system_prompt = truncate_to_tokens(system_prompt or "", budget // 4)
+        system_instruction = f"{system_prompt}\n\n{INSTRUCTIONS}".strip()
+        return PromptPrefix(
+            system_instruction=system_instruction,
+            tokens=estimate_tokens(system_instruction),
+            key=hashlib.sha1(system_instruction.encode('utf-8')).hexdigest()
+        )
+
+    def assemble(self, system_prompt: str, user_message: str, chunks: Sequence[str] = (),
+                 history: Sequence[Tuple[bool, str]] = (), budget: int = None,
+                 prefix: Optional[PromptPrefix] = None, summary: Optional[str] = None) -> AssembledPrompt:
+        """
+        Build the prompt for one reply. `history` is (is_from_user, content)
+        pairs, oldest first, not including `user_message`; `summary` covers
+        the turns before them. A precompiled `prefix` replaces `system_prompt`.
+        """
+        budget = budget or self.budget_for(None)
+
+        prefix = prefix or self.compile_prefix(system_prompt, budget)
+        system_instruction = prefix.system_instruction
+        user_message = truncate_to_tokens(user_message, budget // 4)
+
+        remaining = budget - prefix.tokens - estimate_tokens(user_message) - 16
+
+        history_tokens = [estimate_tokens(content) + 2 for _, content in history]
+        summary_tokens = estimate_tokens(summary) + 8 if summary else 0
+        history_reserve = min(sum(history_tokens) + summary_tokens, int(max(remaining, 0) * self.history_share))
+
+        context_parts: List[str] = []
+        chunk_budget = remaining - history_reserve
+        for chunk in chunks:
+            cost = estimate_tokens(chunk) + 2
+            if cost <= chunk_budget:
+                context_parts.append(chunk)
+                chunk_budget -= cost
+                continue
+            if chunk_budget >= MIN_PARTIAL_CHUNK_TOKENS:
+                context_parts.append(truncate_to_tokens(chunk, chunk_budget - 2))
+            break
+        remaining -= sum(estimate_tokens(part) + 2 for part in context_parts)
+
+        turns: List[str] = []
+        for (is_from_user, content), cost in zip(reversed(history), reversed(history_tokens)):
+            if cost > remaining:
+                break
+            turns.append(f"{'User' if is_from_user else 'Assistant'}: {content}")
+            remaining -= cost
+        turns.reverse()
+        if summary_tokens > remaining:
+            summary = None
+
+        sections = []
+        if context_parts:
+            sections.append("Context from knowledge base:\n" + "\n\n".join(context_parts))
+        if summary:
+            sections.append("Summary of the earlier conversation:\n" + summary)
+        if turns:
+            sections.append("Conversation so far:\n" + "\n".join(turns))
+        sections.append(f"User message: {user_message}")
+        contents = "\n\n".join(sections)
+
+        input_tokens = prefix.tokens + estimate_tokens(contents)
+        metrics.increment('prompt.assembled')
+        metrics.increment('prompt.input_tokens', input_tokens)
+        if len(context_parts) < len(chunks) or len(turns) < len(history):
+            metrics.increment('prompt.truncated')
+
+        return AssembledPrompt(
+            system_instruction=system_instruction,
+            contents=contents,
+            input_tokens=input_tokens,
+            chunks_used=len(context_parts),
+            turns_used=len(turns)
+        )
+
+
+context_assembler = ContextAssembler()
@@ -0,0 +1,158 @@
+import os
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import update
+
+from app import db
+from models import Conversation, Message
+from services.ai_service import AIService
+from services.message_writer import get_message_writer
+from utils import metrics
+
+
+class ConversationMemory:
+    """
+    Bounded memory of a conversation for the prompt.
+
+    The last `keep_turns` messages are used verbatim; everything before them
+    is folded into a rolling summary stored on the Conversation. Folding
+    happens on a background thread once `fold_turns` messages have fallen
+    out of the verbatim window, and only those messages are summarized
+    together with the previous summary, so neither the prompt nor the
+    summarization work grows with the length of the chat.
+    """
+
+    def __init__(self, app, keep_turns: int = None, fold_turns: int = None):
+        self.app = app
+        self.pid = os.getpid()
+        self.keep_turns = keep_turns or int(os.environ.get("PROMPT_HISTORY_TURNS", 10))
+        self.fold_turns = fold_turns or int(os.environ.get("MEMORY_FOLD_TURNS", 10))
+        # Messages summarized per pass at most, so a long backlog is folded in steps
+        self.max_fold_turns = int(os.environ.get("MEMORY_FOLD_MAX_TURNS", 50))
+        self.summary_chars = int(os.environ.get("MEMORY_SUMMARY_CHARS", 1500))
+
+        self._ai = AIService()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("MEMORY_SUMMARY_WORKERS", 2)),
+            thread_name_prefix='memory'
+        )
+        self._pending: Set[int] = set()
+        self._pending_lock = threading.Lock()
+
+    def load(self, conversation_id: int) -> Tuple[Optional[str], List[Tuple[bool, str]]]:
+        """
+        Summary of the earlier conversation (or None) and the recent turns as
+        (is_from_user, content), oldest first. Schedules a fold when enough
+        turns are waiting to be summarized.
+        """
+        # The previous turn may still be in the write buffer
+        try:
+            get_message_writer(self.app).flush_conversation(conversation_id)
+        except Exception as e:
+            logging.error(f"Could not flush buffered messages of conversation {conversation_id}: {e}")
+
+        conversation = db.session.query(
+            Conversation.summary, Conversation.summary_through_id
+        ).filter(Conversation.id == conversation_id).one_or_none()
+        summary, through_id = conversation if conversation is not None else (None, None)
+
+        query = db.session.query(Message.is_from_user, Message.content).filter(
+            Message.conversation_id == conversation_id
+        )
+        if through_id is not None:
+            query = query.filter(Message.id > through_id)
+        # One extra batch tells whether enough older turns are waiting to be folded
+        rows = query.order_by(Message.id.desc()).limit(self.keep_turns + self.fold_turns).all()
+
+        if len(rows) == self.keep_turns + self.fold_turns:
+            self._schedule(conversation_id)
+
+        turns = [(row.is_from_user, row.content) for row in reversed(rows[:self.keep_turns])]
+        return summary, turns
+
+    def _schedule(self, conversation_id: int) -> None:
+        with self._pending_lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        self._executor.submit(self._fold, conversation_id)
+
+    def _fold(self, conversation_id: int) -> None:
+        """
+        Summarize the turns that left the verbatim window into the stored summary
+        """
+        try:
+            with self.app.app_context():
+                try:
+                    self._fold_once(conversation_id)
+                except Exception as e:
+                    db.session.rollback()
+                    metrics.increment('memory.fold_errors')
+                    logging.error(f"Failed to fold conversation {conversation_id} into its summary: {e}")
+                finally:
+                    db.session.remove()
+        finally:
+            with self._pending_lock:
+                self._pending.discard(conversation_id)
+
+    def _fold_once(self, conversation_id: int) -> None:
+        summary, through_id = db.session.query(
+            Conversation.summary, Conversation.summary_through_id
+        ).filter(Conversation.id == conversation_id).one()
+
+        query = db.session.query(Message.id, Message.is_from_user, Message.content).filter(
+            Message.conversation_id == conversation_id
+        )
+        if through_id is not None:
+            query = query.filter(Message.id > through_id)
+        rows = query.order_by(Message.id).limit(self.max_fold_turns + self.keep_turns).all()
+        older = rows[:-self.keep_turns] if len(rows) > self.keep_turns else []
+        if not older:
+            return
+        # Close the session's transaction before the slow model call
+        db.session.commit()
+
+        transcript = "\n".join(f"{'User' if row.is_from_user else 'Assistant'}: {row.content}" for row in older)
+        text = f"Summary of the conversation so far:\n{summary}\n\nNew messages:\n{transcript}" if summary \
+            else transcript
+        new_summary = self._ai.summarize_text(text, max_length=self.summary_chars)
+        if not new_summary or new_summary == text[:self.summary_chars] + "...":
+            # summarize_text falls back to truncating its input; keep the old summary instead
+            metrics.increment('memory.fold_errors')
+            return
+
+        # Only the worker that read this version of the summary may replace it
+        stale = Conversation.summary_through_id.is_(None) if through_id is None \
+            else Conversation.summary_through_id == through_id
+        result = db.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id, stale)
+            .values(summary=new_summary.strip(), summary_through_id=older[-1].id)
+        )
+        db.session.commit()
+        if result.rowcount:
+            metrics.increment('memory.folds')
+            metrics.increment('memory.folded_messages', len(older))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_memory: Optional[ConversationMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_conversation_memory(app) -> ConversationMemory:
+    """
+    Return this process's conversation memory, creating it on first use
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is None or _memory.pid != os.getpid():
+            _memory = ConversationMemory(app)
+            atexit.register(_memory.close)
+        return _memory
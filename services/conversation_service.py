@@ -0,0 +1,139 @@
+import os
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+from app import db
+from models import Conversation, Message
+from utils import metrics
+from utils.lru import LRUCache
+
+
+class ConversationStore:
+    """
+    Maps Telegram chats to conversation ids.
+
+    A per-worker LRU answers repeat chats without any SELECT; misses go through
+    a single INSERT ... ON CONFLICT upsert on the unique (bot_id, telegram_chat_id)
+    constraint, so concurrent first messages cannot create duplicates. A
+    database upgraded without that constraint (see
+    merge_duplicate_conversations) gets a lookup followed by an insert.
+    """
+
+    def __init__(self, maxsize: int = None):
+        self._ids = LRUCache(maxsize=maxsize or int(os.environ.get("CONVERSATION_CACHE_SIZE", 50000)))
+        self._upsert_supported = True
+
+    def get_or_create_id(self, bot_id: int, owner_id: int, chat_id, telegram_user_id=None) -> int:
+        """
+        Return the conversation id for a chat, creating the conversation if needed
+        """
+        key = (bot_id, str(chat_id))
+        conversation_id = self._ids.get(key)
+        if conversation_id is not None:
+            metrics.increment('conversations.cache_hits')
+            return conversation_id
+
+        metrics.increment('conversations.cache_misses')
+        conversation_id = self._upsert(bot_id, owner_id, str(chat_id),
+                                       str(telegram_user_id) if telegram_user_id is not None else None)
+        self._ids.set(key, conversation_id)
+        return conversation_id
+
+    def _upsert(self, bot_id: int, owner_id: int, chat_id: str, telegram_user_id) -> int:
+        now = datetime.utcnow()
+        values = {
+            'bot_id': bot_id,
+            'user_id': owner_id,
+            'telegram_chat_id': chat_id,
+            'telegram_user_id': telegram_user_id,
+            'started_at': now,
+            'last_message_at': now
+        }
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect in ('postgresql', 'sqlite') and self._upsert_supported:
+            dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            stmt = dialect_insert(Conversation).values(**values)
+            # A no-op update on conflict lets RETURNING hand back the existing id in the same round-trip
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['bot_id', 'telegram_chat_id'],
+                set_={'telegram_chat_id': stmt.excluded.telegram_chat_id}
+            ).returning(Conversation.id)
+            try:
+                conversation_id = db.session.execute(stmt).scalar_one()
+                db.session.commit()
+                return conversation_id
+            except (OperationalError, ProgrammingError) as e:
+                # ON CONFLICT needs the unique constraint, which the startup upgrade could not add
+                db.session.rollback()
+                self._upsert_supported = False
+                logging.error(f"Conversation upsert unavailable, using lookup and insert: {e}")
+
+        existing_id = db.session.query(Conversation.id).filter_by(
+            bot_id=bot_id, telegram_chat_id=chat_id
+        ).order_by(Conversation.id).limit(1).scalar()
+        if existing_id is not None:
+            return existing_id
+
+        # Insert and fall back to a lookup when the constraint fires
+        try:
+            conversation_id = db.session.execute(
+                insert(Conversation).values(**values).returning(Conversation.id)
+            ).scalar_one()
+            db.session.commit()
+            return conversation_id
+        except IntegrityError:
+            db.session.rollback()
+            return db.session.query(Conversation.id).filter_by(
+                bot_id=bot_id, telegram_chat_id=chat_id
+            ).order_by(Conversation.id).limit(1).scalar()
+
+
+def merge_duplicate_conversations(connection) -> int:
+    """
+    Merge conversations that share a (bot_id, telegram_chat_id), which racing
+    first messages could create before the unique constraint existed, so it
+    can be added. The oldest conversation keeps all messages; its summary is
+    reset so the merged history is summarized again. Returns the number of
+    conversations removed.
+    """
+    conversation = Conversation.__table__
+    message = Message.__table__
+    groups = connection.execute(
+        select(conversation.c.bot_id, conversation.c.telegram_chat_id, func.min(conversation.c.id))
+        .where(conversation.c.telegram_chat_id.isnot(None))
+        .group_by(conversation.c.bot_id, conversation.c.telegram_chat_id)
+        .having(func.count() > 1)
+    ).all()
+
+    removed = 0
+    for bot_id, chat_id, keep_id in groups:
+        rows = connection.execute(
+            select(conversation.c.id, conversation.c.last_message_at).where(
+                conversation.c.bot_id == bot_id,
+                conversation.c.telegram_chat_id == chat_id
+            )
+        ).all()
+        duplicate_ids = [row.id for row in rows if row.id != keep_id]
+        last_message_at = max((row.last_message_at for row in rows if row.last_message_at), default=None)
+
+        connection.execute(
+            update(message).where(message.c.conversation_id.in_(duplicate_ids)).values(conversation_id=keep_id)
+        )
+        connection.execute(
+            update(conversation).where(conversation.c.id == keep_id)
+            .values(last_message_at=last_message_at, summary=None, summary_through_id=None)
+        )
+        connection.execute(delete(conversation).where(conversation.c.id.in_(duplicate_ids)))
+        removed += len(duplicate_ids)
+
+    if removed:
+        logging.warning(f"Merged {removed} duplicate conversations into {len(groups)}")
+    return removed
+
+
+conversation_store = ConversationStore()
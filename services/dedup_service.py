@@ -0,0 +1,79 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict
+
+from app import db
+from models import ProcessedUpdate
+from utils import metrics
+from utils.lru import LRUCache
+
+
+class UpdateDeduplicator:
+    """
+    Idempotency store for Telegram updates keyed by (bot_id, update_id).
+
+    A per-process LRU with TTL answers repeat deliveries without touching the
+    database; the unique-constrained processed_update table makes all workers
+    agree on which updates were already accepted.
+    """
+
+    def __init__(self, maxsize: int = None, ttl: int = None):
+        self.ttl = ttl or int(os.environ.get("UPDATE_DEDUP_TTL", 86400))
+        self._seen = LRUCache(
+            maxsize=maxsize or int(os.environ.get("UPDATE_DEDUP_CACHE_SIZE", 100000)),
+            ttl=self.ttl
+        )
+
+    def is_known(self, bot_id: int, update_id: int) -> bool:
+        """
+        Cheap in-process check for updates this worker has already seen
+        """
+        if (bot_id, update_id) in self._seen:
+            metrics.increment('dedup.memory_hits')
+            return True
+        return False
+
+    def register(self, bot_id: int, update_id: int) -> None:
+        """
+        Add the idempotency row to the current session.
+
+        Committing raises IntegrityError when another delivery of the same
+        update was accepted first.
+        """
+        marker = ProcessedUpdate()
+        marker.bot_id = bot_id
+        marker.update_id = update_id
+        db.session.add(marker)
+
+    def remember(self, bot_id: int, update_id: int) -> None:
+        """
+        Record a committed update in the in-process cache
+        """
+        self._seen.set((bot_id, update_id), True)
+        metrics.increment('dedup.accepted')
+
+    def record_duplicate(self, bot_id: int, update_id: int) -> None:
+        """
+        Record a duplicate that was caught by the unique constraint
+        """
+        self._seen.set((bot_id, update_id), True)
+        metrics.increment('dedup.db_hits')
+
+    def purge(self) -> int:
+        """
+        Drop markers older than the TTL; Telegram stops redelivering long before
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        deleted = ProcessedUpdate.query.filter(
+            ProcessedUpdate.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, float]:
+        stats = metrics.snapshot('dedup.')
+        stats['dedup.cache_size'] = len(self._seen)
+        return stats
+
+
+update_deduplicator = UpdateDeduplicator()
@@ -0,0 +1,141 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple, Any
+
+
+class ShardBacklogFull(Exception):
+    """Raised when a shard already holds its maximum number of queued tasks"""
+
+
+class ShardedDispatcher:
+    """
+    Runs tasks on a bounded thread pool, sharded by key.
+
+    Tasks that share a key (e.g. a `(bot_id, chat_id)` pair) run strictly one
+    after another in submission order; tasks with different keys run in
+    parallel, up to `concurrency` at a time. Tasks still queued at shutdown
+    are not run; each is passed to `on_abandon(fn, args)` instead, so the
+    caller can hand its work back.
+    """
+
+    def __init__(self, concurrency: int = 16, shard_backlog: int = 100, fairness_batch: int = 8,
+                 on_abandon: Optional[Callable[[Callable, tuple], None]] = None):
+        self.concurrency = concurrency
+        self.shard_backlog = shard_backlog
+        # Tasks a shard may run before yielding its thread to other shards
+        self.fairness_batch = fairness_batch
+        self.on_abandon = on_abandon
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='shard')
+        self._shards: Dict[Hashable, Deque[Tuple[Callable, tuple]]] = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+
+    def submit(self, key: Hashable, fn: Callable, *args: Any) -> None:
+        """
+        Queue `fn(*args)` behind any earlier tasks for the same key
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Dispatcher is shut down")
+            shard = self._shards.get(key)
+            if shard is None:
+                # Idle shard: queue the task and schedule a drain
+                self._shards[key] = deque([(fn, args)])
+                schedule = True
+            elif len(shard) >= self.shard_backlog:
+                raise ShardBacklogFull(f"Shard {key!r} has {len(shard)} queued tasks")
+            else:
+                # A drain for this shard is already scheduled or running
+                shard.append((fn, args))
+                schedule = False
+            self._pending += 1
+
+        if schedule:
+            self._executor.submit(self._drain, key)
+
+    def _drain(self, key: Hashable) -> None:
+        for _ in range(self.fairness_batch):
+            with self._lock:
+                if self._closed:
+                    break
+                shard = self._shards[key]
+                if not shard:
+                    del self._shards[key]
+                    return
+                fn, args = shard.popleft()
+
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Unhandled error in shard {key!r}: {e}")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+        # Requeue behind other shards so a busy chat cannot starve the pool
+        with self._lock:
+            if self._closed:
+                abandoned = self._take(key)
+            elif not self._shards[key]:
+                del self._shards[key]
+                return
+            else:
+                abandoned = None
+        if abandoned is None:
+            try:
+                self._executor.submit(self._drain, key)
+                return
+            except RuntimeError:
+                # The executor shut down in between
+                with self._lock:
+                    abandoned = self._take(key)
+        self._abandon(abandoned)
+
+    def _take(self, key: Hashable) -> List[Tuple[Callable, tuple]]:
+        """
+        Remove a shard and its queued tasks; the caller holds the lock
+        """
+        tasks = list(self._shards.pop(key, ()))
+        self._pending -= len(tasks)
+        return tasks
+
+    def _abandon(self, tasks: List[Tuple[Callable, tuple]]) -> None:
+        for fn, args in tasks:
+            if self.on_abandon is None:
+                continue
+            try:
+                self.on_abandon(fn, args)
+            except Exception as e:
+                logging.error(f"Error abandoning a queued task: {e}")
+
+    def pending(self) -> int:
+        """
+        Number of submitted tasks that have not finished yet
+        """
+        with self._lock:
+            return self._pending
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'active_shards': len(self._shards),
+                'pending_tasks': self._pending,
+                'largest_shard_backlog': max((len(shard) for shard in self._shards.values()), default=0)
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop starting queued tasks and abandon them; running tasks finish
+        (and are waited for with `wait`)
+        """
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            abandoned = [task for key in list(self._shards) for task in self._take(key)]
+        self._abandon(abandoned)
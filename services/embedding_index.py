@@ -0,0 +1,398 @@
+import os
+import sys
+import math
+import zlib
+import heapq
+import random
+import struct
+import threading
+from array import array
+from collections import Counter
+from operator import itemgetter, mul
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.text_processing import tokenize
+
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", 128))
+
+SNAPSHOT_MAGIC = b'BEMBIX01'
+# magic, dimension, vector count, list count (0 when not partitioned)
+SNAPSHOT_HEADER = struct.Struct('<8sQQQ')
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> array:
+    return embed_tokens(tokenize(text), dim)
+
+
+def embed_tokens(tokens: List[str], dim: int = EMBEDDING_DIM) -> array:
+    """
+    Hashed character n-gram embedding of a token stream, L2-normalized float32.
+
+    Each word contributes itself plus the 3- and 4-grams of `<word>`; every
+    feature is hashed with crc32 to a signed slot, so spelling variants and
+    inflections of a word land close together without any model or network.
+    """
+    features = Counter()
+    for word in tokens:
+        features[word] += 1
+        padded = f"<{word}>"
+        for n in (3, 4):
+            for i in range(len(padded) - n + 1):
+                features[padded[i:i + n]] += 1
+
+    vector = [0.0] * dim
+    for feature, count in features.items():
+        h = zlib.crc32(feature.encode('utf-8'))
+        weight = 1.0 + math.log(count)
+        if h & 0x80000000:
+            vector[h % dim] -= weight
+        else:
+            vector[h % dim] += weight
+
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return array('f', [x / norm for x in vector])
+
+
+def vector_from_bytes(data: bytes) -> array:
+    vector = array('f')
+    vector.frombytes(data)
+    return vector
+
+
+def _quantize(vector: Sequence[float]) -> Tuple[float, List[int]]:
+    """
+    Per-vector scale and int8 components
+    """
+    scale = max(map(abs, vector)) / 127 or 1.0
+    return scale, list(map(round, map((1 / scale).__mul__, vector)))
+
+
+class PackedVectors:
+    """
+    int8-quantized rows packed column-wise into Python integers.
+
+    Column d holds every row's (component + 128) in its own 32-bit field, so
+    multiplying the columns by the (offset) query components and summing
+    gives all row dot products at once, in `dim` big-integer multiply-adds
+    running in C. The offsets are subtracted out afterwards.
+    """
+
+    FIELD_BYTES = 4
+
+    def __init__(self, rows: Sequence[Sequence[float]]):
+        self.size = len(rows)
+        self.dim = len(rows[0]) if rows else 0
+        self.scales = array('d')
+        self.offset_sums = array('d')
+
+        quantized = bytearray()
+        for row in rows:
+            scale, components = _quantize(row)
+            self.scales.append(scale)
+            self.offset_sums.append(128.0 * sum(components) * scale)
+            quantized += bytes(map((128).__add__, components))
+
+        self.columns = []
+        width = self.FIELD_BYTES
+        for d in range(self.dim):
+            column = bytearray(width * self.size)
+            column[0::width] = quantized[d::self.dim]
+            self.columns.append(int.from_bytes(column, 'little'))
+
+    def scores(self, query: Sequence[float]) -> array:
+        """
+        Approximate dot product of the query with every row
+        """
+        if not self.size:
+            return array('d')
+
+        query_scale, components = _quantize(query)
+        total = 0
+        for column, component in zip(self.columns, components):
+            total += column * (component + 128)
+
+        raw = array('I' if array('I').itemsize == self.FIELD_BYTES else 'L')
+        raw.frombytes(total.to_bytes(self.FIELD_BYTES * self.size, 'little'))
+        if sys.byteorder == 'big':
+            raw.byteswap()
+
+        base = 128.0 * sum(components) + self.dim * 128.0 * 128.0
+        return array('d', [
+            ((value - base) * scale - offset_sum) * query_scale
+            for value, scale, offset_sum in zip(raw, self.scales, self.offset_sums)
+        ])
+
+
+class EmbeddingIndex:
+    """
+    IVF approximate nearest-neighbour index over unit float32 vectors.
+
+    Vectors live in one flat float32 array. Once the index holds
+    `min_ivf_vectors`, k-means splits it into about sqrt(n) lists and a
+    query scans only the lists of its `probe_fraction` closest centroids;
+    smaller indexes are one list. Lists are scanned with `PackedVectors`
+    and the best candidates re-ranked with exact float32 dot products.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, min_ivf_vectors: int = None,
+                 probe_fraction: float = None, seed: int = 0):
+        self.dim = dim
+        self.min_ivf_vectors = min_ivf_vectors or int(os.environ.get("EMBEDDING_IVF_MIN_VECTORS", 2000))
+        self.probe_fraction = probe_fraction or float(os.environ.get("EMBEDDING_IVF_PROBE_FRACTION", 0.2))
+        self.seed = seed
+
+        self.vectors = array('f')
+        self.doc_ids: List[Optional[int]] = []
+        self._positions: Dict[int, int] = {}
+
+        self._centroids: Optional[PackedVectors] = None
+        self._centroid_rows = b''  # float32 centroids, kept for snapshots
+        self._lists: List[List[int]] = [[]]
+        self._packed: List[Optional[Tuple[List[int], PackedVectors]]] = [None]
+        self._assignment: Dict[int, int] = {}
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, items: Sequence[Tuple[int, Sequence[float]]], **kwargs) -> 'EmbeddingIndex':
+        """
+        Build an index from (doc_id, vector) pairs, partitioning it once
+        """
+        index = cls(**kwargs)
+        for doc_id, vector in items:
+            index._positions[doc_id] = len(index.doc_ids)
+            index.doc_ids.append(doc_id)
+            index.vectors.extend(vector)
+        index._train()
+        return index
+
+    @classmethod
+    def from_snapshot(cls, buffer, **kwargs) -> 'EmbeddingIndex':
+        """
+        Open an index over `to_snapshot` bytes without copying or retraining.
+
+        Vectors stay in the (usually memory-mapped) buffer until the index is
+        first modified; only ids, list membership and centroids are unpacked.
+        """
+        view = memoryview(buffer)
+        magic, dim, size, n_lists = SNAPSHOT_HEADER.unpack_from(view, 0)
+        index = cls(**kwargs)
+        if magic != SNAPSHOT_MAGIC or dim != index.dim:
+            raise ValueError("Not an embedding index snapshot for this dimension")
+
+        offset = SNAPSHOT_HEADER.size
+        doc_ids = view[offset:offset + 8 * size].cast('q')
+        offset += 8 * size
+        index.vectors = view[offset:offset + 4 * size * dim].cast('f')
+        offset += 4 * size * dim
+        assignment = view[offset:offset + 4 * size].cast('I')
+        offset += 4 * size + -4 * size % 8
+        centroids = view[offset:offset + 4 * n_lists * dim].cast('f')
+
+        index.doc_ids = doc_ids.tolist()
+        index._positions = {doc_id: position for position, doc_id in enumerate(index.doc_ids)}
+        index._trained_size = size
+        index._assignment = dict(enumerate(assignment))
+        index._lists = [[] for _ in range(max(n_lists, 1))]
+        for position, list_id in enumerate(assignment):
+            index._lists[list_id].append(position)
+        index._packed = [None] * len(index._lists)
+        if n_lists:
+            index._centroids = PackedVectors([centroids[i * dim:(i + 1) * dim] for i in range(n_lists)])
+            index._centroid_rows = centroids.tobytes()
+        return index
+
+    def to_snapshot(self) -> bytes:
+        """
+        Index bytes for `from_snapshot`; removed slots are compacted away first
+        """
+        with self._lock:
+            if len(self.doc_ids) != len(self._positions):
+                self._train()
+
+            size = len(self.doc_ids)
+            n_lists = len(self._lists) if self._centroids is not None else 0
+            assignment = array('I', (self._assignment[position] for position in range(size)))
+            if assignment.itemsize != 4:
+                raise ValueError("Unsupported platform integer size")
+
+            out = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.dim, size, n_lists))
+            out += array('q', self.doc_ids).tobytes()
+            out += memoryview(self.vectors).cast('B')
+            out += assignment.tobytes()
+            out += b'\0' * (-len(assignment.tobytes()) % 8)
+            if n_lists:
+                out += self._centroid_rows
+            return bytes(out)
+
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes held privately: owned vectors, packed lists and id maps
+        """
+        vectors = len(self.vectors) * 4 if isinstance(self.vectors, array) else 0
+        packed = sum(len(entry[0]) * self.dim * PackedVectors.FIELD_BYTES
+                     for entry in self._packed if entry is not None)
+        return vectors + packed + 200 * len(self.doc_ids)
+
+    def add(self, doc_id: int, vector: Sequence[float]) -> None:
+        """
+        Index a vector, replacing any previous one with the same id
+        """
+        with self._lock:
+            if not isinstance(self.vectors, array):
+                # Copy a snapshot's vectors out of the read-only mapping on first write
+                vectors = array('f')
+                vectors.frombytes(self.vectors.cast('B'))
+                self.vectors = vectors
+            self.remove(doc_id)
+            position = len(self.doc_ids)
+            self.vectors.extend(vector)
+            self.doc_ids.append(doc_id)
+            self._positions[doc_id] = position
+
+            if self._centroids is None and len(self._positions) >= self.min_ivf_vectors or \
+                    self._centroids is not None and len(self._positions) > 4 * self._trained_size:
+                self._train()
+                return
+
+            list_id = self._nearest_list(vector)
+            self._lists[list_id].append(position)
+            self._assignment[position] = list_id
+            self._packed[list_id] = None
+
+    def remove(self, doc_id: int) -> None:
+        """
+        Drop a vector; its slot is reclaimed when the index is next reorganized
+        """
+        with self._lock:
+            position = self._positions.pop(doc_id, None)
+            if position is None:
+                return
+            self.doc_ids[position] = None
+            self._packed[self._assignment.pop(position)] = None
+
+            if len(self.doc_ids) > 2 * len(self._positions) + 64:
+                self._train()
+
+    def search(self, query: Sequence[float], k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Top-k (doc_id, cosine similarity) pairs, best first
+        """
+        with self._lock:
+            if not self._positions:
+                return []
+
+            if self._centroids is None:
+                probes = [0]
+            else:
+                n_probes = max(1, math.ceil(len(self._lists) * self.probe_fraction))
+                centroid_scores = self._centroids.scores(query)
+                probes = heapq.nlargest(n_probes, range(len(centroid_scores)), key=centroid_scores.__getitem__)
+
+            candidates = []
+            for list_id in probes:
+                positions, packed = self._packed_list(list_id)
+                candidates.extend(zip(positions, packed.scores(query)))
+
+            shortlist = heapq.nlargest(max(4 * k, 16), candidates, key=itemgetter(1))
+            view = memoryview(self.vectors)
+            dim = self.dim
+            query = list(query)
+            exact = [
+                (self.doc_ids[position], sum(map(mul, query, view[position * dim:(position + 1) * dim])))
+                for position, _ in shortlist
+            ]
+            return heapq.nlargest(k, exact, key=itemgetter(1))
+
+    def _row(self, position: int) -> memoryview:
+        return memoryview(self.vectors)[position * self.dim:(position + 1) * self.dim]
+
+    def _nearest_list(self, vector: Sequence[float]) -> int:
+        if self._centroids is None:
+            return 0
+        scores = self._centroids.scores(vector)
+        return max(range(len(scores)), key=scores.__getitem__)
+
+    def _packed_list(self, list_id: int) -> Tuple[List[int], PackedVectors]:
+        packed = self._packed[list_id]
+        if packed is None:
+            positions = [position for position in self._lists[list_id] if self.doc_ids[position] is not None]
+            packed = (positions, PackedVectors([self._row(position) for position in positions]))
+            self._lists[list_id] = positions
+            self._packed[list_id] = packed
+        return packed
+
+    def _compact(self) -> None:
+        """
+        Drop the slots of removed vectors
+        """
+        vectors = array('f')
+        doc_ids: List[int] = []
+        for position, doc_id in enumerate(self.doc_ids):
+            if doc_id is not None:
+                vectors.extend(self._row(position))
+                doc_ids.append(doc_id)
+        self.vectors = vectors
+        self.doc_ids = doc_ids
+        self._positions = {doc_id: position for position, doc_id in enumerate(doc_ids)}
+
+    def _train(self, iterations: int = 4) -> None:
+        """
+        Compact the index and re-partition it with spherical k-means, trained
+        on a sample of at most 32 vectors per list
+        """
+        self._compact()
+        size = len(self.doc_ids)
+        self._trained_size = size
+
+        if size < self.min_ivf_vectors:
+            self._centroids = None
+            self._centroid_rows = b''
+            self._lists = [list(range(size))]
+            self._packed = [None]
+            self._assignment = dict.fromkeys(range(size), 0)
+            return
+
+        n_lists = int(math.sqrt(size))
+        rng = random.Random(self.seed)
+        sample = rng.sample(range(size), min(size, 32 * n_lists))
+        centroids = [self._row(position).tolist() for position in sample[:n_lists]]
+        sample_rows = PackedVectors([self._row(position) for position in sample])
+
+        for _ in range(iterations):
+            assignment = self._assign(sample_rows, centroids)
+            sums = [[0.0] * self.dim for _ in centroids]
+            for index, list_id in enumerate(assignment):
+                row_sum = sums[list_id]
+                for d, x in enumerate(self._row(sample[index])):
+                    row_sum[d] += x
+            for list_id, row_sum in enumerate(sums):
+                norm = math.sqrt(sum(x * x for x in row_sum))
+                if norm:
+                    centroids[list_id] = [x / norm for x in row_sum]
+
+        assignment = self._assign(PackedVectors([self._row(position) for position in range(size)]), centroids)
+        self._centroids = PackedVectors(centroids)
+        self._centroid_rows = array('f', [x for centroid in centroids for x in centroid]).tobytes()
+        self._lists = [[] for _ in centroids]
+        for position, list_id in enumerate(assignment):
+            self._lists[list_id].append(position)
+        self._packed = [None] * len(centroids)
+        self._assignment = dict(enumerate(assignment))
+
+    @staticmethod
+    def _assign(rows: PackedVectors, centroids: List[List[float]]) -> List[int]:
+        """
+        Index of the closest centroid for every row
+        """
+        best_scores = array('d', [-math.inf]) * rows.size
+        best = [0] * rows.size
+        for list_id, centroid in enumerate(centroids):
+            for index, score in enumerate(rows.scores(centroid)):
+                if score > best_scores[index]:
+                    best_scores[index] = score
+                    best[index] = list_id
+        return best
+
+    def __len__(self) -> int:
+        return len(self._positions)
@@ -0,0 +1,149 @@
+import json
+import base64
+import codecs
+import zipfile
+from typing import Any, Dict, Iterator
+from xml.etree import ElementTree
+
+from services.embedding_index import embed_tokens
+from services.minhash import content_hash, minhash_signature
+from utils.normalizer import NORMALIZER_VERSION
+from utils.text_processing import iter_chunks, tokenize, term_frequencies
+
+# This module runs inside ingestion worker processes, so it must not import the app
+
+READ_BLOCK_BYTES = 64 * 1024
+PREVIEW_CHARS = 500
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class ExtractionError(Exception):
+    """
+    Raised when a file cannot be turned into text
+    """
+    pass
+
+
+def chunk_record(content: str) -> Dict[str, Any]:
+    """
+    Retrieval fields of a knowledge chunk, computed from its text
+    """
+    tokens = tokenize(content)
+    return {
+        'tokens': " ".join(tokens),
+        'normalizer_version': NORMALIZER_VERSION,
+        'token_count': len(tokens),
+        'term_freqs': term_frequencies(tokens),
+        'embedding': embed_tokens(tokens).tobytes(),
+        'content_hash': content_hash(tokens),
+        'minhash': minhash_signature(tokens).tobytes(),
+    }
+
+
+def iter_text(path: str, file_type: str) -> Iterator[str]:
+    """
+    Stream the text of an uploaded file in pieces
+    """
+    if file_type == 'text':
+        return _iter_txt(path)
+    if file_type == 'docx':
+        return _iter_docx(path)
+    if file_type == 'pdf':
+        return _iter_pdf(path)
+    raise ExtractionError(f"Unsupported file type: {file_type}")
+
+
+def _iter_txt(path: str) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(READ_BLOCK_BYTES)
+                if not block:
+                    break
+                text = decoder.decode(block)
+                if text:
+                    yield text
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+    except UnicodeDecodeError:
+        raise ExtractionError("Error reading text file. Please ensure it is UTF-8 encoded.")
+
+
+def _iter_docx(path: str) -> Iterator[str]:
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ExtractionError("Not a valid .docx file")
+
+    with archive:
+        try:
+            document = archive.open('word/document.xml')
+        except KeyError:
+            raise ExtractionError("Not a valid .docx file: word/document.xml is missing")
+        yield from _iter_docx_paragraphs(document)
+
+
+def _iter_docx_paragraphs(document) -> Iterator[str]:
+    with document:
+        parts = []
+        # Paragraphs are emitted and cleared as they close, so the XML tree never builds up
+        for _, element in ElementTree.iterparse(document, events=('end',)):
+            tag = element.tag
+            if tag == _WORD_NS + 't':
+                parts.append(element.text or '')
+            elif tag == _WORD_NS + 'tab':
+                parts.append('\t')
+            elif tag in (_WORD_NS + 'br', _WORD_NS + 'cr'):
+                parts.append('\n')
+            elif tag == _WORD_NS + 'p':
+                parts.append('\n')
+                yield ''.join(parts)
+                parts = []
+                element.clear()
+
+
+def _iter_pdf(path: str) -> Iterator[str]:
+    from pypdf import PdfReader
+    from pypdf.errors import PdfReadError
+
+    try:
+        reader = PdfReader(path)
+        for page in reader.pages:
+            yield (page.extract_text() or '') + '\n'
+    except PdfReadError as e:
+        raise ExtractionError(f"Not a readable PDF file: {e}")
+
+
+def extract_chunks(source_path: str, file_type: str, out_path: str, prefix: str = "",
+                   chunk_size: int = 1000, overlap: int = 200) -> Dict[str, Any]:
+    """
+    Ingestion process entry point: stream text out of a file, chunk and
+    tokenize it, and append one JSON line per chunk to `out_path` as it goes
+    so the parent can index chunks while extraction is still running
+    """
+    def pieces():
+        if prefix:
+            yield prefix + "\n\n"
+        yield from iter_text(source_path, file_type)
+
+    count = 0
+    preview = ""
+    with open(out_path, 'a', encoding='utf-8') as out:
+        for position, content in enumerate(iter_chunks(pieces(), chunk_size, overlap)):
+            record = chunk_record(content)
+            for field in ('embedding', 'minhash'):
+                record[field] = base64.b64encode(record[field]).decode('ascii')
+            record['position'] = position
+            record['content'] = content
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if position % 50 == 0:
+                out.flush()
+
+            if not preview:
+                preview = content[:PREVIEW_CHARS]
+            count += 1
+
+    return {'chunks': count, 'preview': preview}
@@ -0,0 +1,61 @@
+import os
+import threading
+from typing import Dict, Optional
+
+import httpx
+from google import genai
+from google.genai import types
+
+from utils import metrics
+
+_clients: Dict[Optional[str], genai.Client] = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    """
+    Forked workers must not share the parent's sockets; drop inherited clients
+    so each child lazily builds its own pool
+    """
+    global _clients, _lock
+    _clients = {}
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _create_client(api_key: Optional[str]) -> genai.Client:
+    pool_size = int(os.environ.get("GENAI_POOL_SIZE", 20))
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=float(os.environ.get("GENAI_KEEPALIVE_SECONDS", 60))
+    )
+    http_options = types.HttpOptions(
+        client_args={'limits': limits},
+        async_client_args={'limits': limits}
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def get_genai_client(api_key: Optional[str] = None) -> genai.Client:
+    """
+    Return the process-wide Gemini client for an API key.
+
+    The client (and its keep-alive HTTP connection pool) is created on first
+    use in each process and shared by all threads afterwards.
+    """
+    api_key = api_key or os.environ.get("GOOGLE_GENAI_API_KEY")
+
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _create_client(api_key)
+            _clients[api_key] = client
+            metrics.increment('genai.clients_created')
+        else:
+            # A lookup served by an existing client, not a count of reused connections
+            metrics.increment('genai.client_registry_hits')
+        return client
@@ -0,0 +1,98 @@
+import os
+import mmap
+import struct
+import logging
+import tempfile
+from typing import Optional
+
+from utils.normalizer import NORMALIZER_VERSION
+
+MAGIC = b'BSNAP001'
+# magic, index kind, bot id, knowledge base version, normalizer version
+HEADER = struct.Struct('<8s8sQQQ')
+
+
+class SnapshotStore:
+    """
+    Immutable per-bot index snapshots on local disk.
+
+    A snapshot is one file per (bot, kb_version, kind), named by version and
+    prefixed with a header that is checked again on open, so a worker never
+    serves an index built for another version or normalizer. Files are
+    memory-mapped: a cold worker starts answering without reading the
+    knowledge base from the database, and every worker on the host shares
+    the pages of the same file.
+
+    Kinds are short names that fit the header's 8-byte field ('tfidf',
+    'bm25', 'embed').
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, kind: str, bot_id: int, kb_version: int) -> str:
+        # Token streams change with the normalizer, so its version is part of the name
+        return os.path.join(self.directory, f"bot_{bot_id}_v{kb_version}_n{NORMALIZER_VERSION}.{kind}")
+
+    def open(self, kind: str, bot_id: int, kb_version: int) -> Optional[memoryview]:
+        """
+        Memory-map a snapshot and return its payload, or None if there is no valid one
+        """
+        path = self.path(kind, bot_id, kb_version)
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped
+            return None
+
+        view = memoryview(buffer)
+        if len(view) < HEADER.size or \
+                HEADER.unpack_from(view, 0) != self._header(kind, bot_id, kb_version):
+            logging.warning(f"Ignoring invalid index snapshot {path}")
+            return None
+        return view[HEADER.size:]
+
+    def write(self, kind: str, bot_id: int, kb_version: int, payload: bytes) -> bool:
+        """
+        Write a snapshot atomically, so concurrent readers never see a partial
+        file, and remove the bot's snapshots of other versions. Returns False
+        if the disk is not writable; callers then keep the index in memory.
+        """
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(*self._header(kind, bot_id, kb_version)))
+                f.write(payload)
+            os.replace(tmp_path, self.path(kind, bot_id, kb_version))
+        except OSError as e:
+            logging.warning(f"Could not write {kind} index snapshot for bot {bot_id}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self.remove_stale(bot_id, kb_version)
+        return True
+
+    def remove_stale(self, bot_id: int, keep_version: int) -> None:
+        """
+        Delete a bot's snapshots of other versions. Workers that still have
+        one mapped keep reading it; the pages go away with the last mapping.
+        """
+        prefix = f"bot_{bot_id}_v"
+        keep = f"bot_{bot_id}_v{keep_version}_n{NORMALIZER_VERSION}."
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.startswith(prefix) and not name.startswith(keep):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    logging.warning(f"Could not remove stale index snapshot {name}: {e}")
+
+    @staticmethod
+    def _header(kind: str, bot_id: int, kb_version: int):
+        return MAGIC, kind.encode('ascii').ljust(8, b'\0'), bot_id, kb_version, NORMALIZER_VERSION
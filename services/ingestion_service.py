@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import base64
+import logging
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, insert, or_, update
+
+from app import db
+from models import Bot, IngestionJob, KnowledgeBase, KnowledgeChunk
+from services.extraction import extract_chunks
+from services.knowledge_service import knowledge_service
+from utils import metrics
+
+FILE_TYPES = {
+    '.txt': 'text',
+    '.docx': 'docx',
+    '.pdf': 'pdf',
+}
+
+
+def detect_file_type(filename: str) -> Optional[str]:
+    """
+    Ingestion file type for an upload name, or None if it cannot be extracted
+    """
+    return FILE_TYPES.get(os.path.splitext(filename or '')[1].lower())
+
+
+class IngestionService:
+    """
+    Extracts and indexes uploaded knowledge base files in the background.
+
+    Uploads are streamed to disk by the request, which only records an
+    IngestionJob. Extraction, chunking and tokenizing run in a process pool
+    that appends finished chunks to a JSON-lines spool file; a driver thread
+    tails that file and bulk-inserts chunks while extraction is still going,
+    so neither process ever holds a whole document in memory.
+
+    Jobs are claimed with a conditional status update and keep a heartbeat
+    while running, so jobs orphaned by a stopped process are picked up again
+    by recover() in any process that has the upload on disk.
+    """
+
+    def __init__(self, app, processes: Optional[int] = None, batch_size: int = 200):
+        self.app = app
+        self.processes = processes or int(os.environ.get("INGEST_PROCESSES", 2))
+        self.batch_size = batch_size
+        self.poll_interval = 0.2
+        self.heartbeat_interval = 30.0
+        # Running jobs without a heartbeat for this long, and pending jobs this old, are recovered
+        self.stale_after = int(os.environ.get("INGEST_STALE_SECONDS", 300))
+        self.pid = os.getpid()
+
+        self._extractors = self._new_extractors()
+        self._extractors_lock = threading.Lock()
+        self._drivers = ThreadPoolExecutor(max_workers=self.processes, thread_name_prefix='ingest')
+        self._recovery = None
+        self._stop = threading.Event()
+
+    def _new_extractors(self) -> ProcessPoolExecutor:
+        # Spawned rather than forked: web processes run threads and event loops
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def _reset_extractors(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Replace a pool whose worker died; other jobs on it fail and can be uploaded again
+        """
+        with self._extractors_lock:
+            if self._extractors is broken:
+                logging.warning("Ingestion process pool broke, starting a new one")
+                metrics.increment('ingest.pool_resets')
+                self._extractors = self._new_extractors()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def upload_dir(self) -> str:
+        directory = os.environ.get("KB_UPLOAD_DIR") or os.path.join(self.app.instance_path, "uploads")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def create_job(self, bot, kb: KnowledgeBase, upload, file_type: str) -> IngestionJob:
+        """
+        Stream an upload to disk and record a pending job; the caller commits and submits
+        """
+        source_path = os.path.join(self.upload_dir(), f"{uuid.uuid4().hex}{os.path.splitext(upload.filename)[1].lower()}")
+        # FileStorage.save copies in blocks, so the upload is never read whole
+        upload.save(source_path)
+
+        job = IngestionJob()
+        job.filename = upload.filename
+        job.file_type = file_type
+        job.source_path = source_path
+        job.bot_id = bot.id
+        job.knowledge_base = kb
+        db.session.add(job)
+        return job
+
+    def submit(self, job_id: int) -> Future:
+        metrics.increment('ingest.jobs_submitted')
+        return self._drivers.submit(self._run, job_id)
+
+    def start_recovery(self) -> None:
+        """
+        Recover orphaned jobs now and every `stale_after` seconds from a background thread
+        """
+        if self._recovery is None:
+            self._recovery = threading.Thread(target=self._recover_loop, name="ingest-recovery", daemon=True)
+            self._recovery.start()
+
+    def _recover_loop(self) -> None:
+        while True:
+            try:
+                self.recover()
+            except Exception as e:
+                logging.error(f"Ingestion job recovery failed: {e}")
+            if self._stop.wait(self.stale_after):
+                return
+
+    def recover(self) -> int:
+        """
+        Re-queue pending jobs that were never started and running jobs whose
+        heartbeat stopped, discarding the chunks a dead run had inserted.
+        Jobs whose upload is not on this host's disk are failed instead.
+        Returns the number of jobs re-queued.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        requeued = []
+        with self.app.app_context():
+            try:
+                stale = IngestionJob.query.filter(or_(
+                    and_(IngestionJob.status == 'pending', IngestionJob.created_at < cutoff),
+                    and_(IngestionJob.status == 'running',
+                         or_(IngestionJob.heartbeat_at < cutoff, IngestionJob.heartbeat_at.is_(None)))
+                )).all()
+
+                for job in stale:
+                    if not job.source_path or not os.path.exists(job.source_path):
+                        logging.warning(f"Ingestion job {job.id} was interrupted and its upload is gone")
+                        self._fail(job.id, "Processing was interrupted; please upload the file again")
+                        continue
+
+                    if job.status == 'running':
+                        # Only one process may take over a dead run
+                        taken = IngestionJob.query.filter(
+                            IngestionJob.id == job.id,
+                            IngestionJob.status == 'running',
+                            or_(IngestionJob.heartbeat_at < cutoff, IngestionJob.heartbeat_at.is_(None))
+                        ).update({'status': 'pending', 'chunks_indexed': 0, 'duplicate_chunks': 0},
+                                 synchronize_session=False)
+                        if not taken:
+                            db.session.rollback()
+                            continue
+                        KnowledgeChunk.query.filter_by(
+                            knowledge_base_id=job.knowledge_base_id
+                        ).delete(synchronize_session=False)
+                        db.session.commit()
+                        # The dead run's chunks may be in this process's duplicate index
+                        knowledge_service.forget_near_duplicate_index(job.bot_id)
+
+                    requeued.append(job.id)
+            finally:
+                db.session.remove()
+
+        for job_id in requeued:
+            logging.warning(f"Re-queueing interrupted ingestion job {job_id}")
+            metrics.increment('ingest.jobs_recovered')
+            self.submit(job_id)
+        return len(requeued)
+
+    def _claim(self, job_id: int) -> bool:
+        now = datetime.utcnow()
+        claimed = IngestionJob.query.filter_by(id=job_id, status='pending').update(
+            {'status': 'running', 'started_at': now, 'heartbeat_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+        return bool(claimed)
+
+    def _run(self, job_id: int) -> None:
+        with self.app.app_context():
+            # Another process may have recovered this job already
+            if not self._claim(job_id):
+                db.session.remove()
+                return
+            job = db.session.get(IngestionJob, job_id)
+
+            spool_path = f"{job.source_path}.chunks.jsonl"
+            source_path = job.source_path
+            extractors = self._extractors
+            try:
+                kb = job.knowledge_base
+                # Text typed alongside the upload goes in front of the file's text
+                prefix = kb.content or ''
+
+                # The spool file must exist before the extractor starts appending to it
+                open(spool_path, 'w').close()
+                future = extractors.submit(
+                    extract_chunks, job.source_path, job.file_type, spool_path, prefix,
+                    knowledge_service.chunk_size, knowledge_service.overlap
+                )
+                bot = db.session.get(Bot, job.bot_id)
+                lsh = knowledge_service.near_duplicate_index(bot)
+                self._consume(job, kb, spool_path, future, lsh)
+                result = future.result()
+                if not result['chunks']:
+                    raise ValueError("No text could be extracted from the file")
+                if job.duplicate_chunks == result['chunks']:
+                    raise ValueError("The file's content is already in the knowledge base")
+
+                kb.content = result['preview']
+                job.status = 'done'
+                job.finished_at = datetime.utcnow()
+                knowledge_service.publish_bulk_change(bot)
+                metrics.increment('ingest.jobs_done')
+                logging.info(f"Ingested {job.filename} for bot {job.bot_id} "
+                             f"({job.chunks_indexed} chunks, {job.duplicate_chunks} duplicates)")
+
+                try:
+                    knowledge_service.warm_indexes(bot)
+                except Exception as e:
+                    # The job is already published; workers build the indexes on first use instead
+                    logging.warning(f"Could not warm indexes for bot {job.bot_id}: {e}")
+
+            except BrokenProcessPool as e:
+                logging.error(f"Ingestion job {job_id} failed: extraction process died ({e})")
+                self._reset_extractors(extractors)
+                db.session.rollback()
+                self._fail(job_id, "The file could not be processed")
+
+            except Exception as e:
+                logging.error(f"Ingestion job {job_id} failed: {e}")
+                db.session.rollback()
+                self._fail(job_id, str(e))
+
+            finally:
+                for path in (spool_path, source_path):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                db.session.remove()
+
+    def _fail(self, job_id: int, error: str) -> None:
+        """
+        Mark a job failed and remove its knowledge base item along with any chunks
+        """
+        metrics.increment('ingest.jobs_failed')
+        job = db.session.get(IngestionJob, job_id)
+        # Chunks of this job may already be in the duplicate index
+        knowledge_service.forget_near_duplicate_index(job.bot_id)
+        if job.knowledge_base is not None:
+            db.session.delete(job.knowledge_base)
+        job.status = 'failed'
+        job.error = error[:500]
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        if job.source_path and os.path.exists(job.source_path):
+            os.remove(job.source_path)
+
+    def _consume(self, job: IngestionJob, kb: KnowledgeBase, spool_path: str, future: Future, lsh) -> None:
+        """
+        Tail the spool file, inserting chunks in batches as the extractor writes them
+        """
+        rows: List[Dict[str, Any]] = []
+        pending = b''
+        extraction_done = False
+
+        last_heartbeat = time.monotonic()
+        with open(spool_path, 'rb') as spool:
+            while True:
+                if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                    job.heartbeat_at = datetime.utcnow()
+                    db.session.commit()
+                    last_heartbeat = time.monotonic()
+
+                line = spool.readline()
+                if line:
+                    pending += line
+                    if pending.endswith(b'\n'):
+                        rows.append(self._chunk_row(job, kb, json.loads(pending)))
+                        pending = b''
+                        if len(rows) >= self.batch_size:
+                            self._insert(job, rows, lsh)
+                            rows = []
+                    continue
+
+                if extraction_done:
+                    break
+                if rows:
+                    self._insert(job, rows, lsh)
+                    rows = []
+                if future.done():
+                    # One more pass picks up anything written just before exit
+                    extraction_done = True
+                    continue
+                time.sleep(self.poll_interval)
+
+        if rows:
+            self._insert(job, rows, lsh)
+
+    @staticmethod
+    def _chunk_row(job: IngestionJob, kb: KnowledgeBase, record: Dict[str, Any]) -> Dict[str, Any]:
+        for field in ('embedding', 'minhash'):
+            record[field] = base64.b64decode(record[field])
+        record['knowledge_base_id'] = kb.id
+        record['bot_id'] = job.bot_id
+        record['created_at'] = datetime.utcnow()
+        return record
+
+    def _insert(self, job: IngestionJob, rows: List[Dict[str, Any]], lsh) -> None:
+        """
+        Insert a batch of chunks and flag the ones duplicating earlier content
+        """
+        ids = db.session.scalars(
+            insert(KnowledgeChunk).returning(KnowledgeChunk.id, sort_by_parameter_order=True), rows
+        ).all()
+        duplicates = knowledge_service.find_duplicates(lsh, ids, rows)
+        if duplicates:
+            db.session.execute(update(KnowledgeChunk), [
+                {'id': chunk_id, 'duplicate_of_id': original_id} for chunk_id, original_id in duplicates.items()
+            ])
+
+        job.heartbeat_at = datetime.utcnow()
+        job.chunks_indexed = (job.chunks_indexed or 0) + len(rows)
+        job.duplicate_chunks = (job.duplicate_chunks or 0) + len(duplicates)
+        db.session.commit()
+        metrics.increment('ingest.chunks', len(rows))
+
+    def close(self) -> None:
+        self._stop.set()
+        self._drivers.shutdown(wait=False, cancel_futures=True)
+        self._extractors.shutdown(wait=False, cancel_futures=True)
+
+
+_service: Optional[IngestionService] = None
+_service_lock = threading.Lock()
+
+
+def get_ingestion_service(app) -> IngestionService:
+    """
+    Return this process's ingestion service, creating it on first use
+    """
+    global _service
+    with _service_lock:
+        if _service is None or _service.pid != os.getpid():
+            _service = IngestionService(app)
+            atexit.register(_service.close)
+        return _service
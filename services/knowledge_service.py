@@ -0,0 +1,494 @@
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import LargeBinary, cast, func, or_, select
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import IngestionJob, KnowledgeBase, KnowledgeChunk
+from services.bm25_index import BM25Index
+from services.bot_cache import bot_config_cache
+from services.embedding_index import EmbeddingIndex, embed_tokens, vector_from_bytes
+from services.extraction import chunk_record
+from services.minhash import MinHashLSH, content_hash, signature_from_bytes
+from services.retrievers import build_retrievers
+from services.index_snapshots import SnapshotStore
+from services.tfidf_index import TfidfIndex
+from utils import metrics
+from utils.lru import LRUCache
+from utils.normalizer import NORMALIZER_VERSION
+from utils.text_processing import chunk_text, tokenize
+
+# Upload states whose chunks are not published yet
+UNFINISHED_JOB_STATUSES = ('pending', 'running')
+
+
+class KnowledgeService:
+    """
+    Splits knowledge base items into chunks at save time and retrieves the
+    chunks most relevant to a user message at answer time.
+    """
+
+    def __init__(self, chunk_size: int = None, overlap: int = None, top_k: int = None):
+        self.chunk_size = chunk_size or int(os.environ.get("KB_CHUNK_SIZE", 1000))
+        self.overlap = overlap or int(os.environ.get("KB_CHUNK_OVERLAP", 200))
+        self.top_k = top_k or int(os.environ.get("KB_TOP_K", 4))
+        # Knowledge bases with at least this many chunks are served from a
+        # memory-mapped TF-IDF index shared by all workers
+        self.tfidf_min_chunks = int(os.environ.get("TFIDF_MIN_CHUNKS", 2000))
+
+        # (bot_id, kb_version) pairs whose items are known to be chunked
+        self._chunked: Set[Tuple[int, int]] = set()
+        # (kind, bot_id) -> (kb_version, index), kind being 'lexical' (BM25Index
+        # or TfidfIndex), 'embedding' or 'minhash'. Bounded by count and by the
+        # indexes' private memory; idle bots are evicted first.
+        self._indexes = LRUCache(
+            maxsize=int(os.environ.get("KB_INDEX_CACHE_SIZE", 500)) * 3,
+            maxweight=int(os.environ.get("KB_INDEX_MEMORY_MB", 256)) * 1024 * 1024,
+            weigh=lambda entry: entry[1].memory_usage()
+        )
+        self.near_duplicate_threshold = float(os.environ.get("KB_NEAR_DUPLICATE_THRESHOLD", 0.8))
+        self._lock = threading.Lock()
+
+        self.retrievers = build_retrievers(self)
+        self.default_strategy = os.environ.get("KB_RETRIEVAL_STRATEGY", "bm25")
+
+    def index_item(self, kb: KnowledgeBase) -> int:
+        """
+        (Re)build the chunks of a knowledge base item; the caller commits
+        """
+        kb.chunks = []
+        kb.content_hash = content_hash(tokenize(kb.content or ""))
+        db.session.flush()
+
+        for position, content in enumerate(chunk_text(kb.content or "", self.chunk_size, self.overlap)):
+            # Normalized once here; retrieval only ever reads the stored statistics
+            chunk = KnowledgeChunk(**chunk_record(content))
+            chunk.knowledge_base_id = kb.id
+            chunk.bot_id = kb.bot_id
+            chunk.position = position
+            chunk.content = content
+            kb.chunks.append(chunk)
+
+        return len(kb.chunks)
+
+    def find_duplicate_item(self, bot, content: str) -> Optional[KnowledgeBase]:
+        """
+        An existing item of the bot whose normalized text equals `content`
+        """
+        return KnowledgeBase.query.filter_by(
+            bot_id=bot.id, content_hash=content_hash(tokenize(content))
+        ).first()
+
+    def add_item(self, bot, kb: KnowledgeBase) -> None:
+        """
+        Save a new knowledge base item and index it
+        """
+        lsh = self.near_duplicate_index(bot)
+        db.session.add(kb)
+        self.index_item(kb)
+        self._mark_duplicates(lsh, kb.chunks)
+        self._commit_change(bot, [], kb.chunks)
+
+    def update_item(self, bot, kb: KnowledgeBase) -> None:
+        """
+        Re-chunk an edited knowledge base item and update the index in place
+        """
+        removed_ids = [chunk.id for chunk in kb.chunks]
+        lsh = self.near_duplicate_index(bot)
+        promoted = self._release_chunks(bot, lsh, removed_ids)
+        self.index_item(kb)
+        self._mark_duplicates(lsh, promoted + kb.chunks)
+        self._commit_change(bot, removed_ids, promoted + kb.chunks)
+
+    def delete_item(self, bot, kb: KnowledgeBase) -> None:
+        """
+        Delete a knowledge base item and drop its chunks from the index
+        """
+        removed_ids = [chunk.id for chunk in kb.chunks]
+        lsh = self.near_duplicate_index(bot)
+        promoted = self._release_chunks(bot, lsh, removed_ids)
+        db.session.delete(kb)
+        self._mark_duplicates(lsh, promoted)
+        self._commit_change(bot, removed_ids, promoted)
+
+    def _commit_change(self, bot, removed_ids: List[int], added: List[KnowledgeChunk]) -> None:
+        """
+        Commit a knowledge base change under a new version.
+
+        This process's in-memory indexes are patched incrementally; other
+        processes see the version bump and rebuild theirs on next use.
+        """
+        previous_version = bot.kb_version
+        bot.bump_kb_version()
+        try:
+            db.session.commit()
+        except Exception:
+            # The duplicate index was patched ahead of the commit
+            self.forget_near_duplicate_index(bot.id)
+            raise
+        bot_config_cache.invalidate(bot.id)
+
+        # Another process committed a change in between: the indexes of
+        # previous_version lack it, so they are rebuilt on next use instead
+        if bot.kb_version != previous_version + 1:
+            self.forget_near_duplicate_index(bot.id)
+            return
+
+        added = [chunk for chunk in added if chunk.duplicate_of_id is None]
+
+        # Mapped TF-IDF snapshots are immutable and are left to be replaced
+        index = self._cached('lexical', bot.id, previous_version)
+        if isinstance(index, BM25Index):
+            for chunk_id in removed_ids:
+                index.remove(chunk_id)
+            for chunk in added:
+                index.add(chunk.id, chunk.term_freqs, chunk.token_count)
+            self._indexes.set(('lexical', bot.id), (bot.kb_version, index))
+
+        index = self._cached('embedding', bot.id, previous_version)
+        if index is not None:
+            for chunk_id in removed_ids:
+                index.remove(chunk_id)
+            for chunk in added:
+                index.add(chunk.id, vector_from_bytes(chunk.embedding))
+            self._indexes.set(('embedding', bot.id), (bot.kb_version, index))
+
+        index = self._cached('minhash', bot.id, previous_version)
+        if index is not None:
+            self._indexes.set(('minhash', bot.id), (bot.kb_version, index))
+
+        self._chunked.add((bot.id, bot.kb_version))
+
+    def retrieve(self, bot, query: str, k: int = None) -> List[str]:
+        """
+        Return the content of the top-k chunks for a query, best first
+        """
+        strategy = getattr(bot, 'retrieval_strategy', None) or self.default_strategy
+        retriever = self.retrievers.get(strategy) or self.retrievers['bm25']
+        top = retriever.search(bot, query, k or self.top_k)
+        return self._load_contents([chunk_id for chunk_id, _ in top])
+
+    def lexical_index(self, bot):
+        """
+        The bot's lexical index: BM25, or TF-IDF for large knowledge bases.
+
+        A cold worker maps the version's snapshot if one exists; otherwise it
+        builds the index from the stored chunk statistics and writes the
+        snapshot for the next worker.
+        """
+        index = self._cached('lexical', bot.id, bot.kb_version)
+        if index is not None:
+            return index
+
+        store = self.snapshots()
+        for kind in ('tfidf', 'bm25'):
+            buffer = store.open(kind, bot.id, bot.kb_version)
+            if buffer is not None:
+                try:
+                    index = TfidfIndex(buffer, store.path(kind, bot.id, bot.kb_version))
+                except ValueError as e:
+                    logging.warning(f"Discarding {kind} snapshot of bot {bot.id}: {e}")
+                    continue
+                metrics.increment('kb.snapshot_loads')
+                break
+        else:
+            index = self._build_lexical_index(bot)
+
+        self._indexes.set(('lexical', bot.id), (bot.kb_version, index))
+        return index
+
+    def embedding_index(self, bot) -> EmbeddingIndex:
+        """
+        The bot's embedding index for its current knowledge base version,
+        from its snapshot when there is one
+        """
+        index = self._cached('embedding', bot.id, bot.kb_version)
+        if index is not None:
+            return index
+
+        store = self.snapshots()
+        buffer = store.open('embed', bot.id, bot.kb_version)
+        if buffer is not None:
+            try:
+                index = EmbeddingIndex.from_snapshot(buffer)
+                metrics.increment('kb.snapshot_loads')
+            except ValueError as e:
+                logging.warning(f"Discarding embedding snapshot of bot {bot.id}: {e}")
+
+        if index is None:
+            self._ensure_chunked(bot)
+            self._ensure_embedded(bot)
+
+            rows = db.session.query(KnowledgeChunk.id, KnowledgeChunk.embedding).filter(
+                KnowledgeChunk.bot_id == bot.id,
+                KnowledgeChunk.duplicate_of_id.is_(None),
+                self._published(bot)
+            ).all()
+            index = EmbeddingIndex.build([(row.id, vector_from_bytes(row.embedding)) for row in rows])
+            store.write('embed', bot.id, bot.kb_version, index.to_snapshot())
+            metrics.increment('kb.index_builds')
+            logging.info(f"Built embedding index for bot {bot.id} ({len(index)} chunks, version {bot.kb_version})")
+
+        self._indexes.set(('embedding', bot.id), (bot.kb_version, index))
+        return index
+
+    def snapshots(self) -> SnapshotStore:
+        return SnapshotStore(os.environ.get("KB_INDEX_DIR") or os.path.join(current_app.instance_path, "indexes"))
+
+    def _cached(self, kind: str, bot_id: int, kb_version: int):
+        entry = self._indexes.get((kind, bot_id))
+        if entry is not None and entry[0] == kb_version:
+            return entry[1]
+        return None
+
+    def _build_lexical_index(self, bot):
+        """
+        Build the bot's lexical index from the database and snapshot it.
+
+        Small knowledge bases keep a BM25Index in this process, so edits can
+        patch it in place; the snapshot holds the same BM25 ranking with
+        precomputed impacts. Large ones are served from the TF-IDF snapshot.
+        """
+        self._ensure_chunked(bot)
+        store = self.snapshots()
+        query = db.session.query(
+            KnowledgeChunk.id, KnowledgeChunk.token_count, KnowledgeChunk.term_freqs
+        ).filter(
+            KnowledgeChunk.bot_id == bot.id,
+            KnowledgeChunk.duplicate_of_id.is_(None),
+            self._published(bot)
+        )
+        metrics.increment('kb.index_builds')
+
+        if query.count() >= self.tfidf_min_chunks:
+            rows = query.order_by(KnowledgeChunk.id).yield_per(1000)
+            payload = TfidfIndex.serialize((row.id, row.term_freqs) for row in rows)
+            buffer = store.open('tfidf', bot.id, bot.kb_version) \
+                if store.write('tfidf', bot.id, bot.kb_version, payload) else None
+            if buffer is not None:
+                index = TfidfIndex(buffer, store.path('tfidf', bot.id, bot.kb_version))
+            else:
+                index = TfidfIndex(payload)
+            logging.info(f"Wrote TF-IDF index for bot {bot.id} ({len(index)} chunks, version {bot.kb_version})")
+            return index
+
+        rows = query.all()
+        index = BM25Index()
+        for row in rows:
+            index.add(row.id, row.term_freqs, row.token_count)
+        store.write('bm25', bot.id, bot.kb_version,
+                    TfidfIndex.serialize(((row.id, row.term_freqs) for row in rows), scheme='bm25'))
+        logging.info(f"Built BM25 index for bot {bot.id} ({len(index)} chunks, version {bot.kb_version})")
+        return index
+
+    def near_duplicate_index(self, bot) -> MinHashLSH:
+        """
+        MinHash LSH over the bot's non-duplicate chunks for its current
+        knowledge base version; new chunks are checked against it at ingest
+        """
+        lsh = self._cached('minhash', bot.id, bot.kb_version)
+        if lsh is not None:
+            return lsh
+
+        lsh = MinHashLSH(threshold=self.near_duplicate_threshold)
+        rows = db.session.query(KnowledgeChunk.id, KnowledgeChunk.content_hash, KnowledgeChunk.minhash).filter(
+            KnowledgeChunk.bot_id == bot.id,
+            KnowledgeChunk.duplicate_of_id.is_(None),
+            KnowledgeChunk.minhash.isnot(None)
+        ).order_by(KnowledgeChunk.id).yield_per(1000)
+        for row in rows:
+            lsh.add(row.id, row.content_hash, signature_from_bytes(row.minhash))
+
+        self._indexes.set(('minhash', bot.id), (bot.kb_version, lsh))
+        return lsh
+
+    def forget_near_duplicate_index(self, bot_id: int) -> None:
+        self._indexes.pop(('minhash', bot_id))
+
+    def find_duplicates(self, lsh: MinHashLSH, ids: List[int], records: List[Dict]) -> Dict[int, int]:
+        """
+        Check freshly stored chunks, in order, against the duplicate index.
+
+        Returns {chunk_id: duplicate_of_id} for exact and near duplicates;
+        every other chunk is added to the index so later ones match it.
+        """
+        duplicates = {}
+        for chunk_id, record in zip(ids, records):
+            if not record.get('minhash'):
+                continue
+            signature = signature_from_bytes(record['minhash'])
+            match = lsh.find_duplicate(record['content_hash'], signature)
+            if match is not None and match[0] != chunk_id:
+                duplicates[chunk_id] = match[0]
+            else:
+                lsh.add(chunk_id, record['content_hash'], signature)
+
+        if duplicates:
+            metrics.increment('kb.duplicate_chunks', len(duplicates))
+        return duplicates
+
+    def _mark_duplicates(self, lsh: MinHashLSH, chunks: List[KnowledgeChunk]) -> int:
+        db.session.flush()
+        records = [{'content_hash': chunk.content_hash, 'minhash': chunk.minhash} for chunk in chunks]
+        duplicates = self.find_duplicates(lsh, [chunk.id for chunk in chunks], records)
+        for chunk in chunks:
+            chunk.duplicate_of_id = duplicates.get(chunk.id)
+        return len(duplicates)
+
+    def _release_chunks(self, bot, lsh: MinHashLSH, removed_ids: List[int]) -> List[KnowledgeChunk]:
+        """
+        Drop chunks about to be removed from the duplicate index and detach
+        the duplicates that pointed at them, which are returned for re-checking
+        """
+        for chunk_id in removed_ids:
+            lsh.remove(chunk_id)
+        if not removed_ids:
+            return []
+
+        orphans = KnowledgeChunk.query.filter(
+            KnowledgeChunk.bot_id == bot.id,
+            KnowledgeChunk.duplicate_of_id.in_(removed_ids),
+            ~KnowledgeChunk.id.in_(removed_ids)
+        ).order_by(KnowledgeChunk.id).all()
+        for chunk in orphans:
+            chunk.duplicate_of_id = None
+        db.session.flush()
+        return orphans
+
+    def dedup_stats(self, bot) -> Dict[str, int]:
+        """
+        Chunks and bytes of the bot's knowledge base kept out of the index as duplicates
+        """
+        if db.session.get_bind().dialect.name == 'postgresql':
+            size = func.octet_length(KnowledgeChunk.content)
+        else:
+            size = func.length(cast(KnowledgeChunk.content, LargeBinary))
+
+        total, duplicates, duplicate_bytes = db.session.query(
+            func.count(KnowledgeChunk.id),
+            func.count(KnowledgeChunk.duplicate_of_id),
+            func.coalesce(func.sum(size).filter(KnowledgeChunk.duplicate_of_id.isnot(None)), 0)
+        ).filter(KnowledgeChunk.bot_id == bot.id).one()
+
+        original = aliased(KnowledgeChunk)
+        exact = db.session.query(func.count(KnowledgeChunk.id)).join(
+            original, KnowledgeChunk.duplicate_of_id == original.id
+        ).filter(
+            KnowledgeChunk.bot_id == bot.id,
+            KnowledgeChunk.content_hash == original.content_hash
+        ).scalar()
+
+        return {
+            'chunks': total,
+            'duplicate_chunks': duplicates,
+            'exact_duplicates': exact,
+            'near_duplicates': duplicates - exact,
+            'bytes_saved': int(duplicate_bytes),
+        }
+
+    def _published(self, bot):
+        """
+        Filter excluding chunks of uploads still being ingested; they join the
+        indexes with the version bump that completes their job
+        """
+        unfinished = select(IngestionJob.knowledge_base_id).where(
+            IngestionJob.bot_id == bot.id,
+            IngestionJob.status.in_(UNFINISHED_JOB_STATUSES),
+            IngestionJob.knowledge_base_id.isnot(None)
+        )
+        return KnowledgeChunk.knowledge_base_id.notin_(unfinished)
+
+    def _load_contents(self, chunk_ids: List[int]) -> List[str]:
+        if not chunk_ids:
+            return []
+        contents = dict(db.session.query(KnowledgeChunk.id, KnowledgeChunk.content).filter(
+            KnowledgeChunk.id.in_(chunk_ids)
+        ).all())
+        return [contents[chunk_id] for chunk_id in chunk_ids if chunk_id in contents]
+
+    def _ensure_chunked(self, bot) -> None:
+        """
+        Chunk items saved before chunking existed, and re-tokenize chunks
+        written by an older normalizer or stored without a MinHash signature,
+        once per knowledge base version
+        """
+        key = (bot.id, bot.kb_version)
+        if key in self._chunked:
+            return
+
+        with self._lock:
+            if key in self._chunked:
+                return
+
+            # Items still being ingested get their chunks from the ingestion job
+            unchunked = KnowledgeBase.query.filter(
+                KnowledgeBase.bot_id == bot.id,
+                ~KnowledgeBase.chunks.any(),
+                ~KnowledgeBase.ingestion_jobs.any(IngestionJob.status.in_(UNFINISHED_JOB_STATUSES))
+            ).all()
+            if unchunked:
+                for kb in unchunked:
+                    self.index_item(kb)
+                db.session.commit()
+                logging.info(f"Chunked {len(unchunked)} knowledge base items for bot {bot.id}")
+
+            retokenized = 0
+            while True:
+                stale = KnowledgeChunk.query.filter(
+                    KnowledgeChunk.bot_id == bot.id,
+                    self._published(bot),
+                    or_(KnowledgeChunk.normalizer_version.is_(None),
+                        KnowledgeChunk.normalizer_version != NORMALIZER_VERSION,
+                        KnowledgeChunk.minhash.is_(None))
+                ).limit(500).all()
+                if not stale:
+                    break
+                for chunk in stale:
+                    for field, value in chunk_record(chunk.content).items():
+                        setattr(chunk, field, value)
+                db.session.commit()
+                retokenized += len(stale)
+            if retokenized:
+                logging.info(f"Re-tokenized {retokenized} knowledge chunks for bot {bot.id}")
+
+            self._chunked.add(key)
+
+    def publish_bulk_change(self, bot) -> None:
+        """
+        Publish chunks bulk-inserted outside the ORM under a new knowledge
+        base version; indexes rebuild from the stored statistics on next use
+        """
+        bot.bump_kb_version()
+        db.session.commit()
+        bot_config_cache.invalidate(bot.id)
+
+    def warm_indexes(self, bot) -> None:
+        """
+        Build and snapshot the indexes of the bot's current version ahead of
+        its first message, so workers map them instead of building them
+        """
+        self.lexical_index(bot)
+        if (getattr(bot, 'retrieval_strategy', None) or self.default_strategy) != 'bm25':
+            self.embedding_index(bot)
+
+    def _ensure_embedded(self, bot) -> None:
+        """
+        Embed chunks stored before embeddings were computed at ingest
+        """
+        missing = KnowledgeChunk.query.filter(
+            KnowledgeChunk.bot_id == bot.id,
+            KnowledgeChunk.embedding.is_(None),
+            self._published(bot)
+        ).all()
+        if missing:
+            for chunk in missing:
+                chunk.embedding = embed_tokens((chunk.tokens or "").split()).tobytes()
+            db.session.commit()
+            logging.info(f"Embedded {len(missing)} knowledge chunks for bot {bot.id}")
+
+
+knowledge_service = KnowledgeService()
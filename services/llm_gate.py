@@ -0,0 +1,246 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from utils import metrics
+
+
+class LLMOverloaded(Exception):
+    """
+    Raised when an LLM call cannot finish before its deadline
+    """
+    pass
+
+
+class _Flight:
+    """
+    An upstream call that identical requests wait on
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        # Streamed pieces so far, replayed to requests that join mid-stream
+        self.chunks: List[Any] = []
+        self.updated = threading.Condition()
+
+
+class LLMGate:
+    """
+    Admission control for upstream LLM calls.
+
+    Requests with the same key while one is in flight share that call's
+    result instead of making their own (single flight). Calls that do go
+    upstream need a global slot and a slot of their bot; the excess waits in
+    line until its deadline, and a call that could not start in time to
+    answer by its deadline is rejected instead of adding load the user will
+    never see. Two moving averages drive that: how long a call takes to
+    produce its first result (the whole call, or the first piece of a
+    stream), and how long calls hold their slot, which paces the line.
+    """
+
+    def __init__(self, max_concurrency: int = None, max_per_bot: int = None,
+                 deadline_seconds: float = None, expected_latency: float = None):
+        self.max_concurrency = max_concurrency or int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+        self.max_per_bot = max_per_bot or int(os.environ.get("LLM_MAX_CONCURRENCY_PER_BOT", 4))
+        self.deadline_seconds = deadline_seconds or float(os.environ.get("LLM_DEADLINE_SECONDS", 30))
+        # Exponential moving averages of time to first result and of slot hold time
+        self.latency = expected_latency or float(os.environ.get("LLM_EXPECTED_LATENCY", 3.0))
+        self.hold_time = self.latency
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_bot: Dict[Any, int] = {}
+        self._waiting = 0
+
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._flights_lock = threading.Lock()
+
+    def call(self, fn: Callable[[], Any], key: Hashable = None, bot_id: Any = None,
+             deadline: float = None) -> Any:
+        """
+        Run `fn` under the limits, or join an identical call already in flight.
+
+        `deadline` is a time.monotonic() value; raises LLMOverloaded when the
+        call cannot complete by then.
+        """
+        deadline = deadline or time.monotonic() + self.deadline_seconds
+        if key is None:
+            return self._run(fn, bot_id, deadline)
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            metrics.increment('llm.coalesced')
+            if not flight.done.wait(max(0.0, deadline - time.monotonic())):
+                metrics.increment('llm.rejected')
+                raise LLMOverloaded("Timed out waiting for an identical request in flight")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._run(fn, bot_id, deadline)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stream(self, fn: Callable[[], Iterable[Any]], key: Hashable = None, bot_id: Any = None,
+               deadline: float = None) -> Iterator[Any]:
+        """
+        Iterate a streaming call under the limits. Requests with the same key
+        while one is streaming replay its pieces so far and then follow it.
+        """
+        deadline = deadline or time.monotonic() + self.deadline_seconds
+        flight = None
+        if key is not None:
+            key = ('stream', key)
+            with self._flights_lock:
+                flight = self._flights.get(key)
+                if flight is not None:
+                    metrics.increment('llm.coalesced')
+                    return self._follow(flight, deadline)
+                flight = self._flights[key] = _Flight()
+        return self._lead(fn, key, flight, bot_id, deadline)
+
+    def _lead(self, fn, key, flight: Optional[_Flight], bot_id: Any, deadline: float) -> Iterator[Any]:
+        try:
+            with self._slot(bot_id, deadline, timed=False) as started:
+                first = True
+                for chunk in fn():
+                    if first:
+                        # Time to first piece is what the deadline is about, not the whole stream
+                        self._observe_latency(time.monotonic() - started)
+                        first = False
+                    if flight is not None:
+                        with flight.updated:
+                            flight.chunks.append(chunk)
+                            flight.updated.notify_all()
+                    yield chunk
+        except BaseException as e:
+            if flight is not None:
+                flight.error = e if isinstance(e, Exception) else LLMOverloaded("Identical request was abandoned")
+            raise
+        finally:
+            if flight is not None:
+                with self._flights_lock:
+                    self._flights.pop(key, None)
+                with flight.updated:
+                    flight.done.set()
+                    flight.updated.notify_all()
+
+    @staticmethod
+    def _follow(flight: _Flight, deadline: float) -> Iterator[Any]:
+        position = 0
+        while True:
+            with flight.updated:
+                while position >= len(flight.chunks) and not flight.done.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        metrics.increment('llm.rejected')
+                        raise LLMOverloaded("Timed out waiting for an identical request in flight")
+                    flight.updated.wait(remaining)
+                pending = flight.chunks[position:]
+                finished = flight.done.is_set()
+
+            position += len(pending)
+            yield from pending
+            if finished:
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def _run(self, fn: Callable[[], Any], bot_id: Any, deadline: float) -> Any:
+        with self._slot(bot_id, deadline):
+            return fn()
+
+    @contextmanager
+    def _slot(self, bot_id: Any, deadline: float, timed: bool = True):
+        """
+        Hold a slot; with `timed`, the call's duration also counts as its latency
+        """
+        self._acquire(bot_id, deadline)
+        started = time.monotonic()
+        try:
+            yield started
+        finally:
+            duration = time.monotonic() - started
+            if timed:
+                self._observe_latency(duration)
+            self._release(bot_id, duration)
+
+    def _observe_latency(self, seconds: float) -> None:
+        with self._cond:
+            self.latency = 0.8 * self.latency + 0.2 * seconds
+
+    def _has_slot(self, bot_id: Any) -> bool:
+        return self._active < self.max_concurrency and \
+            (bot_id is None or self._active_by_bot.get(bot_id, 0) < self.max_per_bot)
+
+    def _acquire(self, bot_id: Any, deadline: float) -> None:
+        with self._cond:
+            # Calls ahead in line drain about max_concurrency per average slot hold
+            expected_wait = 0.0 if self._has_slot(bot_id) else \
+                (self._waiting + 1) / self.max_concurrency * self.hold_time
+            if time.monotonic() + expected_wait + self.latency > deadline:
+                metrics.increment('llm.rejected')
+                raise LLMOverloaded("LLM call would not finish before the deadline")
+
+            queued_at = time.monotonic()
+            self._waiting += 1
+            try:
+                while not self._has_slot(bot_id):
+                    # Waiting past this point could not finish in time anyway
+                    remaining = deadline - self.latency - time.monotonic()
+                    if remaining <= 0:
+                        metrics.increment('llm.rejected')
+                        raise LLMOverloaded("LLM call could not start before the deadline")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            self._active += 1
+            if bot_id is not None:
+                self._active_by_bot[bot_id] = self._active_by_bot.get(bot_id, 0) + 1
+            metrics.increment('llm.calls')
+            metrics.increment('llm.queue_seconds', time.monotonic() - queued_at)
+
+    def _release(self, bot_id: Any, duration: float) -> None:
+        with self._cond:
+            self._active -= 1
+            if bot_id is not None:
+                remaining = self._active_by_bot.get(bot_id, 1) - 1
+                if remaining:
+                    self._active_by_bot[bot_id] = remaining
+                else:
+                    self._active_by_bot.pop(bot_id, None)
+            self.hold_time = 0.8 * self.hold_time + 0.2 * duration
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'in_flight_keys': len(self._flights),
+                'bots_active': len(self._active_by_bot),
+                'expected_latency': round(self.latency, 3),
+                'expected_hold_time': round(self.hold_time, 3),
+                'max_concurrency': self.max_concurrency,
+                'max_per_bot': self.max_per_bot,
+            }
+
+
+llm_gate = LLMGate()
@@ -0,0 +1,252 @@
+import os
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Any
+
+from sqlalchemy import insert, text, update
+
+from app import db
+from models import Message, Conversation
+from utils import metrics
+
+
+class WriteBufferFull(Exception):
+    """Raised when the buffer stays at its memory ceiling for longer than the caller will wait"""
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when a flush cannot reach the database at all"""
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind buffer for conversation messages.
+
+    Message inserts and conversation `last_message_at` updates are collected in
+    memory and flushed as one bulk INSERT plus one bulk UPDATE every
+    `flush_interval` seconds or `flush_rows` rows, whichever comes first.
+    When `max_buffered` rows are waiting, writers block until a flush frees room.
+    """
+
+    def __init__(self, app, flush_interval_ms: Optional[int] = None, flush_rows: Optional[int] = None,
+                 max_buffered: Optional[int] = None):
+        self.app = app
+        self.flush_interval = (flush_interval_ms or int(os.environ.get("MESSAGE_FLUSH_INTERVAL_MS", 200))) / 1000.0
+        self.flush_rows = flush_rows or int(os.environ.get("MESSAGE_FLUSH_ROWS", 500))
+        self.max_buffered = max_buffered or int(os.environ.get("MESSAGE_BUFFER_MAX", 10000))
+        self.max_flush_failures = 5
+        self.pid = os.getpid()
+
+        self._rows: List[Dict[str, Any]] = []
+        self._last_message_at: Dict[int, datetime] = {}
+        # Conversations with rows taken by a flush that has not finished yet
+        self._in_flight: Set[int] = set()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add_message(self, conversation_id: int, content: str, is_from_user: bool,
+                    telegram_message_id: Optional[str] = None, timeout: float = 30.0) -> None:
+        """
+        Buffer a message row and bump its conversation's last_message_at
+        """
+        now = datetime.utcnow()
+
+        with self._cond:
+            if len(self._rows) >= self.max_buffered:
+                metrics.increment('message_writer.backpressure_waits')
+                self._flush_requested.set()
+                if not self._cond.wait_for(lambda: len(self._rows) < self.max_buffered, timeout):
+                    raise WriteBufferFull(f"Message buffer full ({len(self._rows)} rows)")
+
+            self._rows.append({
+                'conversation_id': conversation_id,
+                'content': content,
+                'is_from_user': is_from_user,
+                'telegram_message_id': telegram_message_id,
+                'created_at': now
+            })
+            previous = self._last_message_at.get(conversation_id)
+            if previous is None or previous < now:
+                self._last_message_at[conversation_id] = now
+
+            if len(self._rows) >= self.flush_rows:
+                self._flush_requested.set()
+
+    def flush(self) -> int:
+        """
+        Write all buffered rows; returns the number of messages written.
+
+        When the batch fails it is split until the failing rows are isolated,
+        so one bad row cannot hold back other chats' messages; a row that
+        fails on its own `max_flush_failures` times is dropped. While the
+        database is unreachable everything stays buffered and writers block
+        at the memory ceiling.
+        """
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows = self._rows, []
+                touched, self._last_message_at = self._last_message_at, {}
+            return self._flush(rows, touched)
+
+    def flush_conversation(self, conversation_id: int) -> int:
+        """
+        Write one conversation's buffered messages now, so a reader of its
+        history sees them; returns the number written. Nothing is done when
+        none of its messages are waiting.
+        """
+        with self._cond:
+            if conversation_id not in self._in_flight and \
+                    not any(row['conversation_id'] == conversation_id for row in self._rows):
+                return 0
+
+        # Also waits for a flush that holds some of its rows to finish
+        with self._flush_lock:
+            with self._cond:
+                rows = [row for row in self._rows if row['conversation_id'] == conversation_id]
+                self._rows = [row for row in self._rows if row['conversation_id'] != conversation_id]
+            metrics.increment('message_writer.conversation_flushes')
+            return self._flush(rows, {})
+
+    def _flush(self, rows: List[Dict[str, Any]], touched: Dict[int, datetime]) -> int:
+        """
+        Write rows taken from the buffer and put back the ones that failed;
+        the caller holds the flush lock
+        """
+        if not rows and not touched:
+            return 0
+
+        with self._cond:
+            self._in_flight = {row['conversation_id'] for row in rows}
+        try:
+            written: Set[int] = set()
+            rejected: Set[int] = set()
+            try:
+                self._write(rows, written, rejected)
+                if touched:
+                    self._execute(lambda: db.session.execute(update(Conversation), [
+                        {'id': conversation_id, 'last_message_at': timestamp}
+                        for conversation_id, timestamp in touched.items()
+                    ]))
+                    touched = {}
+            except DatabaseUnavailable as e:
+                logging.error(f"Message flush failed, keeping {len(rows) - len(written)} rows buffered: {e}")
+            except Exception as e:
+                logging.error(f"Conversation timestamp update failed: {e}")
+
+            if len(written) < len(rows):
+                metrics.increment('message_writer.flush_errors')
+
+            keep = []
+            for row in rows:
+                if id(row) in written:
+                    continue
+                if id(row) in rejected:
+                    row['_failures'] = row.get('_failures', 0) + 1
+                    if row['_failures'] >= self.max_flush_failures:
+                        logging.error(f"Dropping message for conversation {row['conversation_id']} "
+                                      f"after {row['_failures']} failed writes")
+                        metrics.increment('message_writer.rows_dropped')
+                        continue
+                keep.append(row)
+
+            with self._cond:
+                self._rows = keep + self._rows
+                for conversation_id, timestamp in touched.items():
+                    current = self._last_message_at.get(conversation_id)
+                    if current is None or current < timestamp:
+                        self._last_message_at[conversation_id] = timestamp
+                self._cond.notify_all()
+
+            if written:
+                metrics.increment('message_writer.flushes')
+                metrics.increment('message_writer.rows_flushed', len(written))
+            return len(written)
+        finally:
+            with self._cond:
+                self._in_flight = set()
+
+    def _write(self, rows: List[Dict[str, Any]], written: Set[int], rejected: Set[int]) -> None:
+        """
+        Insert rows, bisecting a failing batch down to the rows the database rejects
+        """
+        try:
+            self._execute(lambda: db.session.execute(insert(Message), [
+                {key: value for key, value in row.items() if key != '_failures'} for row in rows
+            ]))
+            written.update(id(row) for row in rows)
+            return
+        except Exception as e:
+            if len(rows) == 1:
+                # A row failing alone is bad data only if the database otherwise works
+                self._check_database(e)
+                logging.error(f"Message insert failed: {e}")
+                rejected.add(id(rows[0]))
+                return
+
+        middle = len(rows) // 2
+        self._write(rows[:middle], written, rejected)
+        self._write(rows[middle:], written, rejected)
+
+    def _check_database(self, error: Exception) -> None:
+        try:
+            self._execute(lambda: db.session.execute(text("SELECT 1")))
+        except Exception:
+            raise DatabaseUnavailable(str(error)) from error
+
+    def _execute(self, statement) -> None:
+        with self.app.app_context():
+            try:
+                statement()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """
+        Stop the flusher and write whatever is still buffered
+        """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._flush_requested.set()
+        if self._thread.is_alive():
+            self._thread.join(5.0)
+        self.flush()
+
+    def buffered(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+
+_writer: Optional[MessageWriteBuffer] = None
+_writer_lock = threading.Lock()
+
+
+def get_message_writer(app) -> MessageWriteBuffer:
+    """
+    Return this process's write buffer, starting its flusher on first use
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = MessageWriteBuffer(app)
+            _writer.start()
+        return _writer
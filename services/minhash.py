@@ -0,0 +1,137 @@
+import hashlib
+import threading
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+NUM_PERM = 64
+SHINGLE_SIZE = 3
+_EMPTY = 0xFFFFFFFF
+
+
+def content_hash(tokens: List[str]) -> str:
+    """
+    Hash of a normalized token stream; equal for texts that differ only in
+    case, punctuation, spacing or script
+    """
+    return hashlib.sha1(" ".join(tokens).encode('utf-8')).hexdigest()
+
+
+def minhash_signature(tokens: List[str], num_perm: int = NUM_PERM) -> array:
+    """
+    One-permutation MinHash of a token stream's word 3-gram shingles.
+
+    Each shingle is hashed once and kept as the minimum of the bin its hash
+    falls in, instead of being hashed `num_perm` times; empty bins borrow
+    from the next non-empty bin so short texts still compare correctly.
+    """
+    signature = array('I', [_EMPTY]) * num_perm
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+    for shingle in shingles:
+        if not shingle:
+            continue
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        slot = h % num_perm
+        value = (h // num_perm) & 0xFFFFFFFE
+        if value < signature[slot]:
+            signature[slot] = value
+
+    filled = [i for i in range(num_perm) if signature[i] != _EMPTY]
+    if filled and len(filled) < num_perm:
+        dense = array('I', signature)
+        for i in range(num_perm):
+            if signature[i] == _EMPTY:
+                offset = 1
+                while signature[(i + offset) % num_perm] == _EMPTY:
+                    offset += 1
+                dense[i] = (signature[(i + offset) % num_perm] + offset * 0x9E3779B1) & 0xFFFFFFFE
+        signature = dense
+    return signature
+
+
+def signature_from_bytes(data: bytes) -> array:
+    signature = array('I')
+    signature.frombytes(data)
+    return signature
+
+
+def similarity(a: array, b: array) -> float:
+    """
+    Estimated Jaccard similarity of two signatures
+    """
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class MinHashLSH:
+    """
+    Banded LSH over MinHash signatures plus an exact content-hash map.
+
+    With 16 bands of 4 rows, pairs around 0.5 Jaccard similarity become
+    candidates half the time and pairs above 0.8 almost always; candidates
+    are then checked against `threshold` with the full signature.
+    """
+
+    def __init__(self, threshold: float = 0.8, bands: int = 16):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+
+        self._buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+        self._signatures: Dict[int, Tuple[str, array]] = {}
+        self._hashes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def _band_keys(self, signature: array):
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def add(self, item_id: int, hash_value: str, signature: array) -> None:
+        with self._lock:
+            self._signatures[item_id] = (hash_value, signature)
+            self._hashes.setdefault(hash_value, item_id)
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, set()).add(item_id)
+
+    def remove(self, item_id: int) -> None:
+        with self._lock:
+            entry = self._signatures.pop(item_id, None)
+            if entry is None:
+                return
+            hash_value, signature = entry
+            if self._hashes.get(hash_value) == item_id:
+                del self._hashes[hash_value]
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(item_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def find_duplicate(self, hash_value: str, signature: array) -> Optional[Tuple[int, float]]:
+        """
+        (item_id, similarity) of an exact or near duplicate already indexed, or None
+        """
+        with self._lock:
+            exact = self._hashes.get(hash_value)
+            if exact is not None:
+                return exact, 1.0
+
+            candidates: Set[int] = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best = None
+            for item_id in candidates:
+                score = similarity(signature, self._signatures[item_id][1])
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (item_id, score)
+            return best
+
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes held by signatures, band buckets and the hash map
+        """
+        return len(self._signatures) * (4 * NUM_PERM + 100 * self.bands + 300)
+
+    def __len__(self) -> int:
+        return len(self._signatures)
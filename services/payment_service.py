@@ -72,6 +72,10 @@ class PaymentService:
             user.is_trial = False
             user.subscription_end = datetime.utcnow() + timedelta(days=30)
             
+            # Cached bot snapshots carry the owner's plan
+            for bot in user.bots:
+                bot.bump_config_version()
+            
             db.session.commit()
             
             logging.info(f"Payment processed successfully for user {user.email}")
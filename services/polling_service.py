@@ -0,0 +1,185 @@
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple, Any
+
+from app import db
+from models import Bot
+from services.telegram_service import get_telegram_service
+from services.telegram_sessions import close_session_registry
+from services.update_worker import get_worker_pool, embedded_workers_enabled
+from services.webhook_queue import webhook_queue
+from utils import metrics
+
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query", "edited_message"]
+
+
+def polling_mode_enabled() -> bool:
+    """
+    Whether bots receive updates through poller.py instead of webhooks
+    """
+    return os.environ.get("TELEGRAM_UPDATE_MODE", "webhook") == "polling"
+
+
+class PollingRunner:
+    """
+    Long-polls getUpdates for many bots from a single asyncio loop.
+
+    Each bot has its own poll task; a semaphore caps how many getUpdates
+    requests are open at once. Received updates go through the same durable
+    queue (and deduplication) as webhook deliveries, and each bot's offset is
+    stored in the database once its updates are queued.
+    """
+
+    def __init__(self, app, max_concurrent_polls: Optional[int] = None,
+                 min_timeout: int = 1, max_timeout: int = 50, refresh_interval: float = 60.0):
+        self.app = app
+        self.max_concurrent_polls = max_concurrent_polls or int(os.environ.get("POLLING_MAX_CONCURRENT", 200))
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.refresh_interval = refresh_interval
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_polls)
+        self._waiting = 0
+        self._tasks: Dict[int, Tuple[str, asyncio.Task]] = {}
+        self._stop = asyncio.Event()
+
+    async def run(self) -> None:
+        """
+        Poll until stop() is called, picking up added, changed and removed bots
+        """
+        try:
+            while not self._stop.is_set():
+                bots = await asyncio.to_thread(self._load_bots)
+                self._sync_tasks(bots)
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.refresh_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for _, task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*[task for _, task in self._tasks.values()], return_exceptions=True)
+            self._tasks.clear()
+            await close_session_registry()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _load_bots(self) -> Dict[int, str]:
+        with self.app.app_context():
+            try:
+                rows = db.session.query(Bot.id, Bot.telegram_token).filter(
+                    Bot.is_active == True,
+                    Bot.telegram_token.isnot(None)
+                ).all()
+                return {row.id: row.telegram_token for row in rows if row.telegram_token}
+            finally:
+                db.session.remove()
+
+    def _sync_tasks(self, bots: Dict[int, str]) -> None:
+        for bot_id, (token, task) in list(self._tasks.items()):
+            if bots.get(bot_id) != token or task.done():
+                task.cancel()
+                del self._tasks[bot_id]
+
+        for bot_id, token in bots.items():
+            if bot_id not in self._tasks:
+                self._tasks[bot_id] = (token, asyncio.create_task(self._poll_bot(bot_id, token)))
+
+        metrics.increment('polling.bot_refreshes')
+
+    def _next_timeout(self, idle_polls: int) -> int:
+        """
+        Long timeouts for idle bots to save round-trips; short ones while other
+        bots are waiting for a poll slot so slots turn over quickly
+        """
+        if self._waiting > 0:
+            return self.min_timeout
+        return min(self.max_timeout, self.min_timeout * 2 ** idle_polls)
+
+    async def _poll_bot(self, bot_id: int, token: str) -> None:
+        telegram_service = get_telegram_service(token)
+
+        # getUpdates is refused while a webhook is set, so polling waits until it is gone
+        error_backoff = 1.0
+        while not await telegram_service.delete_webhook(drop_pending_updates=False):
+            logging.error(f"Could not delete the webhook of bot {bot_id}; not polling it, "
+                          f"retrying in {error_backoff:.0f}s")
+            metrics.increment('polling.errors')
+            await asyncio.sleep(error_backoff)
+            error_backoff = min(error_backoff * 2, 60.0)
+        offset = await asyncio.to_thread(self._load_offset, bot_id)
+
+        idle_polls = 0
+        error_backoff = 1.0
+
+        while True:
+            timeout = self._next_timeout(idle_polls)
+
+            await self._acquire_slot()
+            try:
+                updates = await telegram_service.get_updates(
+                    offset=offset, timeout=timeout, allowed_updates=ALLOWED_UPDATES
+                )
+            finally:
+                self._semaphore.release()
+
+            metrics.increment('polling.requests')
+
+            if updates is None:
+                metrics.increment('polling.errors')
+                await asyncio.sleep(error_backoff)
+                error_backoff = min(error_backoff * 2, 60.0)
+                continue
+
+            error_backoff = 1.0
+            if not updates:
+                idle_polls += 1
+                continue
+
+            idle_polls = 0
+            try:
+                offset = await asyncio.to_thread(self._ingest, bot_id, updates)
+            except Exception as e:
+                # Keep the old offset so the same batch is fetched again
+                logging.error(f"Error queueing polled updates for bot {bot_id}: {e}")
+                metrics.increment('polling.errors')
+                await asyncio.sleep(error_backoff)
+                continue
+            metrics.increment('polling.updates', len(updates))
+
+    async def _acquire_slot(self) -> None:
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+    def _load_offset(self, bot_id: int) -> Optional[int]:
+        with self.app.app_context():
+            try:
+                return db.session.query(Bot.telegram_update_offset).filter(Bot.id == bot_id).scalar()
+            finally:
+                db.session.remove()
+
+    def _ingest(self, bot_id: int, updates: List[Dict[str, Any]]) -> int:
+        """
+        Queue a batch of updates and persist the next offset
+        """
+        with self.app.app_context():
+            try:
+                for update in updates:
+                    webhook_queue.enqueue(bot_id, update)
+
+                next_offset = max(update['update_id'] for update in updates) + 1
+                Bot.query.filter_by(id=bot_id).update(
+                    {'telegram_update_offset': next_offset}, synchronize_session=False
+                )
+                db.session.commit()
+
+                if embedded_workers_enabled():
+                    get_worker_pool(self.app).notify()
+                return next_offset
+            finally:
+                db.session.remove()
@@ -0,0 +1,43 @@
+import os
+
+from services.context_assembler import PromptPrefix, context_assembler
+from utils import metrics
+from utils.lru import LRUCache
+
+
+class PromptTemplates:
+    """
+    Per-bot prompt prefixes compiled once per bot config version.
+
+    The prefix (system prompt and instructions) is the same for every
+    message to a bot, so it is built once and only the retrieved context and
+    conversation are assembled per message. The prefix goes out as the
+    system instruction, byte-identical across a bot's requests, which is what
+    Gemini's implicit prefix caching keys on.
+    """
+
+    def __init__(self, maxsize: int = None):
+        maxsize = maxsize or int(os.environ.get("PROMPT_PREFIX_CACHE_SIZE", 1000))
+        # bot_id -> ((config_version, budget), PromptPrefix)
+        self._prefixes = LRUCache(maxsize=maxsize)
+
+    def prefix_for(self, bot, system_prompt: str, budget: int = None) -> PromptPrefix:
+        """
+        Compiled prefix of a bot's prompt, rebuilt when its config version changes
+        """
+        if bot is None:
+            return context_assembler.compile_prefix(system_prompt, budget)
+
+        scope = (bot.config_version, budget)
+        entry = self._prefixes.get(bot.id)
+        if entry is not None and entry[0] == scope:
+            metrics.increment('prompt.prefix_hits')
+            return entry[1]
+
+        metrics.increment('prompt.prefix_misses')
+        prefix = context_assembler.compile_prefix(system_prompt, budget)
+        self._prefixes.set(bot.id, (scope, prefix))
+        return prefix
+
+
+prompt_templates = PromptTemplates()
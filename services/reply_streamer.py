@@ -0,0 +1,138 @@
+import os
+import re
+import time
+import logging
+from typing import List, Optional
+
+from services.async_runner import run_async
+from utils import metrics
+
+MESSAGE_LIMIT = 4096
+_SENTENCE_END_RE = re.compile(r'[.!?…](\s|$)|\n')
+
+
+class ReplyStreamer:
+    """
+    Delivers a reply to a Telegram chat while it is still being generated.
+
+    The first sentence goes out as a new message as soon as it is complete;
+    the rest is added by editing that message, at most once per
+    STREAM_EDIT_INTERVAL seconds (longer in groups, where Telegram's edit
+    limits are stricter) and backing off when an edit fails. A reply longer
+    than one message continues in a new one. Streamed messages are plain
+    text, since a partial reply may cut through markup.
+    """
+
+    def __init__(self, telegram, chat_id: int, started: float = None):
+        self.telegram = telegram
+        self.chat_id = chat_id
+        self.started = started or time.monotonic()
+
+        interval = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.0))
+        # Negative chat ids are groups and channels
+        self.interval = interval * 3 if chat_id < 0 else interval
+        self.max_interval = float(os.environ.get("STREAM_EDIT_MAX_INTERVAL", 5.0))
+        self.first_chunk_chars = int(os.environ.get("STREAM_FIRST_CHUNK_CHARS", 200))
+
+        self._done: List[str] = []  # text of messages that are complete
+        self._text = ""  # text of the message being streamed
+        self._message_id: Optional[int] = None
+        self._shown = ""  # what the chat currently shows for that message
+        self._last_edit = 0.0
+        # Set when part of the reply could not be shown in the chat
+        self._lost = False
+
+    def feed(self, piece: str) -> None:
+        """
+        Add a piece of the reply, sending or editing if it is time to
+        """
+        self._text += piece
+        while len(self._text) > MESSAGE_LIMIT:
+            self._roll_over()
+
+        if self._message_id is None:
+            if _SENTENCE_END_RE.search(self._text) or len(self._text) >= self.first_chunk_chars:
+                self._send()
+        elif time.monotonic() - self._last_edit >= self.interval:
+            self._edit()
+
+    def finish(self) -> str:
+        """
+        Deliver whatever has not been shown yet and return the whole reply
+        """
+        if self._message_id is None:
+            if self._text.strip() and not self._send():
+                self._lost = True
+        elif self._text != self._shown:
+            for attempt in range(3):
+                if attempt:
+                    time.sleep(self.interval)
+                if self._edit():
+                    break
+            else:
+                self._lost = True
+                logging.warning(f"Failed to deliver the end of a streamed reply to chat {self.chat_id}")
+        return "".join(self._done) + self._text
+
+    @property
+    def delivered(self) -> bool:
+        """
+        Whether the chat shows the whole reply
+        """
+        return not self._lost and (bool(self._done) or self._message_id is not None)
+
+    def _call(self, coro):
+        # A failed request is reported like a rejected one, so one bad call does not end the stream
+        try:
+            return run_async(coro)
+        except Exception as e:
+            logging.warning(f"Telegram request for streamed reply to chat {self.chat_id} failed: {e}")
+            return None
+
+    def _send(self) -> bool:
+        sent = self._call(self.telegram.send_message(self.chat_id, self._text, parse_mode=None))
+        if not sent:
+            return False
+        if not self._done:
+            metrics.increment('telegram.first_message_seconds', time.monotonic() - self.started)
+            metrics.increment('telegram.first_message_samples')
+        self._message_id = sent.get('message_id')
+        self._shown = self._text
+        self._last_edit = time.monotonic()
+        return True
+
+    def _edit(self) -> bool:
+        if self._text == self._shown:
+            return True
+        self._last_edit = time.monotonic()
+        edited = self._call(self.telegram.edit_message_text(self.chat_id, self._message_id, self._text))
+        if not edited:
+            # Most likely rate limited: slow down for the rest of the reply
+            self.interval = min(self.interval * 2, self.max_interval)
+            return False
+        self._shown = self._text
+        return True
+
+    def _roll_over(self) -> None:
+        # Close the current message at a word boundary and carry the rest over
+        cut = self._text.rfind(' ', 0, MESSAGE_LIMIT)
+        if cut <= 0:
+            cut = MESSAGE_LIMIT
+        head, self._text = self._text[:cut], self._text[cut:].lstrip()
+
+        if self._message_id is None:
+            sent = self._call(self.telegram.send_message(self.chat_id, head, parse_mode=None))
+            if sent and not self._done:
+                metrics.increment('telegram.first_message_seconds', time.monotonic() - self.started)
+                metrics.increment('telegram.first_message_samples')
+        elif head != self._shown:
+            sent = self._call(self.telegram.edit_message_text(self.chat_id, self._message_id, head))
+        else:
+            sent = True
+        if not sent:
+            self._lost = True
+            logging.warning(f"Failed to deliver part of a streamed reply to chat {self.chat_id}")
+
+        self._done.append(head + " ")
+        self._message_id = None
+        self._shown = ""
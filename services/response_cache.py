@@ -0,0 +1,162 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+from utils import metrics
+from utils.lru import LRUCache
+from utils.text_processing import tokenize
+
+_CYRILLIC_RE = re.compile(r'[Ѐ-ӿ]')
+
+
+class ResponseCache:
+    """
+    Bot-scoped cache of generated replies to standalone questions (the
+    opening message of a conversation).
+
+    Keys combine the bot, its config and knowledge base versions and the
+    normalized message, so any settings or knowledge change makes the old
+    entries unreachable; they are dropped as soon as the new version is seen.
+    There is no explicit invalidation: bumping Bot.config_version or
+    Bot.kb_version is what retires a bot's replies in every process.
+    Entries live in a per-process LRU with TTL and a memory cap and, when
+    RESPONSE_CACHE_PATH is set, in a SQLite file shared by every worker on
+    the host.
+    """
+
+    def __init__(self, maxsize: int = None, ttl: float = None, path: str = None):
+        self.ttl = ttl or float(os.environ.get("RESPONSE_CACHE_TTL", 6 * 3600))
+        # Very short messages ("yes please", "how much?") only make sense in their conversation
+        self.min_tokens = int(os.environ.get("RESPONSE_CACHE_MIN_TOKENS", 3))
+        self.enabled = os.environ.get("RESPONSE_CACHE_ENABLED", "1") != "0"
+        self._entries = LRUCache(
+            maxsize=maxsize or int(os.environ.get("RESPONSE_CACHE_SIZE", 10000)),
+            ttl=self.ttl,
+            maxweight=int(os.environ.get("RESPONSE_CACHE_MEMORY_MB", 32)) * 1024 * 1024,
+            weigh=lambda entry: len(entry[0]) * 2 + 200
+        )
+        # bot_id -> scope seen last, to drop entries of older versions
+        self._scopes: Dict[int, str] = {}
+        self._scopes_lock = threading.Lock()
+
+        self.path = path if path is not None else os.environ.get("RESPONSE_CACHE_PATH")
+        self.disk_max_entries = int(os.environ.get("RESPONSE_CACHE_DISK_MAX_ENTRIES", 100000))
+        self._local = threading.local()
+        self._writes = 0
+
+    def get(self, bot, message: str) -> Optional[str]:
+        """
+        Cached reply for a message to this bot version, or None
+        """
+        key = self._key(bot, message)
+        if key is None:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None and self.path:
+            entry = self._disk_get(key)
+            if entry is not None:
+                self._entries.set(key, entry)
+
+        if entry is None:
+            metrics.increment('response_cache.misses')
+            metrics.increment(f'response_cache.misses.bot_{bot.id}')
+            return None
+
+        response, latency = entry
+        metrics.increment('response_cache.hits')
+        metrics.increment(f'response_cache.hits.bot_{bot.id}')
+        metrics.increment(f'response_cache.seconds_saved.bot_{bot.id}', latency)
+        return response
+
+    def set(self, bot, message: str, response: str, latency: float) -> None:
+        """
+        Store a reply along with how long it took to generate
+        """
+        key = self._key(bot, message)
+        if key is None or not response:
+            return
+
+        self._entries.set(key, (response, latency))
+        if self.path:
+            self._disk_set(key, bot.id, self._scope(bot), response, latency)
+
+    @staticmethod
+    def _scope(bot) -> str:
+        return f"{bot.config_version}:{bot.kb_version}"
+
+    def _key(self, bot, message: str) -> Optional[Tuple[int, str]]:
+        if not self.enabled:
+            return None
+        tokens = tokenize(message or "")
+        if len(tokens) < self.min_tokens:
+            return None
+
+        scope = self._scope(bot)
+        with self._scopes_lock:
+            previous = self._scopes.get(bot.id)
+            self._scopes[bot.id] = scope
+        if previous is not None and previous != scope:
+            # Older versions' disk rows are unreachable and removed on the next write
+            self._entries.discard_where(lambda key: key[0] == bot.id)
+
+        # Both scripts normalize to the same tokens, but the reply should match the asker's
+        script = 'cyrl' if _CYRILLIC_RE.search(message) else 'latn'
+        digest = hashlib.sha1(f"{scope}|{script}|{' '.join(tokens)}".encode('utf-8')).hexdigest()
+        return bot.id, digest
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, bot_id INTEGER NOT NULL, scope TEXT NOT NULL, "
+                "response TEXT NOT NULL, latency REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_bot ON responses (bot_id)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _disk_execute(self, sql: str, params=()):
+        # The shared tier is best effort: a locked or unwritable file only costs a miss
+        try:
+            return self._connection().execute(sql, params).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Response cache disk tier error: {e}")
+            return None
+
+    def _disk_get(self, key: Tuple[int, str]) -> Optional[Tuple[str, float]]:
+        row = self._disk_execute(
+            "SELECT response, latency FROM responses WHERE key = ? AND expires_at > ?",
+            (f"{key[0]}:{key[1]}", time.time())
+        )
+        return (row[0], row[1]) if row else None
+
+    def _disk_set(self, key: Tuple[int, str], bot_id: int, scope: str, response: str, latency: float) -> None:
+        self._disk_execute(
+            "INSERT OR REPLACE INTO responses (key, bot_id, scope, response, latency, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (f"{key[0]}:{key[1]}", bot_id, scope, response, latency, time.time() + self.ttl)
+        )
+        self._disk_execute("DELETE FROM responses WHERE bot_id = ? AND scope != ?", (bot_id, scope))
+
+        self._writes += 1
+        if self._writes % 256 == 0:
+            self._disk_execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            self._disk_execute(
+                "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses "
+                "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.disk_max_entries,)
+            )
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,82 @@
+from typing import Dict, List, Tuple
+
+from services.embedding_index import embed_text
+from utils.text_processing import tokenize
+
+
+class Retriever:
+    """
+    Ranks a bot's knowledge chunks for a query.
+
+    Retrievers hold no indexes themselves; they ask the knowledge service for
+    the bot's current ones, so every strategy sees the same versioning.
+    """
+
+    name = None
+
+    def __init__(self, service):
+        self.service = service
+
+    def search(self, bot, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Top-k (chunk_id, score) pairs, best first
+        """
+        raise NotImplementedError
+
+
+class LexicalRetriever(Retriever):
+    """
+    BM25, or memory-mapped TF-IDF for large knowledge bases
+    """
+
+    name = 'bm25'
+
+    def search(self, bot, query: str, k: int) -> List[Tuple[int, float]]:
+        query_terms = tokenize(query)
+        if not query_terms:
+            return []
+        return self.service.lexical_index(bot).search(query_terms, k)
+
+
+class EmbeddingRetriever(Retriever):
+    """
+    Cosine similarity of hashed character n-gram embeddings
+    """
+
+    name = 'embedding'
+
+    def search(self, bot, query: str, k: int) -> List[Tuple[int, float]]:
+        if not query.strip():
+            return []
+        return self.service.embedding_index(bot).search(embed_text(query), k)
+
+
+class HybridRetriever(Retriever):
+    """
+    Reciprocal rank fusion of the lexical and embedding rankings
+    """
+
+    name = 'hybrid'
+
+    def __init__(self, service, retrievers: List[Retriever], depth: int = 4, rrf_k: int = 60):
+        super().__init__(service)
+        self.retrievers = retrievers
+        self.depth = depth
+        self.rrf_k = rrf_k
+
+    def search(self, bot, query: str, k: int) -> List[Tuple[int, float]]:
+        fused: Dict[int, float] = {}
+        for retriever in self.retrievers:
+            for rank, (chunk_id, _) in enumerate(retriever.search(bot, query, k * self.depth)):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def build_retrievers(service) -> Dict[str, Retriever]:
+    """
+    Retrievers by strategy name, as stored in Bot.retrieval_strategy
+    """
+    lexical = LexicalRetriever(service)
+    embedding = EmbeddingRetriever(service)
+    hybrid = HybridRetriever(service, [lexical, embedding])
+    return {retriever.name: retriever for retriever in (lexical, embedding, hybrid)}
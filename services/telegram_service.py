@@ -1,21 +1,24 @@
 import os
 import logging
 import asyncio
+import threading
+import time
 import aiohttp
 from typing import Optional, Dict, List, Any
-from datetime import datetime
-import json
 from urllib.parse import urljoin
 
+from services.telegram_sessions import get_session_registry
+
 class TelegramService:
     """
-    Enhanced Telegram service with async support, knowledge base integration,
-    and comprehensive error handling for BotFactory platform.
+    Enhanced Telegram service with async support and comprehensive error
+    handling for BotFactory platform.
     """
     
     def __init__(self, bot_token: str):
         self.bot_token = bot_token
         self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        # Only set when used as an async context manager; otherwise the shared session is used
         self.session = None
         self.webhook_url = None
         
@@ -35,24 +38,29 @@ class TelegramService:
         """Async context manager exit"""
         if self.session:
             await self.session.close()
+            self.session = None
     
-    async def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Optional[Dict]:
+    async def _make_request(
+        self, 
+        method: str, 
+        endpoint: str, 
+        data: Optional[Dict] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[Dict]:
         """
         Make async HTTP request to Telegram API with error handling
         """
         url = f"{self.base_url}/{endpoint}"
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
         
         try:
-            if not self.session:
-                self.session = aiohttp.ClientSession(
-                    timeout=aiohttp.ClientTimeout(total=30)
-                )
+            session = self.session or get_session_registry().session
             
             if method.upper() == 'GET':
-                async with self.session.get(url, params=data) as response:
+                async with session.get(url, params=data, timeout=request_timeout) as response:
                     result = await response.json()
             else:
-                async with self.session.post(url, json=data) as response:
+                async with session.post(url, json=data, timeout=request_timeout) as response:
                     result = await response.json()
             
             if result.get("ok"):
@@ -117,6 +125,29 @@ class TelegramService:
             self.logger.error("Failed to delete webhook")
             return False
     
+    async def get_updates(
+        self, 
+        offset: Optional[int] = None, 
+        timeout: int = 30, 
+        limit: int = 100,
+        allowed_updates: Optional[List[str]] = None
+    ) -> Optional[List[Dict]]:
+        """
+        Long-poll for new updates; returns None on error
+        """
+        data = {
+            "timeout": timeout,
+            "limit": limit
+        }
+        
+        if offset is not None:
+            data["offset"] = offset
+        if allowed_updates is not None:
+            data["allowed_updates"] = allowed_updates
+        
+        # Allow the HTTP request to outlive the server-side long-poll
+        return await self._make_request("POST", "getUpdates", data, timeout=timeout + 10)
+    
     async def get_webhook_info(self) -> Optional[Dict]:
         """
         Get current webhook information
@@ -143,15 +174,42 @@ class TelegramService:
         data = {
             "chat_id": chat_id,
             "text": text[:4096],  # Telegram message limit
-            "parse_mode": parse_mode,
             "disable_web_page_preview": disable_web_page_preview
         }
         
+        if parse_mode:
+            data["parse_mode"] = parse_mode
         if reply_markup:
             data["reply_markup"] = reply_markup
         
         return await self._make_request("POST", "sendMessage", data)
     
+    async def edit_message_text(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        disable_web_page_preview: bool = False
+    ) -> Optional[Dict]:
+        """
+        Replace the text of a message the bot sent earlier.
+
+        Telegram allows about one edit per second in a private chat and fewer
+        in groups; callers are expected to throttle (see ReplyStreamer).
+        """
+        data = {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": text[:4096],
+            "disable_web_page_preview": disable_web_page_preview
+        }
+        
+        if parse_mode:
+            data["parse_mode"] = parse_mode
+        
+        return await self._make_request("POST", "editMessageText", data, timeout=10)
+    
     async def send_typing_action(self, chat_id: int) -> bool:
         """
         Send typing indicator to show bot is processing
@@ -183,225 +241,6 @@ class TelegramService:
         
         return await self._make_request("POST", "sendDocument", data)
     
-    async def process_message_with_ai(
-        self, 
-        message: Dict, 
-        bot_config: Dict,
-        ai_service,
-        knowledge_base: Optional[List[str]] = None
-    ) -> Optional[str]:
-        """
-        Process incoming message with AI integration and knowledge base
-        """
-        try:
-            user_message = message.get('text', '')
-            chat_id = message.get('chat', {}).get('id')
-            user_id = message.get('from', {}).get('id')
-            
-            if not user_message or not chat_id:
-                return None
-            
-            # Send typing indicator
-            await self.send_typing_action(chat_id)
-            
-            # Prepare AI context with knowledge base
-            context = self._build_ai_context(bot_config, knowledge_base, user_message)
-            
-            # Get AI response
-            ai_response = await ai_service.generate_response(
-                prompt=user_message,
-                context=context,
-                max_tokens=bot_config.get('max_tokens', 1000),
-                temperature=bot_config.get('temperature', 0.7)
-            )
-            
-            if ai_response:
-                # Log conversation for analytics
-                await self._log_conversation(chat_id, user_id, user_message, ai_response)
-                return ai_response
-            else:
-                return bot_config.get('fallback_message', 'Sorry, I cannot process your request right now.')
-                
-        except Exception as e:
-            self.logger.error(f"Error processing message with AI: {e}")
-            return bot_config.get('error_message', 'An error occurred while processing your message.')
-    
-    def _build_ai_context(
-        self, 
-        bot_config: Dict, 
-        knowledge_base: Optional[List[str]], 
-        user_message: str
-    ) -> str:
-        """
-        Build context for AI with system prompt and knowledge base
-        """
-        context_parts = []
-        
-        # Add system prompt
-        if bot_config.get('system_prompt'):
-            context_parts.append(f"System: {bot_config['system_prompt']}")
-        
-        # Add relevant knowledge base content
-        if knowledge_base:
-            relevant_knowledge = self._find_relevant_knowledge(user_message, knowledge_base)
-            if relevant_knowledge:
-                context_parts.append(f"Knowledge Base: {relevant_knowledge}")
-        
-        # Add bot personality
-        if bot_config.get('personality'):
-            context_parts.append(f"Personality: {bot_config['personality']}")
-        
-        return "\n\n".join(context_parts)
-    
-    def _find_relevant_knowledge(self, user_message: str, knowledge_base: List[str]) -> str:
-        """
-        Simple keyword-based knowledge base search
-        TODO: Implement semantic search for better relevance
-        """
-        user_words = set(user_message.lower().split())
-        relevant_docs = []
-        
-        for doc in knowledge_base[:5]:  # Limit to avoid token overflow
-            doc_words = set(doc.lower().split())
-            overlap = len(user_words.intersection(doc_words))
-            
-            if overlap > 0:
-                relevant_docs.append((doc, overlap))
-        
-        # Sort by relevance and return top matches
-        relevant_docs.sort(key=lambda x: x[1], reverse=True)
-        return " ".join([doc[0] for doc in relevant_docs[:3]])
-    
-    async def _log_conversation(
-        self, 
-        chat_id: int, 
-        user_id: int, 
-        user_message: str, 
-        bot_response: str
-    ) -> None:
-        """
-        Log conversation for analytics (implement database logging)
-        """
-        log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "chat_id": chat_id,
-            "user_id": user_id,
-            "user_message": user_message,
-            "bot_response": bot_response,
-            "message_length": len(user_message),
-            "response_length": len(bot_response)
-        }
-        
-        self.logger.info(f"Conversation logged: {json.dumps(log_data)}")
-    
-    async def handle_webhook_update(
-        self, 
-        update: Dict, 
-        bot_config: Dict,
-        ai_service,
-        knowledge_base: Optional[List[str]] = None
-    ) -> bool:
-        """
-        Main webhook update handler with comprehensive message processing
-        """
-        try:
-            # Handle regular messages
-            if 'message' in update:
-                message = update['message']
-                chat_id = message.get('chat', {}).get('id')
-                
-                if not chat_id:
-                    return False
-                
-                # Process with AI
-                response = await self.process_message_with_ai(
-                    message, bot_config, ai_service, knowledge_base
-                )
-                
-                if response:
-                    await self.send_message(chat_id, response)
-                    return True
-            
-            # Handle callback queries (inline keyboard buttons)
-            elif 'callback_query' in update:
-                callback = update['callback_query']
-                chat_id = callback.get('message', {}).get('chat', {}).get('id')
-                callback_data = callback.get('data')
-                
-                if chat_id and callback_data:
-                    response = await self._handle_callback_query(callback_data, bot_config)
-                    if response:
-                        await self.send_message(chat_id, response)
-                        return True
-            
-            # Handle inline queries
-            elif 'inline_query' in update:
-                inline_query = update['inline_query']
-                query_id = inline_query.get('id')
-                query_text = inline_query.get('query', '')
-                
-                if query_id:
-                    await self._handle_inline_query(query_id, query_text, bot_config)
-                    return True
-            
-            return False
-            
-        except Exception as e:
-            self.logger.error(f"Error handling webhook update: {e}")
-            return False
-    
-    async def _handle_callback_query(self, callback_data: str, bot_config: Dict) -> Optional[str]:
-        """
-        Handle callback query from inline keyboards
-        """
-        try:
-            # Parse callback data and generate appropriate response
-            if callback_data.startswith("help_"):
-                topic = callback_data.replace("help_", "")
-                return bot_config.get('help_responses', {}).get(topic, "Help topic not found.")
-            
-            elif callback_data == "contact_support":
-                return "Please contact our support team at support@botfactory.com"
-            
-            else:
-                return "Unknown command."
-                
-        except Exception as e:
-            self.logger.error(f"Error handling callback query: {e}")
-            return None
-    
-    async def _handle_inline_query(self, query_id: str, query_text: str, bot_config: Dict) -> bool:
-        """
-        Handle inline query for bot mentions in other chats
-        """
-        try:
-            results = []
-            
-            # Simple inline query handler
-            if query_text:
-                results = [{
-                    "type": "article",
-                    "id": "1",
-                    "title": f"Ask {bot_config.get('name', 'Bot')}",
-                    "description": f"Get an answer about: {query_text}",
-                    "input_message_content": {
-                        "message_text": f"Please answer: {query_text}"
-                    }
-                }]
-            
-            data = {
-                "inline_query_id": query_id,
-                "results": results[:10],  # Limit results
-                "cache_time": 300
-            }
-            
-            result = await self._make_request("POST", "answerInlineQuery", data)
-            return result is not None
-            
-        except Exception as e:
-            self.logger.error(f"Error handling inline query: {e}")
-            return False
-    
     async def send_broadcast_message(
         self, 
         user_ids: List[int], 
@@ -500,4 +339,33 @@ async def create_telegram_service(bot_token: str) -> TelegramService:
     if not validation["valid"]:
         raise ValueError(f"Invalid Telegram bot token: {validation.get('error', 'Unknown error')}")
     
-    return service
\ No newline at end of file
+    return service
+
+# Long-lived per-token facades over the shared session
+_services: Dict[str, List[Any]] = {}
+_services_lock = threading.Lock()
+_SERVICE_IDLE_SECONDS = int(os.environ.get("TELEGRAM_SERVICE_IDLE_SECONDS", 600))
+_last_eviction = time.monotonic()
+
+
+def get_telegram_service(bot_token: str) -> TelegramService:
+    """
+    Return the shared TelegramService for a token, evicting facades idle too long
+    """
+    global _last_eviction
+    now = time.monotonic()
+
+    with _services_lock:
+        if now - _last_eviction > 60:
+            _last_eviction = now
+            for token in [token for token, (_, last_used) in _services.items()
+                          if now - last_used > _SERVICE_IDLE_SECONDS]:
+                del _services[token]
+
+        entry = _services.get(bot_token)
+        if entry is None:
+            entry = [TelegramService(bot_token), now]
+            _services[bot_token] = entry
+        else:
+            entry[1] = now
+        return entry[0]
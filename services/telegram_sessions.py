@@ -0,0 +1,100 @@
+import os
+import asyncio
+import logging
+import weakref
+from typing import Dict, Any, Optional
+
+import aiohttp
+
+from utils import metrics
+
+
+class TelegramSessionRegistry:
+    """
+    Long-lived aiohttp session for Telegram Bot API calls on one event loop.
+
+    All bot tokens share one TCPConnector with DNS caching and keep-alive,
+    so calls reuse warm connections to api.telegram.org instead of paying
+    a new TLS handshake each time.
+    """
+
+    def __init__(self, limit: Optional[int] = None, keepalive_timeout: Optional[float] = None,
+                 dns_cache_ttl: Optional[int] = None):
+        self.limit = limit or int(os.environ.get("TELEGRAM_POOL_SIZE", 100))
+        self.keepalive_timeout = keepalive_timeout or float(os.environ.get("TELEGRAM_KEEPALIVE_SECONDS", 60))
+        self.dns_cache_ttl = dns_cache_ttl or int(os.environ.get("TELEGRAM_DNS_CACHE_TTL", 300))
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The shared session, created on first use
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30),
+                trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    @staticmethod
+    def _trace_config() -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            metrics.increment('telegram.requests')
+
+        async def on_connection_create_end(session, context, params):
+            metrics.increment('telegram.connections_created')
+
+        async def on_connection_reuseconn(session, context, params):
+            metrics.increment('telegram.connections_reused')
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats = metrics.snapshot('telegram.')
+        created = stats.get('telegram.connections_created', 0)
+        reused = stats.get('telegram.connections_reused', 0)
+        stats['telegram.connection_reuse_ratio'] = round(reused / (created + reused), 3) if created + reused else 0.0
+        return stats
+
+
+# Sessions cannot cross event loops, so each loop gets its own registry
+_registries: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TelegramSessionRegistry]" = weakref.WeakKeyDictionary()
+
+
+def get_session_registry() -> TelegramSessionRegistry:
+    """
+    Registry for the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    registry = _registries.get(loop)
+    if registry is None:
+        registry = TelegramSessionRegistry()
+        _registries[loop] = registry
+    return registry
+
+
+async def close_session_registry() -> None:
+    """
+    Close the running loop's shared session; call before the loop shuts down
+    """
+    registry = _registries.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry.close()
+        logging.info("Closed shared Telegram session")
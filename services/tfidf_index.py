@@ -0,0 +1,208 @@
+import math
+import heapq
+import struct
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = b'BTFIDF01'
+BM25_MAGIC = b'BBM25I01'
+# magic, term count, document count, posting count
+HEADER = struct.Struct('<8sQQQ')
+
+
+def _pad(size: int) -> int:
+    """
+    Bytes needed to keep the next section 8-byte aligned
+    """
+    return -size % 8
+
+
+class TfidfIndex:
+    """
+    Read-only TF-IDF index stored column-wise (CSC) in flat typed arrays.
+
+    The buffer holds the sorted vocabulary, per-term posting offsets, posting
+    document positions (uint32), L2-normalized tf-idf weights (float32) and
+    idf values (float32). Opened over a memory-mapped snapshot, every worker
+    shares one copy of its pages through the OS page cache; nothing is
+    unpacked into Python objects except the postings of the query terms.
+
+    With scheme 'bm25' the weights are precomputed BM25 impacts instead, and
+    a query sums them, ranking exactly like `BM25Index` at build time.
+    """
+
+    def __init__(self, buffer, path: Optional[str] = None):
+        self.path = path
+        self._buffer = buffer
+
+        view = memoryview(buffer)
+        magic, n_terms, n_docs, n_postings = HEADER.unpack_from(view, 0)
+        if magic not in (MAGIC, BM25_MAGIC):
+            raise ValueError(f"Not a TF-IDF index: {path}")
+        self.scheme = 'bm25' if magic == BM25_MAGIC else 'tfidf'
+
+        self.n_terms = n_terms
+        self.n_docs = n_docs
+
+        offset = HEADER.size
+        sections = []
+        for fmt, count in (('q', n_docs), ('Q', n_terms + 1), ('Q', n_terms + 1),
+                           ('I', n_postings), ('f', n_postings), ('f', n_terms)):
+            size = struct.calcsize(fmt) * count
+            sections.append(view[offset:offset + size].cast(fmt))
+            offset += size + _pad(size)
+        self.doc_ids, self._term_offsets, self._posting_offsets, \
+            self._posting_docs, self._posting_weights, self._idf = sections
+
+        vocab_size = self._term_offsets[n_terms] if n_terms else 0
+        self._vocab = view[offset:offset + vocab_size]
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[int, Dict[str, int]]], scheme: str = 'tfidf') -> 'TfidfIndex':
+        """
+        Build an in-memory index from (doc_id, term_freqs) pairs
+        """
+        return cls(cls.serialize(documents, scheme))
+
+    @staticmethod
+    def serialize(documents: Iterable[Tuple[int, Dict[str, int]]], scheme: str = 'tfidf',
+                  k1: float = 1.2, b: float = 0.75) -> bytes:
+        """
+        Index bytes for (doc_id, term_freqs) pairs, as stored in a snapshot
+        """
+        doc_ids = array('q')
+        doc_lengths = array('I')
+        columns: Dict[bytes, Tuple[array, array]] = {}
+
+        for doc_id, term_freqs in documents:
+            position = len(doc_ids)
+            doc_ids.append(doc_id)
+            doc_lengths.append(sum(term_freqs.values()))
+            for term, tf in term_freqs.items():
+                column = columns.get(term.encode('utf-8'))
+                if column is None:
+                    column = columns[term.encode('utf-8')] = (array('I'), array('f'))
+                column[0].append(position)
+                column[1].append(tf)
+
+        n_docs = len(doc_ids)
+        # Sorting the UTF-8 bytes gives the order the binary search compares in
+        terms = sorted(columns)
+
+        if scheme == 'bm25':
+            magic = BM25_MAGIC
+            idf = array('f', (math.log(1 + (n_docs - len(columns[term][0]) + 0.5) / (len(columns[term][0]) + 0.5))
+                              for term in terms))
+            avg_length = sum(doc_lengths) / n_docs if n_docs else 1.0
+            norms = [1.0] * n_docs
+            for term, term_idf in zip(terms, idf):
+                positions, weights = columns[term]
+                for i, (position, tf) in enumerate(zip(positions, weights)):
+                    weights[i] = term_idf * tf * (k1 + 1) / (
+                        tf + k1 * (1 - b + b * doc_lengths[position] / (avg_length or 1.0)))
+        else:
+            magic = MAGIC
+            idf = array('f', (math.log((1 + n_docs) / (1 + len(columns[term][0]))) + 1.0 for term in terms))
+            norms = [0.0] * n_docs
+            for term, term_idf in zip(terms, idf):
+                positions, weights = columns[term]
+                for i, (position, tf) in enumerate(zip(positions, weights)):
+                    weight = (1.0 + math.log(tf)) * term_idf
+                    weights[i] = weight
+                    norms[position] += weight * weight
+            norms = [math.sqrt(norm) or 1.0 for norm in norms]
+
+        term_offsets = array('Q', [0])
+        posting_offsets = array('Q', [0])
+        posting_docs = array('I')
+        posting_weights = array('f')
+        vocab = bytearray()
+        for term in terms:
+            positions, weights = columns[term]
+            posting_docs.extend(positions)
+            posting_weights.extend(weight / norms[position] for position, weight in zip(positions, weights))
+            posting_offsets.append(len(posting_docs))
+            vocab += term
+            term_offsets.append(len(vocab))
+
+        out = bytearray(HEADER.pack(magic, len(terms), n_docs, len(posting_docs)))
+        for section in (doc_ids, term_offsets, posting_offsets, posting_docs, posting_weights, idf):
+            data = section.tobytes()
+            out += data
+            out += b'\0' * _pad(len(data))
+        out += vocab
+        return bytes(out)
+
+    def _term_id(self, term: str) -> int:
+        """
+        Position of a term in the sorted vocabulary, or -1
+        """
+        key = term.encode('utf-8')
+        offsets, vocab = self._term_offsets, self._vocab
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate = vocab[offsets[mid]:offsets[mid + 1]].tobytes()
+            if candidate < key:
+                lo = mid + 1
+            elif candidate > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def search(self, query_terms: Iterable[str], k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Top-k (doc_id, score) pairs for a query, best first; tf-idf scores are cosines.
+
+        The query becomes a normalized tf-idf vector and is multiplied against
+        the posting columns of its terms only, rarest first. Once there are
+        enough candidates, a column longer than the candidate set is probed
+        by binary search (positions are sorted) instead of being scanned.
+        """
+        query_freqs: Dict[int, int] = {}
+        for term in query_terms:
+            term_id = self._term_id(term)
+            if term_id >= 0:
+                query_freqs[term_id] = query_freqs.get(term_id, 0) + 1
+        if not query_freqs:
+            return []
+
+        offsets = self._posting_offsets
+        if self.scheme == 'bm25':
+            query_weights = dict.fromkeys(query_freqs, 1.0)
+            query_norm = 1.0
+        else:
+            query_weights = {term_id: (1.0 + math.log(tf)) * self._idf[term_id] for term_id, tf in query_freqs.items()}
+            query_norm = math.sqrt(sum(weight * weight for weight in query_weights.values())) or 1.0
+
+        scores: Dict[int, float] = {}
+        for term_id in sorted(query_weights, key=lambda term_id: offsets[term_id + 1] - offsets[term_id]):
+            query_weight = query_weights[term_id] / query_norm
+            start, end = offsets[term_id], offsets[term_id + 1]
+            positions = self._posting_docs[start:end]
+            weights = self._posting_weights[start:end]
+
+            if len(scores) >= k and end - start > len(scores):
+                for position in scores:
+                    i = bisect_left(positions, position)
+                    if i < len(positions) and positions[i] == position:
+                        scores[position] += query_weight * weights[i]
+            else:
+                for position, weight in zip(positions, weights):
+                    scores[position] = scores.get(position, 0.0) + query_weight * weight
+
+        doc_ids = self.doc_ids
+        return [(doc_ids[position], score)
+                for position, score in heapq.nlargest(k, scores.items(), key=itemgetter(1))]
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held privately by this index; mapped snapshots live in the shared page cache
+        """
+        return 0 if self.path else len(self._buffer)
+
+    def __len__(self) -> int:
+        return self.n_docs
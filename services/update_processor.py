@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+from typing import Dict, Any, Optional
+
+from flask import current_app
+
+from services.ai_service import AIService
+from services.async_runner import run_async
+from services.bot_cache import bot_config_cache
+from services.context_assembler import context_assembler
+from services.conversation_memory import get_conversation_memory
+from services.conversation_service import conversation_store
+from services.knowledge_service import knowledge_service
+from services.llm_gate import llm_gate
+from services.message_writer import get_message_writer
+from services.reply_streamer import ReplyStreamer
+from services.telegram_service import get_telegram_service
+
+
+class UpdateProgress:
+    """
+    Side effects an update has had so far, so a retry can skip finished
+    steps and stop before repeating one the user would see
+    """
+
+    def __init__(self):
+        self.message_stored = False
+        self.reply_started = False
+
+    @property
+    def retryable(self) -> bool:
+        return not self.reply_started
+
+
+class UpdateProcessor:
+    """
+    Runs the AI and send steps for a queued Telegram update
+    """
+
+    def process(self, bot_id: int, update: Dict[str, Any], progress: Optional[UpdateProgress] = None) -> bool:
+        """
+        Process a single update; returns False when the update was ignored.
+
+        Steps recorded in `progress` by an earlier attempt are not repeated.
+        """
+        progress = progress or UpdateProgress()
+        bot = bot_config_cache.get(bot_id)
+        if not bot or not bot.is_active or not bot.telegram_token:
+            return False
+
+        if 'message' not in update:
+            return False
+
+        message = update['message']
+        chat_id = message['chat']['id']
+        user_id = message.get('from', {}).get('id')
+        text = message.get('text', '')
+
+        if not text:
+            return False
+
+        conversation_id = conversation_store.get_or_create_id(bot.id, bot.user_id, chat_id, user_id)
+        # Recent turns verbatim, older ones as a rolling summary
+        summary, history = get_conversation_memory(current_app._get_current_object()).load(conversation_id)
+
+        # Messages and the conversation timestamp are persisted by the write-behind buffer
+        writer = get_message_writer(current_app._get_current_object())
+        if not progress.message_stored:
+            writer.add_message(conversation_id, text, True, str(message.get('message_id', '')))
+            progress.message_stored = True
+
+        # Counted from dequeue: a queue backlog or a restart must still get replies,
+        # while a call that cannot start soon enough is turned away
+        deadline = time.monotonic() + llm_gate.deadline_seconds
+
+        # Generate AI response
+        ai_service = AIService()
+        # Only the chunks most relevant to this message go into the prompt
+        chunks = knowledge_service.retrieve(bot, text)
+        options = dict(
+            history=history,
+            summary=summary,
+            max_tokens=bot.max_tokens,
+            temperature=bot.temperature,
+            budget=context_assembler.budget_for(bot.plan),
+            bot=bot,
+            deadline=deadline
+        )
+        telegram = get_telegram_service(bot.telegram_token)
+        # From here on a failure may already have reached the chat
+        progress.reply_started = True
+
+        if os.environ.get("STREAM_REPLIES", "1") != "0":
+            # The reply appears in the chat while it is being generated
+            streamer = ReplyStreamer(telegram, chat_id)
+            for piece in ai_service.stream_response(text, chunks, bot.system_prompt, **options):
+                streamer.feed(piece)
+            response = streamer.finish()
+            sent = streamer.delivered
+        else:
+            response = ai_service.generate_response(text, chunks, bot.system_prompt, **options)
+            sent = run_async(telegram.send_message(chat_id, response, parse_mode=None))
+
+        writer.add_message(conversation_id, response, False)
+
+        if not sent:
+            logging.warning(f"Failed to deliver reply for bot {bot.id} to chat {chat_id}")
+        return True
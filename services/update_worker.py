@@ -0,0 +1,200 @@
+import os
+import time
+import socket
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+from app import db
+from services.dispatcher import ShardedDispatcher, ShardBacklogFull
+from services.message_writer import get_message_writer
+from services.dedup_service import update_deduplicator
+from services.webhook_queue import webhook_queue
+from services.update_processor import UpdateProcessor, UpdateProgress
+
+
+class UpdateWorkerPool:
+    """
+    Drains the webhook queue onto a sharded dispatcher.
+
+    A single poller thread claims queued updates and hands each one to the
+    shard for its `(bot_id, chat_id)`, so updates from one chat are handled
+    strictly in order while different chats are processed in parallel.
+    """
+
+    def __init__(self, app, size: Optional[int] = None, shard_backlog: Optional[int] = None,
+                 poll_interval: Optional[float] = None):
+        self.app = app
+        self.size = size or int(os.environ.get("WEBHOOK_WORKERS", 16))
+        self.shard_backlog = shard_backlog or int(os.environ.get("WEBHOOK_SHARD_BACKLOG", 100))
+        self.poll_interval = poll_interval or float(os.environ.get("WEBHOOK_WORKER_POLL_INTERVAL", 0.5))
+        # Claim at most this many updates ahead of the threads that run them
+        self.max_in_flight = self.size * 4
+        self.purge_interval = 3600
+        self.processor = UpdateProcessor()
+        self.pid = os.getpid()
+        self.worker_id = f"{socket.gethostname()}:{self.pid}"
+
+        self.dispatcher = ShardedDispatcher(concurrency=self.size, shard_backlog=self.shard_backlog,
+                                            on_abandon=self._release_abandoned)
+        self._poller = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def start(self) -> None:
+        """
+        Start the poller thread
+        """
+        self._poller = threading.Thread(target=self._poll, name="update-poller", daemon=True)
+        self._poller.start()
+        logging.info(f"Started webhook update workers ({self.size} threads) in process {self.pid}")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop claiming new updates, wait for in-flight updates to finish and
+        return the ones still queued to the webhook queue
+        """
+        self._stop.set()
+        self._wakeup.set()
+        if self._poller:
+            self._poller.join(timeout)
+        self.dispatcher.shutdown(wait=True)
+        get_message_writer(self.app).flush()
+
+    def notify(self) -> None:
+        """
+        Wake the poller after a new update was enqueued
+        """
+        self._wakeup.set()
+
+    def _poll(self) -> None:
+        next_purge = time.monotonic() + self.purge_interval
+        while not self._stop.is_set():
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + self.purge_interval
+                self._purge()
+
+            claimed = 0
+            capacity = self.max_in_flight - self.dispatcher.pending()
+
+            if capacity > 0:
+                with self.app.app_context():
+                    try:
+                        claimed = self._dispatch_batch(capacity)
+                    except Exception as e:
+                        logging.error(f"Update poller error: {e}")
+                        db.session.rollback()
+                    finally:
+                        db.session.remove()
+
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _purge(self) -> None:
+        """
+        Trim processed updates and expired idempotency markers
+        """
+        with self.app.app_context():
+            try:
+                webhook_queue.purge_completed()
+                update_deduplicator.purge()
+            except Exception as e:
+                logging.error(f"Error purging processed updates: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def _dispatch_batch(self, limit: int) -> int:
+        items = webhook_queue.claim(self.worker_id, limit)
+        # Chats with a released update; their later updates must stay behind it
+        held = set()
+
+        for item in items:
+            # Updates without a chat have no ordering constraint
+            key = (item.bot_id, item.chat_id or f"update:{item.id}")
+            if key in held:
+                webhook_queue.release(item.id)
+                continue
+            try:
+                self.dispatcher.submit(key, self._handle, item.id, item.bot_id, item.payload)
+            except (ShardBacklogFull, RuntimeError):
+                # RuntimeError: the dispatcher shut down while this batch was being handed out
+                webhook_queue.release(item.id)
+                held.add(key)
+
+        return len(items)
+
+    def _release_abandoned(self, fn, args) -> None:
+        """
+        Return an update that was queued when the dispatcher shut down
+        """
+        item_id = args[0]
+        with self.app.app_context():
+            try:
+                webhook_queue.release(item_id)
+            except Exception as e:
+                # The claim times out and the update is picked up again then
+                logging.error(f"Could not release webhook update {item_id}: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def _handle(self, item_id: int, bot_id: int, payload: Dict[str, Any]) -> None:
+        """
+        Process one update, retrying in place so later updates of the chat wait for it.
+
+        Only failures before the reply step are retried: once generation or
+        delivery has started, a retry could repeat the model call and the
+        messages the user already received.
+        """
+        progress = UpdateProgress()
+        with self.app.app_context():
+            try:
+                for attempt in range(1, webhook_queue.max_attempts + 1):
+                    try:
+                        self.processor.process(bot_id, payload, progress)
+                        webhook_queue.complete(item_id)
+                        return
+                    except Exception as e:
+                        logging.error(f"Error processing webhook update {item_id} (attempt {attempt}): {e}")
+                        db.session.rollback()
+                        if attempt == webhook_queue.max_attempts or not progress.retryable:
+                            webhook_queue.fail(item_id, str(e), retry=False)
+                            return
+                        else:
+                            time.sleep(0.5 * 2 ** (attempt - 1))
+            finally:
+                db.session.remove()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.dispatcher.stats()
+        stats['pid'] = self.pid
+        stats['poller_alive'] = bool(self._poller and self._poller.is_alive())
+        return stats
+
+
+_pool: Optional[UpdateWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(app) -> UpdateWorkerPool:
+    """
+    Return this process's worker pool, starting it on first use.
+
+    Pools are per process: a pool inherited through fork has no live threads,
+    so a new one is started in the child.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = UpdateWorkerPool(app)
+            _pool.start()
+        return _pool
+
+
+def embedded_workers_enabled() -> bool:
+    """
+    Whether web processes drain the queue themselves (disable when running worker.py)
+    """
+    return os.environ.get("WEBHOOK_EMBEDDED_WORKERS", "1") == "1"
@@ -0,0 +1,30 @@
+from typing import Any
+
+from services.bot_cache import bot_config_cache
+from services.update_worker import get_worker_pool, embedded_workers_enabled
+from services.webhook_queue import webhook_queue
+
+
+def accept_update(app, bot_id: int, update_data: Any) -> int:
+    """
+    Validate and queue a webhook update; returns the HTTP status to answer with.
+
+    Shared by the Flask route and the ASGI endpoint. Must run inside an app context.
+    """
+    bot = bot_config_cache.get(bot_id)
+
+    if not bot or not bot.is_active or not bot.telegram_token:
+        return 404
+
+    if not isinstance(update_data, dict) or 'update_id' not in update_data:
+        return 400
+
+    # Queue the update; the AI and send steps run on the update workers.
+    # Redeliveries of an already accepted update are acknowledged and dropped.
+    if webhook_queue.enqueue(bot.id, update_data) is None:
+        return 200
+
+    if embedded_workers_enabled():
+        get_worker_pool(app).notify()
+
+    return 200
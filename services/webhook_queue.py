@@ -0,0 +1,219 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import func, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import WebhookUpdate
+from services.dedup_service import update_deduplicator
+
+
+class WebhookQueue:
+    """
+    Durable, database-backed queue for Telegram webhook updates.
+
+    The webhook route only enqueues; update workers claim rows in batches,
+    process them off the request path and mark them done or failed.
+    """
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # Postgres advisory lock key serializing claims across processes
+    CLAIM_LOCK_KEY = 0x7765626b
+
+    def __init__(self, max_attempts: Optional[int] = None, claim_timeout: Optional[int] = None):
+        self.max_attempts = max_attempts or int(os.environ.get("WEBHOOK_QUEUE_MAX_ATTEMPTS", 3))
+        # Seconds after which a claimed row is considered abandoned by a dead worker
+        self.claim_timeout = claim_timeout or int(os.environ.get("WEBHOOK_QUEUE_CLAIM_TIMEOUT", 300))
+
+    def enqueue(self, bot_id: int, update: Dict[str, Any]) -> Optional[WebhookUpdate]:
+        """
+        Persist an update for later processing.
+
+        Returns None when the update was already accepted (a Telegram redelivery).
+        """
+        update_id = update.get('update_id')
+        if update_id is not None and update_deduplicator.is_known(bot_id, update_id):
+            return None
+
+        item = WebhookUpdate()
+        item.bot_id = bot_id
+        item.update_id = update_id
+        item.chat_id = self.extract_chat_id(update)
+        item.payload = update
+        db.session.add(item)
+
+        if update_id is None:
+            db.session.commit()
+            return item
+
+        # The idempotency marker commits atomically with the queued update
+        update_deduplicator.register(bot_id, update_id)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            update_deduplicator.record_duplicate(bot_id, update_id)
+            return None
+
+        update_deduplicator.remember(bot_id, update_id)
+        return item
+
+    @staticmethod
+    def extract_chat_id(update: Dict[str, Any]) -> Optional[str]:
+        """
+        Find the chat an update belongs to, if any
+        """
+        for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+            if key in update:
+                chat_id = update[key].get('chat', {}).get('id')
+                return str(chat_id) if chat_id is not None else None
+
+        if 'callback_query' in update:
+            chat_id = update['callback_query'].get('message', {}).get('chat', {}).get('id')
+            return str(chat_id) if chat_id is not None else None
+
+        return None
+
+    def claim(self, worker_id: str, limit: int = 10) -> List[WebhookUpdate]:
+        """
+        Atomically claim up to `limit` pending updates in arrival order
+        """
+        self._release_stale_claims()
+
+        if db.engine.dialect.name == 'postgresql':
+            # One claim at a time, so a chat claimed by one worker is visible to the next
+            # claim; the lock is released when the claim commits
+            db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': self.CLAIM_LOCK_KEY})
+
+        # Skip chats another worker is still processing so per-chat order holds across processes
+        candidate = aliased(WebhookUpdate)
+        in_flight = aliased(WebhookUpdate)
+        busy_elsewhere = select(in_flight.id).where(
+            in_flight.bot_id == candidate.bot_id,
+            in_flight.chat_id == candidate.chat_id,
+            in_flight.status == self.PROCESSING,
+            in_flight.claimed_by != worker_id
+        ).exists()
+        candidates = select(candidate.id).where(
+            candidate.status == self.PENDING,
+            ~busy_elsewhere
+        ).order_by(candidate.id).limit(limit)
+
+        # Choosing and claiming the rows is one statement, so no claim can slip in between
+        claimed_ids = db.session.scalars(
+            update(WebhookUpdate).where(
+                WebhookUpdate.id.in_(candidates),
+                WebhookUpdate.status == self.PENDING
+            ).values(
+                status=self.PROCESSING,
+                claimed_by=worker_id,
+                claimed_at=datetime.utcnow(),
+                attempts=WebhookUpdate.attempts + 1
+            ).returning(WebhookUpdate.id).execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+
+        if not claimed_ids:
+            return []
+        return WebhookUpdate.query.filter(
+            WebhookUpdate.id.in_(claimed_ids)
+        ).order_by(WebhookUpdate.id).all()
+
+    def complete(self, item_id: int) -> None:
+        """
+        Mark an update as processed
+        """
+        WebhookUpdate.query.filter_by(id=item_id).update({
+            'status': self.DONE,
+            'processed_at': datetime.utcnow(),
+            'last_error': None
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def release(self, item_id: int) -> None:
+        """
+        Return a claimed update to the queue without counting it as an attempt
+        """
+        WebhookUpdate.query.filter_by(id=item_id, status=self.PROCESSING).update({
+            'status': self.PENDING,
+            'claimed_by': None,
+            'attempts': WebhookUpdate.attempts - 1
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def fail(self, item_id: int, error: str, retry: bool = True) -> None:
+        """
+        Record a processing failure, re-queueing the update until attempts run out
+        """
+        item = db.session.get(WebhookUpdate, item_id)
+        if not item:
+            return
+
+        item.last_error = error[:2000]
+        if not retry or item.attempts >= self.max_attempts:
+            item.status = self.FAILED
+            item.processed_at = datetime.utcnow()
+            logging.error(f"Webhook update {item_id} failed permanently: {error}")
+        else:
+            item.status = self.PENDING
+            item.claimed_by = None
+        db.session.commit()
+
+    def _release_stale_claims(self) -> None:
+        """
+        Return updates claimed by crashed workers to the queue
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.claim_timeout)
+        released = WebhookUpdate.query.filter(
+            WebhookUpdate.status == self.PROCESSING,
+            WebhookUpdate.claimed_at < cutoff
+        ).update({'status': self.PENDING, 'claimed_by': None}, synchronize_session=False)
+
+        if released:
+            db.session.commit()
+            logging.warning(f"Released {released} stale webhook update claims")
+
+    def purge_completed(self, older_than: timedelta = timedelta(days=1)) -> int:
+        """
+        Delete processed updates older than the given age
+        """
+        cutoff = datetime.utcnow() - older_than
+        deleted = WebhookUpdate.query.filter(
+            WebhookUpdate.status == self.DONE,
+            WebhookUpdate.processed_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Queue depth and age, used to size the worker pool
+        """
+        counts = dict(db.session.query(
+            WebhookUpdate.status, func.count(WebhookUpdate.id)
+        ).group_by(WebhookUpdate.status).all())
+
+        oldest_pending = db.session.query(func.min(WebhookUpdate.created_at)).filter(
+            WebhookUpdate.status == self.PENDING
+        ).scalar()
+
+        oldest_age = (datetime.utcnow() - oldest_pending).total_seconds() if oldest_pending else 0.0
+
+        return {
+            'depth': counts.get(self.PENDING, 0),
+            'processing': counts.get(self.PROCESSING, 0),
+            'done': counts.get(self.DONE, 0),
+            'failed': counts.get(self.FAILED, 0),
+            'oldest_pending_age_seconds': round(oldest_age, 3)
+        }
+
+
+webhook_queue = WebhookQueue()
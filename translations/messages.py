@@ -90,12 +90,14 @@ TRANSLATIONS = {
         'system_prompt': 'System Prompt',
         'temperature': 'Temperature',
         'max_tokens': 'Max Tokens',
+        'retrieval_strategy': 'Knowledge Search',
         'bot_status': 'Status',
         'active': 'Active',
         'inactive': 'Inactive',
         'save_changes': 'Save Changes',
         'add_knowledge': 'Add Knowledge',
         'upload_file': 'Upload File',
+        'file_content_readonly': 'This item comes from an uploaded file; only its title can be edited. Upload the file again to change its content.',
         
         # Admin
         'admin_panel': 'Admin Panel',
@@ -231,12 +233,14 @@ TRANSLATIONS = {
         'system_prompt': 'Системный промпт',
         'temperature': 'Температура',
         'max_tokens': 'Макс. токенов',
+        'retrieval_strategy': 'Поиск по базе знаний',
         'bot_status': 'Статус',
         'active': 'Активный',
         'inactive': 'Неактивный',
         'save_changes': 'Сохранить изменения',
         'add_knowledge': 'Добавить знания',
         'upload_file': 'Загрузить файл',
+        'file_content_readonly': 'Этот элемент загружен из файла, изменить можно только название. Чтобы изменить содержимое, загрузите файл заново.',
         
         # Admin
         'admin_panel': 'Админ панель',
@@ -372,12 +376,14 @@ TRANSLATIONS = {
         'system_prompt': 'Tizim prompti',
         'temperature': 'Harorat',
         'max_tokens': 'Maks. tokenlar',
+        'retrieval_strategy': 'Bilimlar bazasida qidiruv',
         'bot_status': 'Holat',
         'active': 'Faol',
         'inactive': 'Nofaol',
         'save_changes': 'O\'zgarishlarni saqlash',
         'add_knowledge': 'Bilim qo\'shish',
         'upload_file': 'Fayl yuklash',
+        'file_content_readonly': 'Bu element fayldan yuklangan, faqat nomini o\'zgartirish mumkin. Mazmunini o\'zgartirish uchun faylni qayta yuklang.',
         
         # Admin
         'admin_panel': 'Admin panel',
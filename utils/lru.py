@@ -0,0 +1,94 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live per entry.
+
+    With `maxweight` and a `weigh` function, entries are also evicted while
+    their total weight (weighed when stored) exceeds maxweight; the newest
+    entry is always kept.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None,
+                 maxweight: Optional[int] = None, weigh: Optional[Callable[[Any], int]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self._data = OrderedDict()
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return a live entry and mark it most recently used
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._delete(key)
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store an entry, evicting the least recently used ones beyond maxsize
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        weight = self.weigh(value) if self.weigh else 0
+
+        with self._lock:
+            self._delete(key)
+            self._data[key] = (value, expires_at)
+            self._weights[key] = weight
+            self.weight += weight
+            while len(self._data) > self.maxsize or \
+                    self.maxweight is not None and self.weight > self.maxweight and len(self._data) > 1:
+                self._delete(next(iter(self._data)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            self._delete(key)
+            return default if entry is _MISSING else entry[0]
+
+    def _delete(self, key: Hashable) -> None:
+        if self._data.pop(key, _MISSING) is not _MISSING:
+            self.weight -= self._weights.pop(key, 0)
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Remove every entry whose key matches the predicate
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._delete(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,33 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+
+
+def increment(name: str, value: float = 1) -> None:
+    """
+    Add to a process-wide counter
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def get_counter(name: str) -> float:
+    """
+    Read a single counter
+    """
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot(prefix: Optional[str] = None) -> Dict[str, float]:
+    """
+    Copy of all counters, optionally limited to names starting with prefix
+    """
+    with _lock:
+        return {
+            name: value for name, value in sorted(_counters.items())
+            if prefix is None or name.startswith(prefix)
+        }
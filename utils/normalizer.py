@@ -0,0 +1,121 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# Bump whenever normalization output changes, so stored token streams are rebuilt
+NORMALIZER_VERSION = 3
+
+# Apostrophes inside words (Uzbek o‘/g‘ and ʼ, English contractions) are dropped
+# so "o'zbek", "oʻzbek" and "ўзбек" all become "ozbek"
+_INNER_APOSTROPHE_RE = re.compile(r"(?<=\w)['`´ʻʼ‘’](?=\w)")
+_CYRILLIC_RE = re.compile(r'[Ѐ-ӿ]')
+
+_CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+}
+_VOWELS = set('аеёиоуэюяўы')
+
+# Inflection endings per script as (suffix, shortest stem left behind), longest
+# first. Cyrillic words are stemmed before transliteration, where Russian
+# endings are still distinct from Uzbek ones (магазины is not an Uzbek -ни
+# form); Uzbek suffixes are listed in both scripts so a word stems the same
+# in either. Latin words get Uzbek suffixes only. The shortest endings need
+# a longer stem, so short words that merely end like them (книга, уйда)
+# are left alone.
+_UZBEK_SUFFIXES = (
+    ('larning', 3), ('lardan', 3), ('larga', 3), ('larda', 3), ('larni', 3), ('lari', 3),
+    ('lar', 3), ('ning', 3), ('dagi', 3), ('dan', 3), ('lik', 3),
+)
+_UZBEK_SHORT_SUFFIXES = ('ni', 'ga', 'da')
+_RUSSIAN_ENDINGS = (
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ими', 'ыми', 'ях', 'ах', 'ов', 'ев',
+    'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ую', 'юю', 'ом', 'ем', 'ам', 'ям',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю',
+)
+_LATIN_TO_CYRILLIC = str.maketrans({
+    'a': 'а', 'd': 'д', 'g': 'г', 'i': 'и', 'k': 'к', 'l': 'л', 'n': 'н', 'r': 'р',
+})
+
+
+def _by_length(suffixes):
+    return tuple(sorted(suffixes, key=lambda entry: len(entry[0]), reverse=True))
+
+
+_SUFFIXES = {
+    'latin': _by_length(_UZBEK_SUFFIXES + tuple((suffix, 4) for suffix in _UZBEK_SHORT_SUFFIXES)),
+    'cyrillic': _by_length(
+        tuple((suffix.translate(_LATIN_TO_CYRILLIC), min_stem) for suffix, min_stem in _UZBEK_SUFFIXES)
+        + tuple((suffix.translate(_LATIN_TO_CYRILLIC), 4) for suffix in _UZBEK_SHORT_SUFFIXES)
+        + tuple((ending, 4 if len(ending) == 1 else 3) for ending in _RUSSIAN_ENDINGS)
+    ),
+}
+
+
+def transliterate(token: str) -> str:
+    """
+    Uzbek Cyrillic to Latin (2021 alphabet, without apostrophes); also
+    applied to Russian so both scripts share one index vocabulary
+    """
+    out = []
+    previous = ''
+    for char in token:
+        if char == 'е' and (not previous or previous in _VOWELS):
+            out.append('ye')
+        else:
+            out.append(_CYRILLIC_TO_LATIN.get(char, char))
+        previous = char
+    return ''.join(out)
+
+
+def _strip_suffix(token: str, script: str) -> str:
+    for suffix, min_stem in _SUFFIXES[script]:
+        if token.endswith(suffix) and len(token) - len(suffix) >= min_stem:
+            return token[:-len(suffix)]
+    return token
+
+
+def stem(token: str, script: str = 'latin') -> str:
+    """
+    Light stemmer: one inflection ending of the word's script; Latin words
+    without one get English plural/verb endings removed first. Uzbek suffixes
+    come first so -ning is not cut as -ing (kitobning -> kitob, like китобнинг)
+    """
+    stripped = _strip_suffix(token, script)
+    if stripped != token or script != 'latin':
+        return stripped
+
+    if len(token) > 4 and token.endswith('ies'):
+        token = token[:-3] + 'y'
+    elif len(token) > 5 and token.endswith('ing'):
+        token = token[:-3]
+    elif len(token) > 4 and token.endswith('ed'):
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        token = token[:-1]
+    return _strip_suffix(token, script)
+
+
+@lru_cache(maxsize=200000)
+def normalize_token(token: str) -> str:
+    """
+    Fold, transliterate and lightly stem one lowercase word
+    """
+    if _CYRILLIC_RE.search(token):
+        return transliterate(stem(token, 'cyrillic'))
+    if not token.isascii():
+        # Strip Latin diacritics (café -> cafe)
+        token = ''.join(char for char in unicodedata.normalize('NFKD', token)
+                        if not unicodedata.combining(char))
+    return stem(token)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Unicode-fold a text and join apostrophe-split words, before tokenizing
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _INNER_APOSTROPHE_RE.sub('', text)
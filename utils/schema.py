@@ -0,0 +1,133 @@
+import enum
+import logging
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import UniqueConstraint, inspect, text
+from sqlalchemy.exc import DatabaseError
+
+
+def add_missing_columns(db) -> List[str]:
+    """
+    Add model columns that existing tables are missing.
+
+    db.create_all() only creates missing tables, so columns added to models
+    after a table was created would otherwise break the first query that
+    selects them. New columns are added with their scalar default (NOT NULL
+    only when they have one) plus their foreign key and indexes. Safe to run
+    on every start and from several processes at once. Returns the
+    "table.column" names that were added.
+    """
+    engine = db.engine
+    dialect = engine.dialect
+    existing_tables = set(inspect(engine).get_table_names())
+    added = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {column['name'] for column in inspect(engine).get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name in present:
+                continue
+
+            ddl = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if default is not None:
+                ddl += f" DEFAULT {_literal(default)}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            foreign_keys = list(column.foreign_keys)
+            if len(foreign_keys) == 1:
+                target = foreign_keys[0].column
+                ddl += f" REFERENCES {target.table.name} ({target.name})"
+                if foreign_keys[0].ondelete:
+                    ddl += f" ON DELETE {foreign_keys[0].ondelete}"
+
+            # Another process may be adding the same column right now
+            if_not_exists = "IF NOT EXISTS " if dialect.name == 'postgresql' else ""
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{ddl}"))
+            except DatabaseError as e:
+                if column.name in {c['name'] for c in inspect(engine).get_columns(table.name)}:
+                    continue
+                logging.error(f"Could not add column {table.name}.{column.name}: {e}")
+                raise
+            added.append(f"{table.name}.{column.name}")
+            logging.warning(f"Added missing column {table.name}.{column.name}")
+
+        new_columns = {name.split('.', 1)[1] for name in added if name.startswith(f"{table.name}.")}
+        for index in table.indexes:
+            if new_columns & {column.name for column in index.columns}:
+                index.create(engine, checkfirst=True)
+
+    return added
+
+
+def add_missing_unique_constraints(db, before_create: Optional[Dict[str, Callable]] = None) -> List[str]:
+    """
+    Add model unique constraints that existing tables are missing, as
+    unique indexes under the constraint's name.
+
+    Rows that would violate a constraint must be resolved first:
+    `before_create` maps a constraint name to a function called with the
+    connection, in the same transaction, right before its index is built
+    (on Postgres with the table locked against concurrent writes). A
+    constraint whose index cannot be built is logged and skipped, so
+    callers must still work without it. Returns the names that were added.
+    """
+    engine = db.engine
+    dialect = engine.dialect
+    before_create = before_create or {}
+    existing_tables = set(inspect(engine).get_table_names())
+    added = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or not constraint.name:
+                continue
+            columns = [column.name for column in constraint.columns]
+            if _has_unique(engine, table.name, columns):
+                continue
+
+            quote = dialect.identifier_preparer.quote
+            ddl = (f"CREATE UNIQUE INDEX IF NOT EXISTS {quote(constraint.name)} "
+                   f"ON {table.name} ({', '.join(quote(column) for column in columns)})")
+            try:
+                with engine.begin() as connection:
+                    if dialect.name == 'postgresql':
+                        connection.execute(text(f"LOCK TABLE {table.name} IN SHARE ROW EXCLUSIVE MODE"))
+                    hook = before_create.get(constraint.name)
+                    if hook is not None:
+                        hook(connection)
+                    connection.execute(text(ddl))
+            except DatabaseError as e:
+                if not _has_unique(engine, table.name, columns):
+                    logging.error(f"Could not add unique constraint {constraint.name}: {e}")
+                continue
+            added.append(constraint.name)
+            logging.warning(f"Added missing unique constraint {constraint.name} on {table.name}")
+
+    return added
+
+
+def _has_unique(engine, table_name: str, columns: List[str]) -> bool:
+    inspector = inspect(engine)
+    wanted = set(columns)
+    if any(set(unique['column_names']) == wanted for unique in inspector.get_unique_constraints(table_name)):
+        return True
+    return any(index.get('unique') and set(index['column_names']) == wanted
+               for index in inspector.get_indexes(table_name))
+
+
+def _literal(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, enum.Enum):
+        value = value.name
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
@@ -0,0 +1,104 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List
+
+from utils.normalizer import normalize_text, normalize_token
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_TOKEN_PIECE_RE = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+_BREAK_RE = re.compile(r'(?:\n\s*\n|[.!?]\s|\n)')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Normalized word tokens for retrieval: folded, transliterated to Latin and lightly stemmed
+    """
+    tokens = [normalize_token(word) for word in _WORD_RE.findall(normalize_text(text or ""))]
+    return [token for token in tokens if token]
+
+
+def _piece_tokens(piece: str) -> int:
+    # Roughly 4 characters per token for Latin script, fewer for Cyrillic and others
+    if piece.isascii():
+        return (len(piece) + 3) // 4
+    return (len(piece) + 2) // 3
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Local estimate of how many model tokens a text uses
+    """
+    return sum(_piece_tokens(match.group()) for match in _TOKEN_PIECE_RE.finditer(text or ""))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Longest prefix of a text, cut between words, that fits in `max_tokens`
+    """
+    count = 0
+    for match in _TOKEN_PIECE_RE.finditer(text or ""):
+        count += _piece_tokens(match.group())
+        if count > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def term_frequencies(tokens: List[str]) -> Dict[str, int]:
+    """
+    Count occurrences of each token
+    """
+    return dict(Counter(tokens))
+
+
+def iter_chunks(pieces: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """
+    Split a stream of text into overlapping chunks of about `chunk_size` characters.
+
+    Chunks end at a paragraph, sentence or line break when one falls in the
+    second half of the window, and each chunk repeats up to `overlap`
+    characters of the previous one so facts spanning a boundary stay intact.
+    Accepts any iterable of text pieces, so large documents never need to be
+    held in memory as a whole.
+    """
+    # Each step must advance past the overlap
+    overlap = min(overlap, chunk_size // 4)
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_size + overlap:
+            end = _find_break(buffer, chunk_size)
+            chunk = buffer[:end].strip()
+            if chunk:
+                yield chunk
+            buffer = buffer[max(end - overlap, 0):]
+            buffer = buffer[_find_word_start(buffer):]
+
+    tail = buffer.strip()
+    if tail:
+        yield tail
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    """
+    Split text into overlapping chunks
+    """
+    return list(iter_chunks([text], chunk_size, overlap))
+
+
+def _find_break(buffer: str, chunk_size: int) -> int:
+    last_break = None
+    for match in _BREAK_RE.finditer(buffer, chunk_size // 2, chunk_size):
+        last_break = match.end()
+    if last_break:
+        return last_break
+
+    space = buffer.rfind(' ', chunk_size // 2, chunk_size)
+    return space + 1 if space != -1 else chunk_size
+
+
+def _find_word_start(buffer: str) -> int:
+    """
+    Skip a partial word left at the start of the overlap
+    """
+    space = buffer.find(' ', 0, 50)
+    return space + 1 if space != -1 else 0
@@ -0,0 +1,21 @@
+import os
+import signal
+import threading
+
+# This process runs its own pool below; the app must not start an embedded one
+os.environ['WEBHOOK_EMBEDDED_WORKERS'] = '0'
+
+from app import app  # noqa: E402
+from services.update_worker import UpdateWorkerPool  # noqa: E402
+
+if __name__ == '__main__':
+    # Standalone queue consumer; run web processes with WEBHOOK_EMBEDDED_WORKERS=0
+    pool = UpdateWorkerPool(app)
+    pool.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+
+    pool.stop()